@@ -1,13 +1,30 @@
 from django.contrib import admin
-from .models import UploadedFile, SeatAllotment, VisibilityWindow, AdminAuditLog
+from .models import UploadedFile, SeatAllotment, VisibilityWindow, AdminAuditLog, DataVersion, ParseCache, ParseJob
+from .allotment_index import allotments_changed
+
+
+class AllotmentsChangedMixin:
+    # Edits made through the Django admin must also refresh the student lookup index
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        allotments_changed()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        allotments_changed()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        allotments_changed()
 
 @admin.register(UploadedFile)
-class UploadedFileAdmin(admin.ModelAdmin):
-    list_display = ('id', 'file', 'uploaded_at', 'is_published', 'exam_date')
+class UploadedFileAdmin(AllotmentsChangedMixin, admin.ModelAdmin):
+    list_display = ('id', 'original_name', 'file', 'uploaded_at', 'is_published', 'exam_date')
     list_filter = ('is_published', 'uploaded_at')
+    search_fields = ('original_name', 'content_hash')
 
 @admin.register(SeatAllotment)
-class SeatAllotmentAdmin(admin.ModelAdmin):
+class SeatAllotmentAdmin(AllotmentsChangedMixin, admin.ModelAdmin):
     list_display = ('usn', 'subject_code', 'room_no', 'seat_no', 'exam_start_time', 'uploaded_file')
     search_fields = ('usn', 'room_no', 'course_code')
     list_filter = ('exam_start_time', 'room_no')
@@ -16,10 +33,34 @@ class SeatAllotmentAdmin(admin.ModelAdmin):
         return obj.course_code
 
 @admin.register(VisibilityWindow)
-class VisibilityWindowAdmin(admin.ModelAdmin):
+class VisibilityWindowAdmin(AllotmentsChangedMixin, admin.ModelAdmin):
     list_display = ('window_name', 'file', 'visible_from', 'visible_until', 'is_active_manual')
     list_filter = ('is_active_manual', 'visible_from')
 
+    def delete_queryset(self, request, queryset):
+        # Queryset deletes skip VisibilityWindow.delete(), so clear the denormalized bounds here
+        SeatAllotment.objects.filter(uploaded_file__visibility_window__in=queryset).update(
+            visible_from=None, visible_until=None, window_active=False
+        )
+        super().delete_queryset(request, queryset)
+
+@admin.register(DataVersion)
+class DataVersionAdmin(admin.ModelAdmin):
+    list_display = ('name', 'version', 'updated_at')
+
+@admin.register(ParseCache)
+class ParseCacheAdmin(admin.ModelAdmin):
+    list_display = ('content_hash', 'parser_version', 'created_at')
+    list_filter = ('parser_version',)
+    search_fields = ('content_hash',)
+    exclude = ('result',)
+
+@admin.register(ParseJob)
+class ParseJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'files_done', 'attempts', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    exclude = ('result',)
+
 @admin.register(AdminAuditLog)
 class AdminAuditLogAdmin(admin.ModelAdmin):
     list_display = ('timestamp', 'user', 'action', 'details')
@@ -0,0 +1,404 @@
+"""
+Per-worker in-memory index of the allotments students can currently see.
+
+The student API is read-heavy and spiky (everyone checks at window open), so
+instead of querying SeatAllotment on every request each worker keeps a dict of the visible allotments keyed by
+normalized USN.
+
+The index is rebuilt when:
+  * the shared DataVersion counter changes (publish, delete, window edits),
+    checked at most once every ALLOTMENT_INDEX_CHECK_INTERVAL seconds, or
+  * the clock passes the next visibility boundary (a visible window closes
+    or an upcoming one opens).
+
+A rebuild first looks for a snapshot of the same state (same state token) in
+ALLOTMENT_SNAPSHOT_DIR, written ahead of a window's opening by
+`manage.py warm_up_allotments`, so every worker loading the index at once
+when an exam opens reads one JSON file instead of querying the allotments.
+
+With the index disabled the rebuild still tracks the state (for ETags) and,
+with LOOKUP_BLOOM_ENABLED, a Bloom filter of the visible USNs (core.bloom)
+that turns most lookups of unknown USNs into 404s without a query.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .bloom import BloomFilter
+from .models import DataVersion, SeatAllotment, VisibilityWindow
+from .parser import normalize_usn
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'allotments'
+
+
+def serialize_allotment(usn, room_no, seat_no, course_code, exam_start_time):
+    # Get start time in local timezone (Asia/Kolkata check)
+    # Django handles timezone conversion if USE_TZ is True
+    localized_time = timezone.localtime(exam_start_time)
+    return {
+        "usn": usn,
+        "room": room_no,
+        "seat": seat_no,
+        "course_code": course_code or "N/A",
+        "exam_time": localized_time.isoformat(),
+    }
+
+
+def _visible_allotments(usn):
+    now = timezone.now()
+    # Single-table query on the denormalized window bounds (seat_usn_visibility_idx)
+    return SeatAllotment.objects.filter(
+        usn_normalized=normalize_usn(usn),
+        visible_from__lte=now,
+        visible_until__gte=now,
+        window_active=True
+    ).order_by('id').values_list('usn', 'room_no', 'seat_no', 'course_code', 'exam_start_time')
+
+
+def query_allotment(usn):
+    """Direct DB lookup, used when the in-memory index is disabled."""
+    row = _visible_allotments(usn).first()
+    return serialize_allotment(*row) if row else None
+
+
+async def aquery_allotment(usn):
+    row = await _visible_allotments(usn).afirst()
+    return serialize_allotment(*row) if row else None
+
+
+def query_allotments(usns):
+    """
+    Direct DB lookup of many normalized USNs in one IN query, same visibility
+    rules and lowest-id-wins as query_allotment. Returns {usn_normalized: allotment}.
+    """
+    now = timezone.now()
+    rows = SeatAllotment.objects.filter(
+        usn_normalized__in=usns,
+        visible_from__lte=now,
+        visible_until__gte=now,
+        window_active=True
+    ).order_by('id').values_list('usn_normalized', 'usn', 'room_no', 'seat_no', 'course_code', 'exam_start_time')
+
+    found = {}
+    for key, *row in rows:
+        if key not in found:
+            found[key] = serialize_allotment(*row)
+    return found
+
+
+def visible_windows(now):
+    """
+    Windows students can see at `now`, plus the next time that set changes
+    (a visible window closing or an upcoming one opening).
+    """
+    windows = VisibilityWindow.objects.filter(
+        is_active_manual=True, visible_until__gte=now
+    ).order_by('id').values('id', 'file_id', 'window_name', 'visible_from', 'visible_until')
+
+    visible, boundaries = [], []
+    for win in windows:
+        if win['visible_from'] <= now:
+            visible.append(win)
+            boundaries.append(win['visible_until'])
+        else:
+            boundaries.append(win['visible_from'])
+    return visible, (min(boundaries) if boundaries else None)
+
+
+def state_etag(token):
+    # ETag of every /api/allotment answer for a state token
+    return f'W/"{token}"'
+
+
+def state_token(version, windows):
+    """
+    Identifies what students can currently see. Identical in every worker for the
+    same data, so it doubles as the API ETag and the result shard generation name.
+    """
+    signature = json.dumps(
+        [version] + [[w['id'], w['visible_from'], w['visible_until']] for w in windows],
+        cls=DjangoJSONEncoder,
+    )
+    return hashlib.sha1(signature.encode()).hexdigest()[:16]
+
+
+def build_entries(file_ids):
+    """{usn_normalized: allotment} for the given uploads; the lowest id wins for duplicate USNs."""
+    entries = {}
+    rows = SeatAllotment.objects.filter(
+        uploaded_file_id__in=file_ids
+    ).order_by('id').values_list(
+        'usn_normalized', 'usn', 'room_no', 'seat_no', 'course_code', 'exam_start_time'
+    ).iterator(chunk_size=2000)
+    for key, *row in rows:
+        if key not in entries:
+            entries[key] = serialize_allotment(*row)
+    return entries
+
+
+def build_bloom(file_ids):
+    usns = set(SeatAllotment.objects.filter(
+        uploaded_file_id__in=file_ids
+    ).values_list('usn_normalized', flat=True).iterator(chunk_size=5000))
+    bloom = BloomFilter(len(usns), settings.LOOKUP_BLOOM_FP_RATE, settings.LOOKUP_BLOOM_MAX_BYTES)
+    for usn in usns:
+        bloom.add(usn)
+    return bloom
+
+
+def snapshot_path(token):
+    return os.path.join(settings.ALLOTMENT_SNAPSHOT_DIR, f"{token}.json")
+
+
+def write_snapshot(token, entries):
+    """Saves entries as the index for state token. Returns the file's path."""
+    os.makedirs(settings.ALLOTMENT_SNAPSHOT_DIR, exist_ok=True)
+    path = snapshot_path(token)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(entries, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_snapshot(token):
+    try:
+        with open(snapshot_path(token)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable allotment snapshot {token}: {e}")
+        return None
+
+
+class AllotmentIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._version = None
+        self._expires_at = None
+        self._checked_at = 0.0
+        self.token = None
+        self.built_at = None
+        self.bloom = None
+        self.bloom_checks = 0
+        self.bloom_rejected = 0
+        self.bloom_false_positives = 0
+
+    def lookup(self, usn):
+        self._ensure_fresh()
+        return self._counted(self._entries.get(normalize_usn(usn)))
+
+    def lookup_many(self, usns_normalized):
+        self._ensure_fresh()
+        entries = self._entries
+        found = {usn: entries[usn] for usn in usns_normalized if usn in entries}
+        metrics.LOOKUP_CACHE.inc(len(found), cache='index', result='hit')
+        metrics.LOOKUP_CACHE.inc(len(usns_normalized) - len(found), cache='index', result='miss')
+        return found
+
+    def state(self):
+        """(state token, next visibility boundary) without any SQL between version checks."""
+        self._ensure_fresh()
+        return self.token, self._expires_at
+
+    async def alookup(self, usn):
+        await self._aensure_fresh()
+        return self._counted(self._entries.get(normalize_usn(usn)))
+
+    def _counted(self, entry):
+        metrics.LOOKUP_CACHE.inc(cache='index', result='miss' if entry is None else 'hit')
+        return entry
+
+    async def astate(self):
+        await self._aensure_fresh()
+        return self.token, self._expires_at
+
+    def might_contain(self, usn_normalized):
+        """False only if usn_normalized is certainly not visible (see core.bloom); call state() first."""
+        bloom = self.bloom
+        if bloom is None:
+            return True
+        self.bloom_checks += 1
+        if usn_normalized in bloom:
+            metrics.LOOKUP_CACHE.inc(cache='bloom', result='passed')
+            return True
+        self.bloom_rejected += 1
+        metrics.LOOKUP_CACHE.inc(cache='bloom', result='rejected')
+        return False
+
+    def bloom_stats(self):
+        bloom = self.bloom
+        return {
+            'enabled': bloom is not None,
+            **(bloom.stats() if bloom is not None else {}),
+            'fp_rate_target': settings.LOOKUP_BLOOM_FP_RATE,
+            'checks': self.bloom_checks,
+            'rejected': self.bloom_rejected,
+            'false_positives': self.bloom_false_positives,
+        }
+
+    def invalidate(self):
+        # Forces a rebuild on the next lookup in this worker
+        with self._lock:
+            self._version = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _needs_version_check(self):
+        # True when the cheap in-memory checks cannot vouch for the index
+        if self._version is None:
+            return True
+        if self._expires_at is not None and timezone.now() > self._expires_at:
+            self._version = None
+            return True
+        return time.monotonic() - self._checked_at >= settings.ALLOTMENT_INDEX_CHECK_INTERVAL
+
+    def _version_changed(self, version):
+        self._checked_at = time.monotonic()
+        if version != self._version:
+            self._version = None
+        return self._version is None
+
+    def _is_stale(self):
+        if not self._needs_version_check():
+            return False
+        return self._version is None or self._version_changed(DataVersion.current(VERSION_KEY))
+
+    async def _ais_stale(self):
+        if not self._needs_version_check():
+            return False
+        return self._version is None or self._version_changed(await DataVersion.acurrent(VERSION_KEY))
+
+    def _ensure_fresh(self):
+        if self._is_stale():
+            self._rebuild_if_stale()
+
+    async def _aensure_fresh(self):
+        if await self._ais_stale():
+            await sync_to_async(self._rebuild_if_stale)()
+
+    def _rebuild_if_stale(self):
+        with self._lock:
+            # Another thread may have rebuilt while we waited for the lock
+            if self._version is None:
+                self._rebuild()
+
+    def _rebuild(self):
+        started = time.monotonic()
+        # Read the version first so a publish racing with the build is picked up next check
+        version = DataVersion.current(VERSION_KEY)
+        now = timezone.now()
+
+        windows, expires_at = visible_windows(now)
+        visible_files = [w['file_id'] for w in windows]
+
+        token = state_token(version, windows)
+
+        entries, source = {}, 'db'
+        # With the index disabled only the state (for ETags) is tracked, lookups go to the DB
+        if visible_files and settings.ALLOTMENT_INDEX_ENABLED:
+            entries = load_snapshot(token)
+            if entries is not None:
+                source = 'snapshot'
+            else:
+                entries = build_entries(visible_files)
+        bloom = None
+        if not settings.ALLOTMENT_INDEX_ENABLED and settings.LOOKUP_BLOOM_ENABLED:
+            bloom = build_bloom(visible_files)
+
+        self._entries = entries
+        self._version = version
+        self._expires_at = expires_at
+        self.token = token
+        self.bloom = bloom
+        self._checked_at = time.monotonic()
+        self.built_at = now
+        metrics.INDEX_REBUILDS.inc(source=source)
+        logger.info(
+            f"Allotment index rebuilt from {source}: {len(entries)} USNs from {len(visible_files)} windows "
+            f"(v{version}) in {(time.monotonic() - started) * 1000:.1f}ms"
+            + (f", Bloom filter of {bloom.count} USNs in {len(bloom.bits)} bytes" if bloom is not None else "")
+        )
+
+
+allotment_index = AllotmentIndex()
+
+
+# Direct DB lookups (index disabled) for the same USN and visibility state share
+# one query and one serialized body (core.singleflight)
+lookup_flight = SingleFlight(
+    name='lookup',
+    ttl=lambda: settings.LOOKUP_COALESCE_TTL,
+    max_keys=lambda: settings.LOOKUP_COALESCE_MAX_KEYS,
+)
+
+
+def _serialized(allotment):
+    if allotment is None:
+        if allotment_index.bloom is not None:
+            # The Bloom filter let this USN through
+            allotment_index.bloom_false_positives += 1
+            metrics.LOOKUP_CACHE.inc(cache='bloom', result='false_positive')
+        return None, None
+    return allotment, json.dumps(allotment, cls=DjangoJSONEncoder).encode()
+
+
+def lookup_allotment(usn):
+    """
+    (allotment or None, its JSON body or None). The body is only set for
+    coalesced DB lookups; the caller serializes index entries itself.
+    """
+    if settings.ALLOTMENT_INDEX_ENABLED:
+        return allotment_index.lookup(usn), None
+    # The state token in the key keeps cached results from outliving a publish or window change
+    key = (allotment_index.state()[0], normalize_usn(usn))
+    if not allotment_index.might_contain(key[1]):
+        return None, None
+    return lookup_flight.do(key, lambda: _serialized(query_allotment(usn)))
+
+
+def lookup_allotments(usns_normalized):
+    if settings.ALLOTMENT_INDEX_ENABLED:
+        return allotment_index.lookup_many(usns_normalized)
+    allotment_index.state()
+    wanted = [usn for usn in usns_normalized if allotment_index.might_contain(usn)]
+    return query_allotments(wanted) if wanted else {}
+
+
+async def alookup_allotment(usn):
+    if settings.ALLOTMENT_INDEX_ENABLED:
+        return await allotment_index.alookup(usn), None
+    key = ((await allotment_index.astate())[0], normalize_usn(usn))
+    if not allotment_index.might_contain(key[1]):
+        return None, None
+
+    async def query():
+        return _serialized(await aquery_allotment(usn))
+    return await lookup_flight.ado(key, query)
+
+
+def allotments_changed():
+    """Call after anything that changes what students can see."""
+    DataVersion.bump(VERSION_KEY)
+    allotment_index.invalidate()
+
+    if settings.RESULT_SHARDS_ENABLED:
+        from .result_shards import schedule_sync
+        # Rewriting and compressing the shards takes seconds: after the commit, in the background
+        transaction.on_commit(schedule_sync)
@@ -0,0 +1,39 @@
+"""
+ASGI routing for the student lookup API.
+
+Django runs each MiddlewareMixin-based middleware (sessions, CSRF, auth,
+messages, ...) through sync_to_async under ASGI, i.e. two thread hops per
+middleware per request. /api/allotment is anonymous, GET-only and needs none
+of them, so seat_allotment/asgi.py sends it to StudentApiHandler, a Django
+ASGIHandler whose chain is just STUDENT_API_MIDDLEWARE (all async-native).
+"""
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.exception import convert_exception_to_response
+from django.utils.module_loading import import_string
+
+
+class StudentApiHandler(ASGIHandler):
+    def load_middleware(self, is_async=False):
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        handler = convert_exception_to_response(self._get_response_async)
+        for middleware_path in reversed(settings.STUDENT_API_MIDDLEWARE):
+            middleware = import_string(middleware_path)
+            if not getattr(middleware, 'async_capable', False):
+                raise RuntimeError(f"{middleware_path} must be async capable to be used in STUDENT_API_MIDDLEWARE")
+            handler = convert_exception_to_response(middleware(handler))
+        self._middleware_chain = handler
+
+
+def route_student_api(django_application):
+    student_api = StudentApiHandler()
+
+    async def application(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == '/api/allotment':
+            return await student_api(scope, receive, send)
+        return await django_application(scope, receive, send)
+
+    return application
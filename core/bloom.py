@@ -0,0 +1,52 @@
+"""
+Bloom filter of the USNs students can currently see.
+
+With the in-memory index disabled every student lookup goes to the database,
+including the typos and early checks that can only 404. AllotmentIndex
+builds this filter whenever it refreshes its state (publish, delete, window
+edits, a window opening or closing), and a USN the filter has never seen is
+answered as not found without a query. A USN it has seen is only "maybe":
+at most about fp_rate of unknown USNs still reach the database.
+
+Sized for the number of USNs and LOOKUP_BLOOM_FP_RATE, capped at
+LOOKUP_BLOOM_MAX_BYTES (a capped filter has a higher false-positive rate,
+reported by stats()).
+"""
+import hashlib
+import math
+
+
+class BloomFilter:
+    def __init__(self, capacity, fp_rate, max_bytes):
+        capacity = max(capacity, 1)
+        bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        self.size = max(8, min(bits, max_bytes * 8))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing over one 128-bit digest (Kirsch & Mitzenmacher)
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def expected_fp_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def stats(self):
+        return {
+            'usns': self.count,
+            'bytes': len(self.bits),
+            'hashes': self.hashes,
+            'expected_fp_rate': round(self.expected_fp_rate(), 6),
+        }
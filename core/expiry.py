@@ -0,0 +1,202 @@
+"""
+Expiry of old data, run by `manage.py expire_allotments` (cron) or
+periodically by the parse worker, never on a request.
+
+  * Uploads whose visibility window closed more than EXPIRY_GRACE_HOURS ago
+    are deleted with their allotments, window, raw rows and staging rows.
+    Allotments go first in transactions of at most `batch_size` rows, then the
+    uploads themselves, so no single transaction (or SQLite write lock) grows
+    with the amount of expired data.
+  * Staging batches nobody published within STAGING_BATCH_MAX_AGE_HOURS are
+    deleted the same way.
+  * Cached parse results (ParseCache, full parser output with every USN) live
+    as long as an upload with the same content hash does, and only for the
+    current PARSER_VERSION. Finished parse jobs go once none of their uploads
+    is left and the uploader has seen the outcome (or it is older than
+    STAGING_BATCH_MAX_AGE_HOURS): a failed job has no uploads from the start.
+  * Files under uploads/ that no UploadedFile references any more are removed
+    from storage. Identical uploads share one stored file (core.uploads), so
+    a file is only orphaned once its last upload is gone. Files younger than
+    ORPHAN_FILE_MIN_AGE_SECONDS are skipped: an upload in flight saves its file,
+    or touches the stored copy it reuses, just before creating its
+    UploadedFile. Both checks are repeated right before each file is removed.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .allotment_index import allotments_changed
+from .models import AdminAuditLog, ParseCache, ParseJob, SeatAllotment, StagingBatch, StagingRecord, UploadedFile
+from .parser import PARSER_VERSION
+from .uploads import UPLOAD_DIR
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_PER_TRANSACTION = 50
+
+
+def _delete_in_batches(queryset, batch_size):
+    """Deletes queryset's rows at most batch_size per transaction. Returns the number deleted."""
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            queryset.model.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+def expired_upload_ids(now=None):
+    cutoff = (now or timezone.now()) - timedelta(hours=settings.EXPIRY_GRACE_HOURS)
+    return list(UploadedFile.objects.filter(visibility_window__visible_until__lt=cutoff).values_list('id', flat=True))
+
+
+def expire_uploads(upload_ids, batch_size):
+    """Deletes the given uploads and everything hanging off them. Returns (uploads, allotments) deleted."""
+    allotments = _delete_in_batches(SeatAllotment.objects.filter(uploaded_file_id__in=upload_ids), batch_size)
+    _delete_in_batches(StagingRecord.objects.filter(page__upload_id__in=upload_ids), batch_size)
+    uploads = 0
+    for start in range(0, len(upload_ids), UPLOADS_PER_TRANSACTION):
+        with transaction.atomic():
+            # Windows, raw rows and staging pages cascade; the big tables are empty by now
+            _, per_model = UploadedFile.objects.filter(id__in=upload_ids[start:start + UPLOADS_PER_TRANSACTION]).delete()
+        uploads += per_model.get(UploadedFile._meta.label, 0)
+    return uploads, allotments
+
+
+def expire_staging_batches(batch_size, now=None):
+    """Deletes staging batches older than STAGING_BATCH_MAX_AGE_HOURS. Returns the number deleted."""
+    cutoff = (now or timezone.now()) - timedelta(hours=settings.STAGING_BATCH_MAX_AGE_HOURS)
+    batch_ids = list(StagingBatch.objects.filter(created_at__lt=cutoff).values_list('id', flat=True))
+    if not batch_ids:
+        return 0
+    _delete_in_batches(StagingRecord.objects.filter(page__batch_id__in=batch_ids), batch_size)
+    with transaction.atomic():
+        StagingBatch.objects.filter(id__in=batch_ids).delete()
+    return len(batch_ids)
+
+
+def unreferenced_parse_cache():
+    """ParseCache rows no upload can use: no UploadedFile has their hash, or an older parser made them."""
+    hashes = UploadedFile.objects.exclude(content_hash='').values('content_hash')
+    return ParseCache.objects.exclude(content_hash__in=hashes, parser_version=PARSER_VERSION)
+
+
+def finished_jobs_without_uploads(now=None):
+    """Ids of seen or old done/failed ParseJobs none of whose uploads exist any more."""
+    cutoff = (now or timezone.now()) - timedelta(hours=settings.STAGING_BATCH_MAX_AGE_HOURS)
+    existing = set(UploadedFile.objects.values_list('id', flat=True))
+    jobs = ParseJob.objects.filter(
+        Q(seen_at__isnull=False) | Q(finished_at__lt=cutoff), status__in=[ParseJob.DONE, ParseJob.FAILED],
+    ).values_list('id', 'files')
+    return [
+        job_id for job_id, files in jobs.iterator()
+        if not any(f['upload_id'] in existing for f in files)
+    ]
+
+
+def expire_parse_jobs(batch_size, now=None):
+    """Deletes finished parse jobs whose uploads are all gone. Returns the number deleted."""
+    job_ids = finished_jobs_without_uploads(now)
+    for start in range(0, len(job_ids), batch_size):
+        with transaction.atomic():
+            ParseJob.objects.filter(id__in=job_ids[start:start + batch_size]).delete()
+    return len(job_ids)
+
+
+def orphaned_files(now=None):
+    """[(name, size)] of files under uploads/ no UploadedFile points at."""
+    try:
+        _, names = default_storage.listdir(UPLOAD_DIR)
+    except FileNotFoundError:
+        return []
+    referenced = set(UploadedFile.objects.filter(file__startswith=f"{UPLOAD_DIR}/").values_list('file', flat=True))
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.ORPHAN_FILE_MIN_AGE_SECONDS)
+    orphans = []
+    for name in names:
+        path = f"{UPLOAD_DIR}/{name}"
+        if path in referenced or default_storage.get_modified_time(path) > cutoff:
+            continue
+        orphans.append((path, default_storage.size(path)))
+    return orphans
+
+
+def _still_orphaned(path, cutoff):
+    # An upload may have reused the file since orphaned_files listed it
+    if UploadedFile.objects.filter(file=path).exists():
+        return False
+    try:
+        return default_storage.get_modified_time(path) <= cutoff
+    except FileNotFoundError:
+        return False
+
+
+def run_expiry(batch_size=None, dry_run=False, remove_files=True):
+    """
+    One expiry pass. Returns a report dict: uploads, allotments, staging_batches,
+    parse_cache, parse_jobs, files, file_bytes and seconds (with dry_run, what would have been deleted).
+    """
+    batch_size = batch_size or settings.EXPIRY_BATCH_SIZE
+    started = time.monotonic()
+    now = timezone.now()
+    upload_ids = expired_upload_ids(now)
+
+    if dry_run:
+        staging_cutoff = now - timedelta(hours=settings.STAGING_BATCH_MAX_AGE_HOURS)
+        # Files of expiring uploads only become orphans once the uploads are gone
+        orphans = orphaned_files(now) if remove_files else []
+        report = {
+            'uploads': len(upload_ids),
+            'allotments': SeatAllotment.objects.filter(uploaded_file_id__in=upload_ids).count(),
+            'staging_batches': StagingBatch.objects.filter(created_at__lt=staging_cutoff).count(),
+            # Rows of the expiring uploads' hashes are only unreferenced once the uploads are gone
+            'parse_cache': unreferenced_parse_cache().count(),
+            'parse_jobs': len(finished_jobs_without_uploads(now)),
+            'files': len(orphans),
+            'file_bytes': sum(size for _, size in orphans),
+        }
+    else:
+        uploads, allotments = expire_uploads(upload_ids, batch_size) if upload_ids else (0, 0)
+        staging_batches = expire_staging_batches(batch_size, now)
+        # After the uploads, so hashes only they used are no longer referenced
+        parse_cache = _delete_in_batches(unreferenced_parse_cache(), batch_size)
+        parse_jobs = expire_parse_jobs(batch_size, now)
+        files = file_bytes = 0
+        if remove_files:
+            cutoff = now - timedelta(seconds=settings.ORPHAN_FILE_MIN_AGE_SECONDS)
+            for path, size in orphaned_files(now):
+                if not _still_orphaned(path, cutoff):
+                    continue
+                try:
+                    default_storage.delete(path)
+                except OSError as e:
+                    logger.warning(f"Could not remove orphaned upload {path}: {e}")
+                    continue
+                files += 1
+                file_bytes += size
+        if uploads:
+            allotments_changed()
+            AdminAuditLog.objects.create(
+                user=None, action='DELETE', details=f"Expired {uploads} uploads ({allotments} allotments)",
+            )
+        report = {
+            'uploads': uploads,
+            'allotments': allotments,
+            'staging_batches': staging_batches,
+            'parse_cache': parse_cache,
+            'parse_jobs': parse_jobs,
+            'files': files,
+            'file_bytes': file_bytes,
+        }
+
+    report['seconds'] = round(time.monotonic() - started, 3)
+    if not dry_run and any(report[key] for key in ('uploads', 'staging_batches', 'parse_cache', 'parse_jobs', 'files')):
+        logger.info(f"Expiry: {report}")
+    return report
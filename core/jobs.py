@@ -0,0 +1,182 @@
+"""
+DB-backed queue for parsing uploads outside the HTTP request.
+
+upload_file stores the files and enqueues a ParseJob. With PARSE_JOBS_MODE =
+'background' a worker (manage.py run_parse_worker) claims it, parses the
+files with core.uploads.parse_uploads and stages the pages (core.staging).
+The dashboard polls parse_job_status and opens the preview once the job is
+done. There is no broker: the ParseJob table is the queue, so queued jobs
+survive restarts.
+
+Claiming is a conditional UPDATE (only while the job is still queued), so two
+workers never run the same job. While a job runs a heartbeat thread keeps
+heartbeat_at fresh. A running job whose heartbeat is older than
+PARSE_JOB_STALE_SECONDS belonged to a worker that died or was restarted: it is
+queued again, or failed once it has used PARSE_JOB_MAX_ATTEMPTS attempts.
+Unexpected errors are retried the same way, after PARSE_JOB_RETRY_DELAY
+seconds (doubling per attempt). A file the parser cannot read is not retried:
+its error is reported next to the other files' pages, as the upload view did
+before.
+
+With PARSE_JOBS_MODE = 'inline', the default, the upload request runs its own
+job, so deployments without a worker process still parse uploads.
+"""
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ParseJob, UploadedFile
+from .staging import stage_results
+from .uploads import parse_uploads
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_parse_job(user, uploads):
+    return ParseJob.objects.create(
+        user=user,
+        files=[{'upload_id': upload.id, 'filename': upload.filename()} for upload in uploads],
+    )
+
+
+def claim_job(worker, job_id=None):
+    """Takes the oldest runnable queued job (or job_id) for worker; None if there is none."""
+    now = timezone.now()
+    queued = ParseJob.objects.filter(status=ParseJob.QUEUED, run_after__lte=now)
+    if job_id is not None:
+        queued = queued.filter(id=job_id)
+    for candidate in queued.order_by('id').values_list('id', flat=True)[:5]:
+        # Only one worker's UPDATE can still see the job as queued
+        claimed = ParseJob.objects.filter(id=candidate, status=ParseJob.QUEUED).update(
+            status=ParseJob.RUNNING, worker=worker, heartbeat_at=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return ParseJob.objects.defer('result').get(id=candidate)
+    return None
+
+
+def reclaim_stale_jobs():
+    """Re-queues (or fails, when out of attempts) running jobs whose worker stopped sending heartbeats."""
+    now = timezone.now()
+    stale = ParseJob.objects.filter(
+        status=ParseJob.RUNNING,
+        heartbeat_at__lt=now - timedelta(seconds=settings.PARSE_JOB_STALE_SECONDS),
+    )
+    failed = stale.filter(attempts__gte=settings.PARSE_JOB_MAX_ATTEMPTS).update(
+        status=ParseJob.FAILED, error='The worker parsing this upload stopped responding.', finished_at=now,
+    )
+    requeued = stale.update(status=ParseJob.QUEUED, worker='', run_after=now)
+    if failed or requeued:
+        logger.warning(f"Stale parse jobs: {requeued} re-queued, {failed} failed")
+    return requeued, failed
+
+
+def _owned(job, worker):
+    # Updates only land while this worker still holds the job; after a stale
+    # reclaim another worker owns it and this one's results are dropped
+    return ParseJob.objects.filter(id=job.id, status=ParseJob.RUNNING, worker=worker)
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, job, worker):
+        super().__init__(name=f"parse-job-{job.id}-heartbeat", daemon=True)
+        self.job = job
+        self.worker = worker
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.PARSE_JOB_HEARTBEAT_SECONDS):
+                _owned(self.job, self.worker).update(heartbeat_at=timezone.now())
+        except Exception:
+            logger.exception(f"Heartbeat for parse job {self.job.id} failed")
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(job, worker):
+    """Parses a claimed job's files and records the outcome on the job."""
+    uploads = UploadedFile.objects.in_bulk([entry['upload_id'] for entry in job.files])
+    files = [(entry, uploads[entry['upload_id']]) for entry in job.files if entry['upload_id'] in uploads]
+    errors = [f"{entry['filename']} was deleted before it was parsed"
+              for entry in job.files if entry['upload_id'] not in uploads]
+    skipped = len(errors)
+
+    def progress(done, total):
+        _owned(job, worker).update(files_done=skipped + done, heartbeat_at=timezone.now())
+
+    heartbeat = _Heartbeat(job, worker)
+    heartbeat.start()
+    try:
+        results = parse_uploads([upload for _, upload in files], progress)
+    except Exception as e:
+        logger.exception(f"Parse job {job.id} failed (attempt {job.attempts})")
+        _retry_or_fail(job, worker, e)
+        return
+    finally:
+        heartbeat.stop()
+
+    parsed = []
+    for (entry, upload), result in zip(files, results):
+        if result.get('error'):
+            errors.append(f"Error parsing {entry['filename']}: {result['error']}")
+            upload.delete()
+            continue
+        parsed.append((upload, result.get('pages', [])))
+
+    finished = {'files_done': len(job.files), 'finished_at': timezone.now()}
+    if any(pages for _, pages in parsed):
+        try:
+            with transaction.atomic():
+                batch = stage_results(job.user, parsed)
+                updated = _owned(job, worker).update(
+                    status=ParseJob.DONE, result={'batch_id': batch.id, 'errors': errors}, **finished,
+                )
+                if not updated:
+                    transaction.set_rollback(True)
+        except Exception as e:
+            logger.exception(f"Staging parse job {job.id} failed (attempt {job.attempts})")
+            _retry_or_fail(job, worker, e)
+            return
+    else:
+        updated = _owned(job, worker).update(
+            status=ParseJob.FAILED, error='\n'.join(errors) or 'No seating data found in the uploaded files.',
+            **finished,
+        )
+    if not updated:
+        logger.warning(f"Parse job {job.id} was reclaimed from {worker}; dropped its result")
+
+
+def _retry_or_fail(job, worker, error):
+    retry = settings.PARSE_JOBS_MODE == 'background' and job.attempts < settings.PARSE_JOB_MAX_ATTEMPTS
+    if retry:
+        delay = settings.PARSE_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        _owned(job, worker).update(
+            status=ParseJob.QUEUED, worker='', error=str(error),
+            run_after=timezone.now() + timedelta(seconds=delay),
+        )
+    else:
+        _owned(job, worker).update(status=ParseJob.FAILED, error=str(error), finished_at=timezone.now())
+
+
+def run_inline(job):
+    """Runs a freshly enqueued job in the current process (PARSE_JOBS_MODE = 'inline')."""
+    worker = worker_name()
+    claimed = claim_job(worker, job_id=job.id)
+    if claimed is not None:
+        run_job(claimed, worker)
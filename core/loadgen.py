@@ -0,0 +1,256 @@
+"""
+Minimal asyncio HTTP/1.1 load generator used by the benchmark commands.
+
+Keeps one keep-alive connection per simulated client (reconnecting when the
+server closes it, as gunicorn sync workers do) so thousands of concurrent
+clients can be driven from a single process without extra dependencies.
+"""
+import asyncio
+import itertools
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class LoadResult:
+    label: str
+    concurrency: int
+    elapsed: float = 0.0
+    latencies: list = field(default_factory=list)
+    statuses: dict = field(default_factory=dict)
+    errors: int = 0
+    # Values of the response header named by run_load(..., collect_header=...)
+    header_values: list = field(default_factory=list)
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+    def summary(self):
+        return {
+            "label": self.label,
+            "concurrency": self.concurrency,
+            "requests": self.requests,
+            "errors": self.errors,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "elapsed_s": round(self.elapsed, 3),
+            "throughput_rps": round(self.requests / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p95_ms": round(self.percentile(95) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "mean_ms": round(statistics.fmean(self.latencies) * 1000, 2) if self.latencies else 0.0,
+        }
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif status not in (204, 304):
+        await reader.read()
+        headers['connection'] = 'close'
+    return status, headers
+
+
+async def _client(host, port, next_request, result, deadline, collect_header):
+    reader = writer = None
+    while time.monotonic() < deadline:
+        request = next_request()
+        if request is None:
+            break
+        path, extra_headers, *body = request
+        body = body[0] if body else None
+        lines = [f"{'POST' if body is not None else 'GET'} {path} HTTP/1.1", f"Host: {host}:{port}"]
+        lines += [f"{name}: {value}" for name, value in extra_headers.items()]
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode() + (body or b'')
+
+        started = time.monotonic()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(payload)
+            await writer.drain()
+            status, headers = await _read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            result.errors += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+
+        result.latencies.append(time.monotonic() - started)
+        result.statuses[status] = result.statuses.get(status, 0) + 1
+        if collect_header and collect_header in headers:
+            result.header_values.append(headers[collect_header])
+        if headers.get('connection', '').lower() == 'close':
+            writer.close()
+            reader = writer = None
+
+    if writer is not None:
+        writer.close()
+
+
+def run_load(host, port, make_request, concurrency, total_requests=None, duration=None,
+             label='', collect_header=None):
+    """
+    Drive `concurrency` clients against host:port. make_request(i) returns
+    (path, headers) for the i-th request, or (path, headers, body) to POST. Stops after total_requests requests
+    or `duration` seconds, whichever comes first.
+    """
+    result = LoadResult(label=label, concurrency=concurrency)
+    counter = iter(range(total_requests)) if total_requests else itertools.count()
+    header = collect_header.lower() if collect_header else None
+
+    def next_request():
+        i = next(counter, None)
+        return None if i is None else make_request(i)
+
+    async def main():
+        deadline = time.monotonic() + (duration or 3600)
+        started = time.monotonic()
+        await asyncio.gather(*(
+            _client(host, port, next_request, result, deadline, header) for _ in range(concurrency)
+        ))
+        result.elapsed = time.monotonic() - started
+
+    asyncio.run(main())
+    return result
+
+
+def lookup_plan(usns, count, miss_ratio=0.1, seed=42):
+    """`count` USNs to look up: random known ones, with `miss_ratio` of them unknown."""
+    rng = random.Random(seed)
+    return [
+        f'NOPE{i:06d}' if rng.random() < miss_ratio else rng.choice(usns)
+        for i in range(count)
+    ]
+
+
+def client_ip(i):
+    # Distinct X-Forwarded-For per request so the per-IP rate limit is exercised but never trips
+    return f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+
+def visible_usns(limit):
+    """Up to `limit` distinct USNs students can currently look up."""
+    from django.utils import timezone
+    from .models import SeatAllotment
+
+    now = timezone.now()
+    return list(SeatAllotment.objects.filter(
+        window_active=True, visible_from__lte=now, visible_until__gte=now
+    ).values_list('usn_normalized', flat=True).distinct()[:limit])
+
+
+def lookup_requests(plan):
+    """make_request for run_load: GET /api/allotment for each USN of `plan`, cycling through it."""
+    def make_request(i):
+        return f"/api/allotment?usn={plan[i % len(plan)]}", {'X-Forwarded-For': client_ip(i)}
+    return make_request
+
+
+def warm_up(server, make_request):
+    # Every worker builds its index and opens its DB connections before anything is measured
+    run_load('127.0.0.1', server.port, make_request, concurrency=server.workers * 4,
+             total_requests=server.workers * 50)
+
+
+def format_summary(summary):
+    """One line of LoadResult.summary() for command output."""
+    return (
+        f"{summary['throughput_rps']:>9} req/s  p50 {summary['p50_ms']}ms  "
+        f"p95 {summary['p95_ms']}ms  p99 {summary['p99_ms']}ms"
+    )
+
+
+SERVER_PROFILES = {
+    # Matches the Procfile: gunicorn with sync workers
+    'wsgi': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', 'seat_allotment.wsgi',
+        '-w', str(workers), '-b', f'127.0.0.1:{port}', '--log-level', 'warning',
+    ],
+    # Matches start_asgi.sh: uvicorn running the async student lookup
+    'asgi': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', 'seat_allotment.asgi:application',
+        '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port),
+        '--no-access-log', '--log-level', 'warning',
+    ],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LocalServer:
+    """Runs one of SERVER_PROFILES on a free local port for the duration of a with block."""
+
+    def __init__(self, profile, workers=2, env=None, startup_timeout=30):
+        self.profile = profile
+        self.workers = workers
+        self.port = free_port()
+        # Private rate limit table so counts from earlier runs never leak into this one
+        fd, self.rate_limit_file = tempfile.mkstemp(prefix='loadgen-ratelimit-')
+        os.close(fd)
+        self.env = {**os.environ, 'RATE_LIMIT_FILE': self.rate_limit_file, **(env or {})}
+        self.startup_timeout = startup_timeout
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(SERVER_PROFILES[self.profile](self.port, self.workers), env=self.env)
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.profile} server exited with code {self.process.returncode}")
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=0.5).close()
+                return self
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError(f"{self.profile} server did not start within {self.startup_timeout}s")
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if os.path.exists(self.rate_limit_file):
+            os.remove(self.rate_limit_file)
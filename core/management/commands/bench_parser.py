@@ -0,0 +1,148 @@
+"""
+Management command benchmarking the seating plan parser on synthetic .docx
+files (core.synthetic.write_seating_docx) of increasing size.
+
+For each size it reports parse time (best and median of --repeat runs), peak
+RSS of a fresh interpreter that parses the file once, and records/second. The
+RSS includes lxml's C allocations, which tracemalloc cannot see; the baseline
+RSS of the same interpreter without a parse is printed first for comparison.
+The tracemalloc peak of one traced run (measured separately because tracing
+slows parsing down) is kept as a secondary figure for Python objects only.
+
+It also checks that every generated record came back with the right room, so a
+faster parser that drops rows shows up as a failure instead of a speedup.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from core.synthetic import exam_plans, write_seating_docx
+
+# Run in a child interpreter: set up Django, parse argv[2] with the function at
+# argv[1] (or only start up when argv[1] is empty, for the baseline), then print
+# the process's peak RSS in bytes. Linux's VmHWM starts over at exec; ru_maxrss
+# there keeps the high-water mark the forking parent had, so it is the fallback
+_CHILD = """
+import resource, sys, django
+django.setup()
+from django.utils.module_loading import import_string
+if sys.argv[1]:
+    import_string(sys.argv[1])(sys.argv[2])
+try:
+    with open('/proc/self/status') as f:
+        peak = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM:'))
+except (OSError, StopIteration):
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+print(peak)
+"""
+
+
+def peak_rss(parser_path, file_path=''):
+    """Peak resident set size in bytes of a fresh interpreter parsing file_path."""
+    child = subprocess.run(
+        [sys.executable, '-c', _CHILD, parser_path, file_path],
+        cwd=settings.BASE_DIR, capture_output=True, text=True,
+    )
+    if child.returncode:
+        raise CommandError(f"Measuring {file_path or 'the baseline'} failed:\n{child.stderr.strip()}")
+    return int(child.stdout.split()[-1])
+
+
+def megabytes(size):
+    return round(size / 1024 / 1024, 2)
+
+
+class Command(BaseCommand):
+    help = 'Measures parse time, peak memory and records/sec of the .docx parser per file size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='300,3000,15000', help='Comma separated students per file')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per size')
+        parser.add_argument('--seats-per-room', type=int, default=30)
+        parser.add_argument('--corpus-dir', default=None,
+                            help='Where to write/reuse the generated files (default: a temp dir)')
+        parser.add_argument('--parser', default='core.parser.parse_exam_file_wrapper',
+                            help='Dotted path of the parse function to benchmark')
+        parser.add_argument('--output', default=None, help='Also write the results as JSON here')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be a comma separated list of integers')
+        parse = import_string(options['parser'])
+        corpus_dir = options['corpus_dir'] or tempfile.mkdtemp(prefix='parser-corpus-')
+        os.makedirs(corpus_dir, exist_ok=True)
+
+        baseline = megabytes(peak_rss(''))
+        self.stdout.write(f"baseline RSS {baseline} MB (interpreter and Django, no parse)")
+        results = []
+        failed = []
+        for size in sizes:
+            path = os.path.join(corpus_dir, f"seating_{size}_{options['seats_per_room']}.docx")
+            _, pages = next(exam_plans(1, size, seats_per_room=options['seats_per_room']))
+            if not os.path.exists(path):
+                write_seating_docx(pages, path)
+
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                parsed = parse(path)
+                timings.append(time.perf_counter() - started)
+
+            tracemalloc.start()
+            parse(path)
+            _, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            rss = peak_rss(options['parser'], path)
+
+            problem = self.compare(pages, parsed)
+            if problem is not None:
+                failed.append(size)
+            median = statistics.median(timings)
+            result = {
+                'students': size,
+                'pages': len(pages),
+                'file_kb': round(os.path.getsize(path) / 1024, 1),
+                'best_s': round(min(timings), 4),
+                'median_s': round(median, 4),
+                'peak_rss_mb': megabytes(rss),
+                'tracemalloc_peak_mb': megabytes(traced_peak),
+                'records_per_s': round(size / median),
+                'error': problem,
+            }
+            results.append(result)
+            self.stdout.write(
+                f"{size:>7} students  {result['pages']:>4} pages  {result['file_kb']:>8} KB  "
+                f"best {result['best_s']:.3f}s  median {result['median_s']:.3f}s  "
+                f"peak RSS {result['peak_rss_mb']} MB (tracemalloc {result['tracemalloc_peak_mb']} MB)  "
+                f"{result['records_per_s']} rec/s"
+                + (f"  MISMATCH: {problem}" if problem else '')
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'parser': options['parser'], 'corpus_dir': corpus_dir, 'baseline_rss_mb': baseline, 'results': results,
+                }, f, indent=2)
+            self.stdout.write(f"Saved results to {options['output']}")
+        if failed:
+            raise CommandError(f"Parsed records did not match for {', '.join(map(str, failed))} students")
+
+    def compare(self, pages, parsed):
+        if parsed.get('error'):
+            return parsed['error']
+        expected = [(page['room'], record['usn'], record['seat']) for page in pages for record in page['records']]
+        got = [(page['room'], record['usn'], record['seat']) for page in parsed['pages'] for record in page['records']]
+        if got != expected:
+            return f"expected {len(expected)} records, got {len(got)} ({sum(a != b for a, b in zip(expected, got))} differ)"
+        return None
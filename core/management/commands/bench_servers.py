@@ -0,0 +1,59 @@
+"""
+Management command comparing the sync WSGI deployment (gunicorn sync workers)
+with the ASGI profile (uvicorn + async student lookup) under concurrent load.
+
+Both servers are started locally against the configured database, and the
+same mix of known and unknown USNs is sent to /api/allotment. Each request
+uses its own X-Forwarded-For so the per-IP rate limit does not cut the run short.
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.loadgen import (
+    SERVER_PROFILES, LocalServer, format_summary, lookup_plan, lookup_requests, run_load, visible_usns, warm_up,
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks /api/allotment under sync WSGI vs ASGI using local test servers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default='wsgi,asgi',
+                            help=f"Comma separated: {', '.join(sorted(SERVER_PROFILES))}")
+        parser.add_argument('--workers', type=int, default=2, help='Server worker processes')
+        parser.add_argument('--concurrency', type=int, default=200, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=5000, help='Requests per profile')
+        parser.add_argument('--miss-ratio', type=float, default=0.1, help='Fraction of unknown USNs')
+        parser.add_argument('--no-index', action='store_true',
+                            help='Disable the in-memory index so every lookup hits the DB')
+
+    def handle(self, *args, **options):
+        # Checked before any server starts, not when the loop reaches a bad name
+        profiles = [profile.strip() for profile in options['profiles'].split(',') if profile.strip()]
+        unknown = [profile for profile in profiles if profile not in SERVER_PROFILES]
+        if unknown or not profiles:
+            raise CommandError(
+                (f"Unknown profile(s) {', '.join(unknown)}" if unknown else "No profile given")
+                + f"; choose from {', '.join(sorted(SERVER_PROFILES))}"
+            )
+
+        usns = visible_usns(5000)
+        if not usns:
+            raise CommandError('No visible allotments to look up; publish a window first')
+
+        make_request = lookup_requests(lookup_plan(usns, options['requests'], options['miss_ratio']))
+        env = {'ALLOTMENT_INDEX_ENABLED': 'False' if options['no_index'] else 'True'}
+        summaries = []
+        for profile in profiles:
+            with LocalServer(profile, workers=options['workers'], env=env) as server:
+                warm_up(server, make_request)
+                result = run_load('127.0.0.1', server.port, make_request, label=profile,
+                                  concurrency=options['concurrency'], total_requests=options['requests'])
+            summary = result.summary()
+            summaries.append(summary)
+            self.stdout.write(
+                f"{profile:5} {format_summary(summary)}  errors {summary['errors']}  statuses {summary['statuses']}"
+            )
+
+        self.stdout.write(json.dumps(summaries, indent=2))
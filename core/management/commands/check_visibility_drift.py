@@ -0,0 +1,61 @@
+"""
+Management command to detect drift between VisibilityWindow and the window
+bounds denormalized onto SeatAllotment (visible_from/visible_until/window_active).
+Fails (CommandError, non-zero exit) when drift is found and --fix was not given,
+so it can run from cron.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from core.models import SeatAllotment, VisibilityWindow
+from core.allotment_index import allotments_changed
+
+
+class Command(BaseCommand):
+    help = 'Checks SeatAllotment visibility columns against their VisibilityWindow'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Re-sync drifted rows from their window')
+
+    def handle(self, *args, **options):
+        window = 'uploaded_file__visibility_window__'
+
+        # Rows whose file has a window but whose copied bounds disagree with it
+        mismatched = SeatAllotment.objects.filter(
+            **{f'{window}isnull': False}
+        ).filter(
+            Q(visible_from__isnull=True) | ~Q(visible_from=F(f'{window}visible_from')) |
+            Q(visible_until__isnull=True) | ~Q(visible_until=F(f'{window}visible_until')) |
+            ~Q(window_active=F(f'{window}is_active_manual'))
+        )
+        # Rows that still look visible although their file has no window any more
+        orphaned = SeatAllotment.objects.filter(**{f'{window}isnull': True}).filter(
+            Q(visible_from__isnull=False) | Q(visible_until__isnull=False) | Q(window_active=True)
+        )
+
+        drifted_files = list(
+            mismatched.values_list('uploaded_file_id', flat=True).distinct().order_by('uploaded_file_id')
+        )
+        mismatched_count = mismatched.count()
+        orphaned_count = orphaned.count()
+
+        if not mismatched_count and not orphaned_count:
+            self.stdout.write(self.style.SUCCESS('No drift: allotment visibility matches all windows'))
+            return
+
+        drift = (
+            f'{mismatched_count} rows disagree with their window (files: {drifted_files}), '
+            f'{orphaned_count} rows visible without a window'
+        )
+        if not options['fix']:
+            raise CommandError(f'{drift}; run with --fix to re-sync them')
+        self.stdout.write(self.style.WARNING(drift))
+
+        synced = 0
+        for win in VisibilityWindow.objects.filter(file_id__in=drifted_files):
+            synced += win.sync_allotments()
+        cleared = SeatAllotment.objects.filter(pk__in=orphaned.values('pk')).update(
+            visible_from=None, visible_until=None, window_active=False
+        )
+        allotments_changed()
+        self.stdout.write(self.style.SUCCESS(f'Re-synced {synced} rows, cleared {cleared} orphaned rows'))
@@ -0,0 +1,38 @@
+"""
+Management command removing expired data (core.expiry): uploads whose
+visibility window has closed, previews never published, and cached parse
+results, finished parse jobs and upload files nothing references any more.
+
+Meant for cron. The parse worker (run_parse_worker) also runs it every
+EXPIRY_INTERVAL_SECONDS, but with the default PARSE_JOBS_MODE = 'inline' no
+worker is started, so nothing expires unless this command is scheduled.
+"""
+from django.core.management.base import BaseCommand
+
+from core.expiry import run_expiry
+
+
+def format_report(report, dry_run=False):
+    verb = 'Would delete' if dry_run else 'Deleted'
+    return (
+        f"{verb} {report['uploads']} expired uploads ({report['allotments']} allotments), "
+        f"{report['staging_batches']} stale previews, {report['parse_cache']} cached parse results, "
+        f"{report['parse_jobs']} finished parse jobs and {report['files']} orphaned files "
+        f"({report['file_bytes'] / 1024:.1f} KB) in {report['seconds']}s"
+    )
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired uploads and allotments, stale previews, unused parse results and orphaned upload files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows deleted per transaction (default EXPIRY_BATCH_SIZE)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+        parser.add_argument('--skip-files', action='store_true', help='Leave orphaned upload files in storage')
+
+    def handle(self, *args, **options):
+        report = run_expiry(
+            batch_size=options['batch_size'], dry_run=options['dry_run'], remove_files=not options['skip_files'],
+        )
+        self.stdout.write(format_report(report, options['dry_run']))
@@ -0,0 +1,35 @@
+"""
+Management command writing synthetic seating plan .docx files (see
+core.synthetic.write_seating_docx). Use them to exercise the upload/preview/
+publish flow or the parser at realistic or extreme sizes without real student data.
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.synthetic import exam_plans, write_seating_docx
+
+
+class Command(BaseCommand):
+    help = 'Writes synthetic seating plan .docx files in the layout the parser expects'
+
+    def add_arguments(self, parser):
+        parser.add_argument('out_dir', help='Directory to write the files to')
+        parser.add_argument('--files', type=int, default=5, help='Number of files (exam sessions)')
+        parser.add_argument('--students', type=int, default=1500, help='Students per file')
+        parser.add_argument('--seats-per-room', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        os.makedirs(options['out_dir'], exist_ok=True)
+        started = time.monotonic()
+        plans = exam_plans(options['files'], options['students'],
+                           seats_per_room=options['seats_per_room'], seed=options['seed'])
+        for exam, pages in plans:
+            path = os.path.join(options['out_dir'], f"seating_plan_{exam + 1:03d}.docx")
+            write_seating_docx(pages, path)
+            self.stdout.write(f"  {path}: {sum(len(p['records']) for p in pages)} students in {len(pages)} rooms")
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {options['files']} files in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,119 @@
+"""
+Management command that fills the DB with realistic synthetic exam data for
+benchmarking: many uploads, each a seating plan across dozens of rooms with
+its own visibility window. Windows are a mix of visible now, upcoming,
+expired and manually deactivated, so the lookup's visibility filtering does
+real work.
+
+Synthetic uploads are named uploads/synthetic/..., and --clear removes only those.
+No .docx files are written.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from core.allotment_index import allotments_changed
+from core.models import SeatAllotment, UploadedFile, VisibilityWindow
+from core.raw_rows import raw_rows_entry
+from core.synthetic import exam_plans
+
+SYNTHETIC_PREFIX = 'uploads/synthetic/'
+
+
+class Command(BaseCommand):
+    help = 'Generates synthetic uploads, visibility windows and seat allotments for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uploads', type=int, default=20, help='Number of uploads (exam sessions)')
+        parser.add_argument('--students', type=int, default=2000, help='Students seated per upload')
+        parser.add_argument('--pool', type=int, default=None,
+                            help='Distinct students across all uploads (default 2x --students)')
+        parser.add_argument('--seats-per-room', type=int, default=30)
+        parser.add_argument('--upcoming', type=int, default=None, help='Uploads whose window opens later')
+        parser.add_argument('--expired', type=int, default=None, help='Uploads whose window has closed')
+        parser.add_argument('--inactive', type=int, default=None, help='Uploads with a deactivated window')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clear', action='store_true', help='Delete previously generated synthetic uploads first')
+
+    def handle(self, *args, **options):
+        uploads = options['uploads']
+        # By default a quarter of the uploads each are upcoming/expired/inactive, the rest visible
+        upcoming = options['upcoming'] if options['upcoming'] is not None else uploads // 4
+        expired = options['expired'] if options['expired'] is not None else uploads // 4
+        inactive = options['inactive'] if options['inactive'] is not None else uploads // 8
+        if upcoming + expired + inactive > uploads:
+            raise CommandError('--upcoming + --expired + --inactive exceeds --uploads')
+
+        if options['clear']:
+            deleted, _ = UploadedFile.objects.filter(file__startswith=SYNTHETIC_PREFIX).delete()
+            self.stdout.write(f"Removed {deleted} synthetic objects")
+
+        kinds = ['upcoming'] * upcoming + ['expired'] * expired + ['inactive'] * inactive
+        kinds += ['visible'] * (uploads - len(kinds))
+
+        now = timezone.now()
+        started = time.monotonic()
+        total = 0
+        plans = exam_plans(uploads, options['students'], pool_size=options['pool'],
+                           seats_per_room=options['seats_per_room'], seed=options['seed'])
+
+        for (exam, pages), kind in zip(plans, kinds):
+            exam_dt = {
+                'visible': now + timedelta(minutes=30),
+                'upcoming': now + timedelta(days=1 + exam),
+                'expired': now - timedelta(days=1 + exam),
+                'inactive': now + timedelta(minutes=30),
+            }[kind]
+            visible_from = exam_dt - timedelta(minutes=45)
+            visible_until = exam_dt + timedelta(hours=3)
+            active = kind != 'inactive'
+
+            with transaction.atomic():
+                upload = UploadedFile.objects.create(
+                    file=f"{SYNTHETIC_PREFIX}exam_{options['seed']}_{exam:03d}.docx",
+                    exam_date=exam_dt.date(),
+                    is_published=True,
+                )
+                VisibilityWindow.objects.create(
+                    file=upload,
+                    window_name=f"Synthetic exam {exam} ({kind})",
+                    visible_from=visible_from,
+                    visible_until=visible_until,
+                    is_active_manual=active,
+                )
+                # Same shape as the publish step in preview_data
+                SeatAllotment.objects.bulk_create((
+                    SeatAllotment(
+                        uploaded_file=upload,
+                        usn=record['usn'],
+                        usn_normalized=record['usn'],
+                        room_no=page['room'],
+                        seat_no=record['seat'],
+                        course_code=record['course'],
+                        exam_start_time=exam_dt,
+                        visible_from=visible_from,
+                        visible_until=visible_until,
+                        window_active=active,
+                    )
+                    for page in pages
+                    for record in page['records']
+                ), batch_size=2000)
+                if settings.RAW_ROWS_STORAGE == 'compressed':
+                    raw_rows_entry(upload, [
+                        {'page_idx': page['page_idx'], 'room': page['room'], 'columns': page['columns'],
+                         'rows': [record['raw_data'] for record in page['records']]}
+                        for page in pages
+                    ]).save()
+            count = sum(len(page['records']) for page in pages)
+            total += count
+            self.stdout.write(f"  upload {upload.id}: {count} students in {len(pages)} rooms ({kind})")
+
+        allotments_changed()
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {uploads} uploads / {total} allotments in {time.monotonic() - started:.1f}s "
+            f"({kinds.count('visible')} visible, {upcoming} upcoming, {expired} expired, {inactive} inactive)"
+        ))
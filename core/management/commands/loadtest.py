@@ -0,0 +1,173 @@
+"""
+Repeatable load test for the student API.
+
+Starts a local server (see core.loadgen.SERVER_PROFILES) against the configured
+database and drives it at one or more concurrency levels. For each level it
+reports p50/p95/p99 latency, throughput and SQL queries per request (from the
+X-DB-Queries header that QueryCountMiddleware adds when QUERY_COUNT_HEADER is on).
+
+Results are written to a JSON file. Pass an earlier file as --baseline to
+compare: the command exits non-zero when throughput or p95 regresses by more
+than --max-regression percent.
+
+    manage.py generate_synthetic_data --uploads 40 --students 2500 --clear
+    manage.py loadtest --concurrency 10,100,500 --output benchmarks/before.json
+    ... change something ...
+    manage.py loadtest --concurrency 10,100,500 --baseline benchmarks/before.json
+"""
+import json
+import os
+import secrets
+import statistics
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.loadgen import (
+    SERVER_PROFILES, LocalServer, client_ip, format_summary, lookup_plan, lookup_requests, run_load, visible_usns,
+    warm_up,
+)
+
+
+class Command(BaseCommand):
+    help = 'Load tests /api/allotment (or the batch endpoint) and saves the results for comparison'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', default='wsgi', choices=sorted(SERVER_PROFILES))
+        parser.add_argument('--workers', type=int, default=2, help='Server worker processes')
+        parser.add_argument('--concurrency', default='10,100,300',
+                            help='Comma separated concurrency levels, one run each')
+        parser.add_argument('--requests', type=int, default=3000, help='Requests per level')
+        parser.add_argument('--duration', type=float, default=None,
+                            help='Seconds per level (stops at --requests or --duration, whichever is first)')
+        parser.add_argument('--scenario', default='lookup', choices=['lookup', 'batch'],
+                            help='lookup: GET /api/allotment; batch: POST /api/allotment/batch')
+        parser.add_argument('--batch-size', type=int, default=50, help='USNs per batch request')
+        parser.add_argument('--miss-ratio', type=float, default=0.1, help='Fraction of unknown USNs')
+        parser.add_argument('--no-index', action='store_true',
+                            help='Disable the in-memory index so every lookup hits the DB')
+        parser.add_argument('--output', default=None,
+                            help='Results file (default benchmarks/loadtest-<profile>-<timestamp>.json)')
+        parser.add_argument('--baseline', default=None, help='Earlier results file to compare against')
+        parser.add_argument('--max-regression', type=float, default=10.0,
+                            help='Allowed throughput/p95 regression vs --baseline, in percent')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        usns = visible_usns(20000)
+        if not usns:
+            raise CommandError('No visible allotments; run generate_synthetic_data first')
+
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency must be a comma separated list of integers')
+
+        api_key = secrets.token_hex(16)
+        make_request = self.request_factory(options, usns, api_key)
+        env = {
+            'QUERY_COUNT_HEADER': 'True',
+            'ALLOTMENT_INDEX_ENABLED': 'False' if options['no_index'] else 'True',
+            'STUDENT_BATCH_API_KEYS': api_key,
+        }
+
+        runs = []
+        with LocalServer(options['profile'], workers=options['workers'], env=env) as server:
+            warm_up(server, make_request)
+            for level in levels:
+                result = run_load('127.0.0.1', server.port, make_request, label=f"c{level}",
+                                  concurrency=level, total_requests=options['requests'],
+                                  duration=options['duration'], collect_header='X-DB-Queries')
+                summary = result.summary()
+                queries = [int(value) for value in result.header_values]
+                summary['queries_per_request'] = round(statistics.fmean(queries), 2) if queries else None
+                summary['max_queries'] = max(queries) if queries else None
+                runs.append(summary)
+                self.stdout.write(
+                    f"c={level:<5} {format_summary(summary)}  "
+                    f"queries/req {summary['queries_per_request']} (max {summary['max_queries']})  "
+                    f"errors {summary['errors']}  statuses {summary['statuses']}"
+                )
+
+        report = {
+            'created_at': now,
+            'commit': self.git_commit(),
+            'profile': options['profile'],
+            'workers': options['workers'],
+            'scenario': options['scenario'],
+            'batch_size': options['batch_size'] if options['scenario'] == 'batch' else None,
+            'index_enabled': not options['no_index'],
+            'miss_ratio': options['miss_ratio'],
+            'database': settings.DATABASES['default']['ENGINE'],
+            'visible_usns': len(usns),
+            'runs': runs,
+        }
+        output = options['output'] or os.path.join(
+            'benchmarks', f"loadtest-{options['profile']}-{now:%Y%m%d-%H%M%S}.json"
+        )
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        self.stdout.write(f"Saved results to {output}")
+
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['max_regression'])
+
+    def request_factory(self, options, usns, api_key):
+        if options['scenario'] == 'lookup':
+            return lookup_requests(lookup_plan(usns, options['requests'], options['miss_ratio']))
+
+        size = options['batch_size']
+        plan = lookup_plan(usns, options['requests'] * size, options['miss_ratio'])
+        headers = {'Content-Type': 'application/json', 'X-API-Key': api_key}
+
+        def make_request(i):
+            offset = (i * size) % len(plan)
+            body = json.dumps({'usns': plan[offset:offset + size]}).encode()
+            return '/api/allotment/batch', {**headers, 'X-Forwarded-For': client_ip(i)}, body
+        return make_request
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, timeout=5,
+            ).stdout.strip() or None
+        except OSError:
+            return None
+
+    def compare(self, report, baseline_path, max_regression):
+        try:
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read baseline {baseline_path}: {e}")
+
+        before = {run['concurrency']: run for run in baseline.get('runs', [])}
+        regressions = []
+        self.stdout.write(f"Compared with {baseline_path} (commit {baseline.get('commit')}):")
+        for run in report['runs']:
+            old = before.get(run['concurrency'])
+            if old is None:
+                continue
+            rps_change = self.change(old['throughput_rps'], run['throughput_rps'])
+            p95_change = self.change(old['p95_ms'], run['p95_ms'])
+            self.stdout.write(
+                f"  c={run['concurrency']:<5} throughput {old['throughput_rps']} -> {run['throughput_rps']} "
+                f"({rps_change:+.1f}%)  p95 {old['p95_ms']} -> {run['p95_ms']}ms ({p95_change:+.1f}%)  "
+                f"queries/req {old.get('queries_per_request')} -> {run['queries_per_request']}"
+            )
+            if rps_change < -max_regression or p95_change > max_regression:
+                regressions.append(run['concurrency'])
+
+        if regressions:
+            raise CommandError(
+                f"Regression beyond {max_regression}% at concurrency {', '.join(map(str, regressions))}"
+            )
+        self.stdout.write(self.style.SUCCESS('No regression beyond the allowed margin'))
+
+    @staticmethod
+    def change(old, new):
+        return (new - old) / old * 100 if old else 0.0
@@ -0,0 +1,77 @@
+"""
+Management command running the upload parse queue (core.jobs).
+
+Claims queued ParseJobs one at a time and parses them; in between it re-queues
+jobs left running by a worker that died. Several workers can run side by side.
+SIGTERM/SIGINT let the current job finish before exiting; a worker killed
+outright leaves its job to be picked up again once its heartbeat goes stale.
+When the queue is empty it also runs expiry (core.expiry) every
+EXPIRY_INTERVAL_SECONDS, so deployments running this worker need no cron for
+it (inline-parsing ones do, see the EXPIRY settings).
+"""
+import logging
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.expiry import run_expiry
+from core.jobs import claim_job, reclaim_stale_jobs, run_job, worker_name
+
+from .expire_allotments import format_report
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Parses uploaded seating plans queued by the upload view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--no-expiry', action='store_true', help='Never run expiry from this worker')
+
+    def handle(self, *args, **options):
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping after the current job...')
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        worker = worker_name()
+        self.stdout.write(f"Parse worker {worker} started")
+        interval = 0 if options['no_expiry'] else settings.EXPIRY_INTERVAL_SECONDS
+        next_expiry = time.monotonic()
+        while not stopping.is_set():
+            close_old_connections()
+            reclaim_stale_jobs()
+            job = claim_job(worker)
+            if job is None:
+                if interval and time.monotonic() >= next_expiry:
+                    next_expiry = time.monotonic() + interval
+                    self._expire()
+                    continue
+                if options['once']:
+                    break
+                stopping.wait(options['poll'])
+                continue
+
+            self.stdout.write(f"Job {job.id}: parsing {len(job.files)} file(s) (attempt {job.attempts})")
+            run_job(job, worker)
+            job.refresh_from_db(fields=['status', 'error'])
+            self.stdout.write(f"Job {job.id}: {job.status}" + (f" ({job.error})" if job.error else ''))
+
+    def _expire(self):
+        try:
+            report = run_expiry()
+        except Exception:
+            logger.exception("Expiry run failed")
+            return
+        if any(report[key] for key in ('uploads', 'staging_batches', 'parse_cache', 'parse_jobs', 'files')):
+            self.stdout.write(format_report(report))
@@ -0,0 +1,22 @@
+"""
+Management command to regenerate or withdraw the pre-rendered result shards.
+Publishing and window boundaries already schedule this in the web processes
+(core.result_shards.schedule_sync); run it by hand to rebuild with --force.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.result_shards import sync_result_shards
+
+
+class Command(BaseCommand):
+    help = 'Writes static JSON result shards for the currently visible windows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rewrite the current generation even if unchanged')
+
+    def handle(self, *args, **options):
+        if not settings.RESULT_SHARDS_ENABLED:
+            self.stdout.write('Result shards are disabled (RESULT_SHARDS_ENABLED=False)')
+            return
+        self.stdout.write(self.style.SUCCESS(sync_result_shards(force=options['force'])))
@@ -0,0 +1,57 @@
+"""
+Management command warming the student lookup ahead of an exam window
+(core.warmup). Run it from cron some minutes before windows open, e.g.
+
+    */5 * * * * python manage.py warm_up_allotments --url https://seats.example.edu/
+
+It targets the next window opening within WARMUP_HORIZON_MINUTES (or --at),
+and exits with an error when something is not ready.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = 'Preloads the allotment index snapshot, result shards and DB caches for the next exam window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--at', help='Warm the state at this time (ISO format, local time) instead of the next opening')
+        parser.add_argument('--horizon', type=int, default=None,
+                            help='Minutes ahead to look for an opening window (default WARMUP_HORIZON_MINUTES)')
+        parser.add_argument('--url', action='append', default=[], help='URL to request to bring up workers (repeatable)')
+        parser.add_argument('--requests', type=int, default=4, help='Concurrent requests per --url')
+
+    def handle(self, *args, **options):
+        at = None
+        if options['at']:
+            at = parse_datetime(options['at'])
+            if at is None:
+                raise CommandError(f"Invalid --at: {options['at']}")
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+        horizon = timedelta(minutes=options['horizon']) if options['horizon'] else None
+
+        report = warm_up(at=at, horizon=horizon, urls=options['url'], requests=options['requests'])
+
+        when = timezone.localtime(report['at']).strftime('%Y-%m-%d %H:%M')
+        names = ', '.join(name or '(unnamed)' for name in report['windows'][:5])
+        if len(report['windows']) > 5:
+            names += f" and {len(report['windows']) - 5} more"
+        self.stdout.write(f"{'Opening at' if report['upcoming'] else 'Visible now'} {when}: "
+                          f"{len(report['windows'])} window(s) {names} (state {report['token']})")
+        if report['usns']:
+            self.stdout.write(f"  {report['usns']} USNs, index snapshot: {report['snapshot'] or 'index disabled'}")
+            self.stdout.write(f"  Result shards: {report['shards'] or 'disabled'}")
+            self.stdout.write(f"  Lookup index touched: {report['touched_rows']} rows")
+        for result in report['pings']:
+            self.stdout.write(f"  {result['url']}: {result['ok']}/{result['requests']} ok, slowest {result['max_ms']}ms")
+        self.stdout.write(f"  Timings: {report['timings']}")
+
+        if report['problems']:
+            raise CommandError(f"Not ready: {'; '.join(report['problems'])}")
+        self.stdout.write(self.style.SUCCESS('Ready'))
@@ -0,0 +1,365 @@
+"""
+Prometheus metrics for the hot paths, shared across worker processes.
+
+Every process (gunicorn/uvicorn workers, the parse worker, its parse pool)
+keeps its counters and histograms in memory and writes them to
+METRICS_DIR/<pid>-<process start time>.json about once every
+METRICS_FLUSH_SECONDS from a background thread. /metrics (core.views.metrics)
+sums the files of all processes and renders the Prometheus text format, so a
+scrape sees the whole host no matter which worker answers it.
+
+A scrape also folds the files of exited processes into METRICS_DIR/_exited.json
+and removes them, so counters do not go backwards when workers restart and the
+directory does not grow with every restart. The start time in the file name
+keeps a recycled pid from overwriting an exited process's totals. With several
+hosts, scrape each one.
+
+Metrics are defined at the bottom of this module and recorded with
+`METRIC.inc(...)` / `METRIC.observe(...)`, passing label values as keywords.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: scrapes folding exited processes are not serialized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+EXITED_NAME = '_exited.json'
+LOCK_NAME = '.lock'
+
+_lock = threading.Lock()
+_samples = {}
+_dirty = False
+_flusher_pid = None
+_process_file = None
+_registry = {}
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+RECORD_BUCKETS = (0, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+    def _key(self, labels):
+        return (self.name, tuple(str(labels[label]) for label in self.labelnames))
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not settings.METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with _lock:
+            _samples[key] = _samples.get(key, 0) + amount
+            _mark_dirty()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if not settings.METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with _lock:
+            # [count per bucket (not cumulative)..., count above the last bucket, sum]
+            sample = _samples.get(key)
+            if sample is None:
+                sample = _samples[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[i] += 1
+                    break
+            else:
+                sample[-2] += 1
+            sample[-1] += value
+            _mark_dirty()
+
+
+class timer:
+    """Context manager observing its duration in seconds on a histogram."""
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+# ---- per-process files ----
+
+def _mark_dirty():
+    # Caller holds _lock. The flusher thread is started lazily in each process,
+    # so it exists in forked workers too.
+    global _dirty, _flusher_pid
+    _dirty = True
+    if _flusher_pid != os.getpid():
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception:
+            logger.exception("Writing metrics failed")
+
+
+def flush():
+    """Writes this process's samples to its file if anything changed."""
+    global _dirty
+    with _lock:
+        if not _dirty:
+            return
+        data = [[name, list(labels), value] for (name, labels), value in _samples.items()]
+        _dirty = False
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    _write(os.path.join(settings.METRICS_DIR, _file_name()), data)
+
+
+def _write(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # gone, or not ours
+
+
+def _start_time(pid):
+    """Start time of pid in clock ticks since boot; None if it is not running or there is no /proc."""
+    try:
+        with open(f"/proc/{pid}/stat", 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Field 22; the command name before it may contain spaces and parentheses
+    return int(stat[stat.rindex(b')') + 2:].split()[19])
+
+
+def _file_name():
+    global _process_file
+    pid = os.getpid()
+    if _process_file is None or _process_file[0] != pid:
+        _process_file = (pid, f"{pid}-{_start_time(pid) or uuid.uuid4().hex}.json")
+    return _process_file[1]
+
+
+def _exited(filename):
+    pid, _, started = filename[:-len('.json')].partition('-')
+    if not pid.isdigit():
+        return False
+    if started.isdigit():
+        return str(_start_time(int(pid))) != started
+    # No start time recorded (no /proc): only a pid nobody uses any more is known to be gone
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass  # running as another user
+    return False
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        pass
+
+
+def _add(totals, data):
+    for name, labels, value in data:
+        key = (name, tuple(labels))
+        if isinstance(value, list):
+            total = totals.get(key)
+            totals[key] = value if total is None else [a + b for a, b in zip(total, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+@contextmanager
+def _dir_lock():
+    # One scrape at a time per host reads and folds the files
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(settings.METRICS_DIR, LOCK_NAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _fold_exited(filenames):
+    """
+    Adds the files of exited processes to EXITED_NAME and removes them. Returns
+    (totals of all exited processes, names of files already counted in them).
+    Caller holds _dir_lock.
+    """
+    exited_path = os.path.join(settings.METRICS_DIR, EXITED_NAME)
+    exited = _read(exited_path) or {'samples': [], 'folded': []}
+    totals = {}
+    _add(totals, exited['samples'])
+    # Files counted by a pass that stopped before removing them
+    folded = {name for name in exited['folded'] if name in filenames}
+
+    newly_folded = []
+    for filename in filenames:
+        if filename in folded or not _exited(filename):
+            continue
+        data = _read(os.path.join(settings.METRICS_DIR, filename))
+        if data is not None:
+            _add(totals, data)
+            newly_folded.append(filename)
+    if not newly_folded:
+        return totals, folded
+
+    folded.update(newly_folded)
+    _write(exited_path, {
+        'samples': [[name, list(labels), value] for (name, labels), value in totals.items()],
+        'folded': sorted(folded),
+    })
+    for filename in newly_folded:
+        try:
+            os.remove(os.path.join(settings.METRICS_DIR, filename))
+        except OSError:
+            pass  # counted in EXITED_NAME either way; skipped until it is gone
+    return totals, folded
+
+
+def collect():
+    """{(name, labels): value} summed over every process, running or exited."""
+    flush()
+    try:
+        names = os.listdir(settings.METRICS_DIR)
+    except FileNotFoundError:
+        return {}
+    filenames = {name for name in names if name.endswith('.json') and name != EXITED_NAME}
+    with _dir_lock():
+        totals, folded = _fold_exited(filenames)
+        for filename in filenames - folded:
+            data = _read(os.path.join(settings.METRICS_DIR, filename))
+            if data is not None:
+                _add(totals, data)
+    return totals
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(metric, values, extra=()):
+    pairs = list(zip(metric.labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics of all processes in the Prometheus text exposition format (0.0.4)."""
+    totals = collect()
+    lines = []
+    for name, metric in sorted(_registry.items()):
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for (sample_name, values), value in sorted(totals.items()):
+            if sample_name != name:
+                continue
+            if metric.kind == 'counter':
+                lines.append(f"{name}_total{_labels(metric, values)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets, value):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(metric, values, [('le', _number(float(bound)))])} {cumulative}")
+            cumulative += value[-2]
+            lines.append(f"{name}_bucket{_labels(metric, values, [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric, values)} {_number(float(value[-1]))}")
+            lines.append(f"{name}_count{_labels(metric, values)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+# ---- metrics ----
+
+REQUEST_DURATION = Histogram(
+    'seat_http_request_duration_seconds', 'Time to answer a request, by view.', ['view', 'method', 'status'],
+)
+REQUEST_DB_QUERIES = Histogram(
+    'seat_http_request_db_queries', 'SQL queries run per request, by view.', ['view'], buckets=COUNT_BUCKETS,
+)
+REQUEST_DB_DURATION = Histogram(
+    'seat_http_request_db_duration_seconds', 'Time spent in SQL per request, by view.', ['view'],
+)
+LOOKUP_CACHE = Counter(
+    'seat_lookup_cache',
+    'Student lookup cache outcomes: etag (hit = 304), index (USN in the in-memory index or not) '
+    'and bloom (rejected without a query, passed, or passed but not found).',
+    ['cache', 'result'],
+)
+COALESCE = Counter(
+    'seat_coalesce_calls',
+    'Coalesced lookups (core.singleflight): cached, coalesced onto an in-flight query, or executed.',
+    ['flight', 'result'],
+)
+INDEX_REBUILDS = Counter(
+    'seat_allotment_index_rebuilds', 'Allotment index rebuilds, by where the entries came from.', ['source'],
+)
+RATE_LIMITED = Counter('seat_rate_limited', 'Requests rejected by RateLimitMiddleware.', ['path'])
+PARSE_DURATION = Histogram(
+    'seat_parse_duration_seconds', 'Time to parse one uploaded file.', ['result'], buckets=SLOW_BUCKETS,
+)
+PARSE_RECORDS = Histogram(
+    'seat_parse_records_per_upload', 'Student records parsed per upload.', ['source'], buckets=RECORD_BUCKETS,
+)
+PARSE_FILES = Counter('seat_parse_files', 'Uploads parsed, by outcome.', ['result'])
+PUBLISH_DURATION = Histogram(
+    'seat_publish_duration_seconds', 'Time per publish phase (see core.staging.publish_staged).', ['phase'],
+    buckets=SLOW_BUCKETS,
+)
+PUBLISH_ROWS = Counter('seat_publish_rows', 'Allotment rows published.')
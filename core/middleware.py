@@ -1,47 +1,83 @@
-from django.http import JsonResponse
-from django.core.cache import cache
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.http import HttpResponseNotFound, JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
 from django.conf import settings
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+import json
+import logging
+import os
 import time
+from contextvars import ContextVar
+
+from . import metrics, profiling
+from .allotment_index import allotment_index, state_etag
+from .ratelimit import get_limiter
+from .result_shards import MANIFEST_NAME, schedule_sync
+
+logger = logging.getLogger(__name__)
 
 class RateLimitMiddleware:
+    # Works natively under both WSGI and ASGI (see student_lookup_async)
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        if request.path == '/api/allotment':
-            ip = self.get_client_ip(request)
-            
-            # Key for cache: rate_limit_IP
-            key = f"rate_limit_{ip}"
-            
-            # Get current count
-            # Using a list of timestamps for "Fixed time window" or "Sliding window"?
-            # Requirement: "Fixed time window" (e.g. 10 req / 1 min?)
-            # "Maximum 10 requests per IP" - Time window not specified in seconds, I'll assume 1 minute.
-            # Let's use a simple counter with timeout if it doesn't exist.
-            
-            limit = 10
-            window = 60 # seconds
-            
-            count = cache.get(key, 0)
-            
-            if count >= limit:
-                return JsonResponse(
-                    {'error': 'Rate limit exceeded. Try again later.'}, 
-                    status=429
-                )
-            
-            # Increment
-            if count == 0:
-                cache.set(key, 1, window)
-            else:
-                try:
-                    cache.incr(key)
-                except ValueError:
-                    cache.set(key, 1, window) # Key might have expired just now
-            
-        response = self.get_response(request)
-        return response
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        revalidating = self.sends_etag(request) and self.etag_matches(request, allotment_index.state()[0])
+        if not self.allow(request, revalidating):
+            return self.rate_limited()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # A check is a few microseconds of mmap work, fine to run on the event loop
+        revalidating = self.sends_etag(request) and self.etag_matches(request, (await allotment_index.astate())[0])
+        if not self.allow(request, revalidating):
+            return self.rate_limited()
+        return await self.get_response(request)
+
+    def sends_etag(self, request):
+        return request.path in settings.RATE_LIMITS and bool(request.headers.get('If-None-Match'))
+
+    def etag_matches(self, request, token):
+        return state_etag(token) in parse_etags(request.headers['If-None-Match'])
+
+    def allow(self, request, revalidating=False):
+        rule = settings.RATE_LIMITS.get(request.path)
+        if rule is None:
+            return True
+
+        limit, window = rule
+        # Revalidations still count, but one matching the current state is a 304
+        # answered without DB work, so it gets a higher ceiling than a lookup.
+        # Any other If-None-Match gets a full answer and counts as a lookup.
+        if revalidating:
+            limit *= settings.RATE_LIMIT_REVALIDATE_FACTOR
+
+        # Shared by all workers on the host (core/ratelimit.py)
+        key = f"{request.path}|{self.get_client_ip(request)}"
+        allowed, _ = get_limiter().allow(key, limit, window)
+        if not allowed:
+            metrics.RATE_LIMITED.inc(path=request.path)
+        return allowed
+
+    def rate_limited(self):
+        return JsonResponse(
+            {'error': 'Rate limit exceeded. Try again later.'}, 
+            status=429
+        )
 
     def get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -50,3 +86,323 @@ class RateLimitMiddleware:
         else:
             ip = request.META.get('REMOTE_ADDR')
         return ip
+
+
+class ResultShardMiddleware(WhiteNoise):
+    """
+    Serves the pre-rendered result shards (core/result_shards.py) from disk.
+
+    Shards are regenerated while the server is running, so unlike the static
+    files WhiteNoise indexes at startup every request looks the path up on disk.
+    That is a couple of stat() calls for a URL under RESULT_SHARDS_URL and
+    nothing for any other URL. gzip/brotli variants are picked up automatically.
+
+    Only the manifest's generation is served, and only until the manifest's
+    valid_until: after that a window has opened or closed, so the manifest and
+    its shards get a 404 (index.html then asks the API) and a sync is scheduled.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        self.prefix = settings.RESULT_SHARDS_URL
+        self.manifest_path = os.path.join(str(settings.RESULT_SHARDS_ROOT), MANIFEST_NAME)
+        self.manifest_key = None
+        self.manifest = None
+        super().__init__(
+            application=None,
+            autorefresh=True,
+            max_age=settings.RESULT_SHARDS_MANIFEST_MAX_AGE,
+        )
+        self.add_files(str(settings.RESULT_SHARDS_ROOT), prefix=self.prefix)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.serve_shard(request)
+        return response if response is not None else self.get_response(request)
+
+    async def __acall__(self, request):
+        response = self.serve_shard(request)
+        return response if response is not None else await self.get_response(request)
+
+    def serve_shard(self, request):
+        if request.path_info.startswith(self.prefix):
+            if not self.is_current(request.path_info[len(self.prefix):]):
+                response = HttpResponseNotFound()
+                response['Cache-Control'] = 'no-cache'
+                return response
+            static_file = self.find_file(request.path_info)
+            if static_file is not None:
+                return WhiteNoiseMiddleware.serve(static_file, request)
+        return None
+
+    def is_current(self, name):
+        manifest = self.read_manifest()
+        if manifest is None:
+            return False
+        valid_until = manifest.get('valid_until')
+        if valid_until and parse_datetime(valid_until) <= timezone.now():
+            schedule_sync()
+            return False
+        return name == MANIFEST_NAME or name.split('/', 1)[0] == manifest.get('generation')
+
+    def read_manifest(self):
+        # Parsed again only when the file was replaced
+        try:
+            stat = os.stat(self.manifest_path)
+        except OSError:
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if key != self.manifest_key:
+            try:
+                with open(self.manifest_path, 'rb') as f:
+                    self.manifest = json.load(f)
+            except (OSError, ValueError):
+                return None
+            self.manifest_key = key
+        return self.manifest
+
+    def immutable_file_test(self, path, url):
+        # Everything except the manifest lives in a content-named generation directory
+        return os.path.basename(path) != 'manifest.json'
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware is sync-only, which under ASGI makes Django run every
+    request through a thread hop. Its lookup is a dict get, so it is safe to
+    call directly from the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings=settings)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class QueryCountMiddleware:
+    """
+    Adds an X-DB-Queries header with the number of SQL queries the request ran,
+    for the load test (manage.py loadtest). Only installed when
+    QUERY_COUNT_HEADER is on; put it first so it sees every query.
+
+    Under ASGI the ORM runs in sync_to_async threads with their own connection
+    objects, so instead of connection.execute_wrapper() around the request a
+    wrapper sits on every connection and counts into a context variable, which
+    those threads inherit.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERY_COUNT_HEADER:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(_install_query_counter)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        _install_query_counter(connection=connection)
+        counter = [0]
+        token = _query_count.set(counter)
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_count.reset(token)
+        response['X-DB-Queries'] = str(counter[0])
+        return response
+
+    async def __acall__(self, request):
+        counter = [0]
+        token = _query_count.set(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_count.reset(token)
+        response['X-DB-Queries'] = str(counter[0])
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Records each request's duration, SQL query count and SQL time per view
+    (core/metrics.py). Put it first so it sees the whole request, including
+    what the other middleware do. Queries are counted the same way as in
+    QueryCountMiddleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(_install_query_counter)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        _install_query_counter(connection=connection)
+        started = time.perf_counter()
+        queries = [0, 0.0]
+        token = _query_stats.set(queries)
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_stats.reset(token)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        queries = [0, 0.0]
+        token = _query_stats.set(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_stats.reset(token)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    def record(self, request, response, seconds, queries):
+        view = view_name(request)
+        metrics.REQUEST_DURATION.observe(seconds, view=view, method=request.method, status=response.status_code)
+        metrics.REQUEST_DB_QUERIES.observe(queries[0], view=view)
+        metrics.REQUEST_DB_DURATION.observe(queries[1], view=view)
+
+
+class ProfilerMiddleware:
+    """
+    Profiles a sample of requests (core/profiling.py). Only installed when
+    PROFILER_SAMPLE_RATE is above 0; put it near the top so the profile
+    covers the other middleware too. cProfile is only used for sync requests:
+    under ASGI other requests run on the same thread between awaits.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.PROFILER_SAMPLE_RATE <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(_install_query_counter)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not profiling.sampled():
+            return self.get_response(request)
+        _install_query_counter(connection=connection)
+        statements = []
+        token = _query_log.set(statements)
+        profiler = profiling.start_cprofile()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            seconds = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+            _query_log.reset(token)
+        self.record(request, response, seconds, statements, profiler)
+        return response
+
+    async def __acall__(self, request):
+        if not profiling.sampled():
+            return await self.get_response(request)
+        statements = []
+        token = _query_log.set(statements)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            seconds = time.perf_counter() - started
+            _query_log.reset(token)
+        self.record(request, response, seconds, statements)
+        return response
+
+    def record(self, request, response, seconds, statements, profiler=None):
+        try:
+            profiling.write_profile(profiling.build_profile(
+                request.method, request.path, view_name(request), response.status_code,
+                seconds, statements, profiler,
+            ))
+        except Exception:
+            # Never fail the request over its profile
+            logger.exception("Writing a request profile failed")
+
+
+def view_name(request):
+    # URL names, never raw paths, so the number of metric label values stays bounded
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        return match.view_name
+    if request.path_info.startswith(settings.RESULT_SHARDS_URL):
+        return 'result_shards'
+    if request.path_info.startswith(settings.STATIC_URL):
+        return 'static'
+    # Answered by a middleware before URL resolution (e.g. rate limited)
+    try:
+        return resolve(request.path_info).view_name
+    except Resolver404:
+        return 'unmatched'
+
+
+_query_count = ContextVar('query_count', default=None)
+# [queries, seconds] of the current request, for MetricsMiddleware
+_query_stats = ContextVar('query_stats', default=None)
+# [(sql, seconds, many)] of a request being profiled, for ProfilerMiddleware
+_query_log = ContextVar('query_log', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1
+    stats = _query_stats.get()
+    statements = _query_log.get()
+    if stats is None and statements is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+        if statements is not None:
+            statements.append((sql, elapsed, many))
+
+
+def _install_query_counter(sender=None, connection=None, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:23
+
+import re
+
+from django.db import migrations, models
+
+
+def backfill_usn_normalized(apps, schema_editor):
+    # Same rule as core.parser.normalize_usn, frozen here so the migration stays stable
+    SeatAllotment = apps.get_model('core', 'SeatAllotment')
+    batch = []
+    for row in SeatAllotment.objects.only('id', 'usn').iterator(chunk_size=2000):
+        row.usn_normalized = re.sub(r'\s+', '', row.usn or '').upper()
+        batch.append(row)
+        if len(batch) >= 2000:
+            SeatAllotment.objects.bulk_update(batch, ['usn_normalized'])
+            batch = []
+    if batch:
+        SeatAllotment.objects.bulk_update(batch, ['usn_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_dataversion'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='seatallotment',
+            name='core_seatal_usn_58d482_idx',
+        ),
+        migrations.AddField(
+            model_name='seatallotment',
+            name='usn_normalized',
+            field=models.CharField(default='', editable=False, max_length=20),
+        ),
+        migrations.RunPython(backfill_usn_normalized, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='seatallotment',
+            index=models.Index(fields=['usn_normalized', 'uploaded_file'], name='seat_usn_norm_file_idx'),
+        ),
+    ]
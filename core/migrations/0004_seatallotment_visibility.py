@@ -0,0 +1,48 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:23
+
+from django.db import migrations, models
+
+
+def backfill_visibility(apps, schema_editor):
+    SeatAllotment = apps.get_model('core', 'SeatAllotment')
+    VisibilityWindow = apps.get_model('core', 'VisibilityWindow')
+    for win in VisibilityWindow.objects.all().iterator():
+        SeatAllotment.objects.filter(uploaded_file_id=win.file_id).update(
+            visible_from=win.visible_from,
+            visible_until=win.visible_until,
+            window_active=win.is_active_manual,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_seatallotment_usn_normalized'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='seatallotment',
+            name='seat_usn_norm_file_idx',
+        ),
+        migrations.AddField(
+            model_name='seatallotment',
+            name='visible_from',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='seatallotment',
+            name='visible_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='seatallotment',
+            name='window_active',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(backfill_visibility, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='seatallotment',
+            index=models.Index(fields=['usn_normalized', 'visible_from', 'visible_until'], name='seat_usn_visibility_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:53
+
+import hashlib
+import os
+
+from django.db import migrations, models
+
+
+def backfill_names_and_hashes(apps, schema_editor):
+    # Existing files stay where they are; they just get their original name and
+    # hash recorded so later identical uploads can share the parse cache
+    UploadedFile = apps.get_model('core', 'UploadedFile')
+    for upload in UploadedFile.objects.all().iterator():
+        upload.original_name = os.path.basename(upload.file.name)
+        try:
+            digest = hashlib.sha256()
+            with upload.file.open('rb') as f:
+                for chunk in f.chunks():
+                    digest.update(chunk)
+            upload.content_hash = digest.hexdigest()
+        except (OSError, ValueError):
+            pass  # file missing from storage
+        upload.save(update_fields=['original_name', 'content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_seatallotment_visibility'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='original_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.CreateModel(
+            name='ParseCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('parser_version', models.PositiveIntegerField()),
+                ('result', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'parser_version'), name='parse_cache_hash_version_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_names_and_hashes, migrations.RunPython.noop),
+    ]
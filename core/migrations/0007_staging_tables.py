@@ -0,0 +1,63 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_parse_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StagingBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('uploads', models.ManyToManyField(related_name='staging_batches', to='core.uploadedfile')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StagingPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('page_idx', models.IntegerField()),
+                ('room', models.CharField(max_length=50)),
+                ('record_count', models.PositiveIntegerField(default=0)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='core.stagingbatch')),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.uploadedfile')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StagingRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row_idx', models.PositiveIntegerField()),
+                ('usn', models.CharField(max_length=20)),
+                ('seat', models.CharField(max_length=50)),
+                ('course', models.CharField(blank=True, max_length=50)),
+                ('raw_data', models.JSONField(default=list)),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='records', to='core.stagingpage')),
+            ],
+            options={
+                'ordering': ['row_idx'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stagingpage',
+            constraint=models.UniqueConstraint(fields=('batch', 'position'), name='staging_page_position_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='stagingrecord',
+            constraint=models.UniqueConstraint(fields=('page', 'row_idx'), name='staging_record_row_uniq'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:03
+
+import json
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def compact_other_data(apps, schema_editor):
+    # Move each upload's SeatAllotment.other_data into one compressed
+    # UploadRawRows, grouping consecutive rows of the same room into a page.
+    # Column names were never stored, so legacy pages have none.
+    SeatAllotment = apps.get_model('core', 'SeatAllotment')
+    UploadRawRows = apps.get_model('core', 'UploadRawRows')
+    upload_ids = SeatAllotment.objects.values_list('uploaded_file_id', flat=True).distinct()
+    for upload_id in list(upload_ids):
+        pages = []
+        rows = SeatAllotment.objects.filter(uploaded_file_id=upload_id).order_by('id').values_list(
+            'room_no', 'other_data'
+        )
+        for room, other_data in rows.iterator(chunk_size=5000):
+            if not pages or pages[-1]['room'] != room:
+                pages.append({'page_idx': len(pages) + 1, 'room': room, 'columns': [], 'rows': []})
+            pages[-1]['rows'].append(other_data)
+        raw = json.dumps({'pages': pages}, separators=(',', ':'), ensure_ascii=False).encode()
+        UploadRawRows.objects.create(
+            upload_id=upload_id,
+            data=zlib.compress(raw, 6),
+            raw_size=len(raw),
+            row_count=sum(len(page['rows']) for page in pages),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_staging_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stagingpage',
+            name='columns',
+            field=models.JSONField(default=list),
+        ),
+        migrations.CreateModel(
+            name='UploadRawRows',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('raw_size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('upload', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='raw_rows', to='core.uploadedfile')),
+            ],
+        ),
+        migrations.RunPython(compact_other_data, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='seatallotment',
+            name='other_data',
+        ),
+    ]
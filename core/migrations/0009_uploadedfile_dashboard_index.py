@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_compact_raw_rows'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='uploadedfile',
+            index=models.Index(fields=['uploaded_at', 'id'], name='upload_dashboard_idx'),
+        ),
+    ]
@@ -1,15 +1,30 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.utils import timezone
 import os
 
+from .parser import normalize_usn
+
 class UploadedFile(models.Model):
+    # Stored content-addressed as uploads/<content_hash>.docx (see core.uploads), so
+    # re-uploads of the same document share one file
     file = models.FileField(upload_to='uploads/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
     exam_date = models.DateField(null=True, blank=True)
     is_published = models.BooleanField(default=False)
+    original_name = models.CharField(max_length=255, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+
+    class Meta:
+        # The dashboard pages through uploads newest first; walking this index
+        # lets the database stop after one page instead of sorting every upload
+        indexes = [
+            models.Index(fields=['uploaded_at', 'id'], name='upload_dashboard_idx'),
+        ]
 
     def filename(self):
-        return os.path.basename(self.file.name)
+        return self.original_name or os.path.basename(self.file.name)
 
     def __str__(self):
         return f"{self.filename()} ({self.uploaded_at})"
@@ -17,18 +32,21 @@ class UploadedFile(models.Model):
 class SeatAllotment(models.Model):
     uploaded_file = models.ForeignKey(UploadedFile, on_delete=models.CASCADE, related_name='allotments')
     usn = models.CharField(max_length=20, db_index=True)
+    # Trimmed/upper-cased copy of usn so lookups can use a plain index seek instead of iexact
+    usn_normalized = models.CharField(max_length=20, default='', editable=False)
     room_no = models.CharField(max_length=50)
     seat_no = models.CharField(max_length=50)
     course_code = models.CharField(max_length=50, blank=True, null=True)
     exam_start_time = models.DateTimeField()
     
-    # Store dynamic fields as JSON if needed, but for now simple structure is requested.
-    # Given requirements say "Class or section or mark fields (format is dynamic)", 
-    # we might need a JSONField or similar if we were using Postgres, 
-    # but with SQLite/Django we can use a TextField with JSON content or just simple fields if structured.
-    # The requirement says "return JSON similar to... Field names like class or mark are dynamic".
-    # Let's add a JSONField for dynamic data to be safe and flexible.
-    other_data = models.JSONField(default=dict, blank=True)
+    # The parsed table row behind each allotment is not stored here: it is kept
+    # once per upload, compressed, in UploadRawRows (see core.raw_rows)
+
+    # Copied from the file's VisibilityWindow (see VisibilityWindow.sync_allotments)
+    # so the student lookup is a single-table query
+    visible_from = models.DateTimeField(null=True, blank=True, editable=False)
+    visible_until = models.DateTimeField(null=True, blank=True, editable=False)
+    window_active = models.BooleanField(default=False, editable=False)
 
     class Meta:
         # Constraint: Unique USN per exam session? 
@@ -38,9 +56,19 @@ class SeatAllotment(models.Model):
         # But rigorous uniqueness might be "USN" globally if it's a student lookup for "current active exam".
         # Let's stick to USN indexed as requested. 
         indexes = [
-            models.Index(fields=['usn']),
+            models.Index(fields=['usn_normalized', 'visible_from', 'visible_until'], name='seat_usn_visibility_idx'),
         ]
 
+    def save(self, *args, **kwargs):
+        # bulk_create bypasses this, so publish sets these fields explicitly
+        self.usn_normalized = normalize_usn(self.usn)
+        window = VisibilityWindow.objects.filter(file_id=self.uploaded_file_id).first()
+        if window is not None:
+            self.visible_from = window.visible_from
+            self.visible_until = window.visible_until
+            self.window_active = window.is_active_manual
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.usn} - {self.room_no}"
 
@@ -51,6 +79,26 @@ class VisibilityWindow(models.Model):
     visible_until = models.DateTimeField()
     is_active_manual = models.BooleanField(default=True) # For manual activation/deactivation override if needed
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.sync_allotments()
+
+    def delete(self, *args, **kwargs):
+        file_id = self.file_id
+        result = super().delete(*args, **kwargs)
+        SeatAllotment.objects.filter(uploaded_file_id=file_id).update(
+            visible_from=None, visible_until=None, window_active=False
+        )
+        return result
+
+    def sync_allotments(self):
+        # Push the window bounds down onto the file's allotments
+        return SeatAllotment.objects.filter(uploaded_file_id=self.file_id).update(
+            visible_from=self.visible_from,
+            visible_until=self.visible_until,
+            window_active=self.is_active_manual,
+        )
+
     def __str__(self):
         return f"Window for {self.file.filename()}"
 
@@ -71,3 +119,152 @@ class AdminAuditLog(models.Model):
 
     def __str__(self):
         return f"{self.user} - {self.action} - {self.timestamp}"
+
+class UploadRawRows(models.Model):
+    """
+    The raw parsed table rows of a published upload, stored once per upload as
+    zlib-compressed JSON with the column names once per page (core.raw_rows).
+    Nothing on the student lookup path reads this table.
+    """
+    upload = models.OneToOneField(UploadedFile, on_delete=models.CASCADE, related_name='raw_rows')
+    data = models.BinaryField()
+    row_count = models.PositiveIntegerField(default=0)
+    raw_size = models.PositiveIntegerField(default=0)  # uncompressed JSON bytes
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Raw rows of {self.upload.filename()} ({self.row_count} rows)"
+
+class ParseCache(models.Model):
+    """
+    Parser output for a .docx, keyed by the file's SHA-256 and the parser version
+    that produced it, so re-uploading an identical file skips parsing.
+    """
+    content_hash = models.CharField(max_length=64)
+    parser_version = models.PositiveIntegerField()
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'parser_version'], name='parse_cache_hash_version_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} (parser v{self.parser_version})"
+
+class ParseJob(models.Model):
+    """
+    One upload submission waiting to be parsed (see core.jobs). The queue is this
+    table: workers claim a queued job with a conditional UPDATE, keep its
+    heartbeat fresh while parsing, and jobs whose worker died are re-queued or
+    failed once their heartbeat goes stale.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    # [{"upload_id": ..., "filename": ...}] in upload order
+    files = models.JSONField(default=list)
+    files_done = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    # {"batch_id": <StagingBatch id>, "errors": [...]}, set when the job is done
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # When the uploader was shown the outcome (preview opened or failure displayed)
+    seen_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='parse_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Parse job {self.id} ({self.status})"
+
+class StagingBatch(models.Model):
+    """
+    Parsed but not yet published uploads, previewed and edited by an admin
+    (see core.staging). Replaces keeping the parsed pages in the session.
+    """
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    uploads = models.ManyToManyField(UploadedFile, related_name='staging_batches')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Staging batch {self.id}"
+
+class StagingPage(models.Model):
+    batch = models.ForeignKey(StagingBatch, on_delete=models.CASCADE, related_name='pages')
+    upload = models.ForeignKey(UploadedFile, on_delete=models.CASCADE, related_name='+')
+    # Order within the batch; page_idx is the parser's block number and repeats across files
+    position = models.PositiveIntegerField()
+    page_idx = models.IntegerField()
+    room = models.CharField(max_length=50)
+    record_count = models.PositiveIntegerField(default=0)
+    # Header of the page's student table: names the cells of each record's raw_data
+    columns = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ['position']
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'position'], name='staging_page_position_uniq'),
+        ]
+
+    def filename(self):
+        return self.upload.filename()
+
+class StagingRecord(models.Model):
+    page = models.ForeignKey(StagingPage, on_delete=models.CASCADE, related_name='records')
+    row_idx = models.PositiveIntegerField()
+    usn = models.CharField(max_length=20)  # normalized
+    seat = models.CharField(max_length=50)
+    course = models.CharField(max_length=50, blank=True)
+    raw_data = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ['row_idx']
+        constraints = [
+            models.UniqueConstraint(fields=['page', 'row_idx'], name='staging_record_row_uniq'),
+        ]
+
+class DataVersion(models.Model):
+    """
+    Monotonic counter bumped whenever published data changes.
+    Workers compare it against the version their in-memory caches were built from.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def current(cls, name):
+        return cls.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    async def acurrent(cls, name):
+        return await cls.objects.filter(name=name).values_list('version', flat=True).afirst() or 0
+
+    @classmethod
+    def bump(cls, name):
+        updated = cls.objects.filter(name=name).update(version=F('version') + 1, updated_at=timezone.now())
+        if not updated:
+            cls.objects.get_or_create(name=name)
+            cls.objects.filter(name=name).update(version=F('version') + 1, updated_at=timezone.now())
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
@@ -1,7 +1,27 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from docx import Document
+from docx.oxml import parse_xml
+from django.conf import settings
+from lxml import etree
+import logging
+import multiprocessing
+import posixpath
 import re
+import threading
+import time
+import zipfile
 from datetime import datetime
 
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a change to the parsing logic changes what it returns for the same
+# file: cached parse results (core.models.ParseCache) are keyed by it
+PARSER_VERSION = 2
+
 # ==============================
 from docx import Document
 
@@ -11,32 +31,32 @@ TBL_TAG = WORD_NAMESPACE + 'tbl'
 TEXT_TAG = WORD_NAMESPACE + 't'
 TEXT_BOX_TAG = WORD_NAMESPACE + 'txbxContent'
 
+def normalize_usn(usn):
+    # Canonical USN used for lookups: trimmed, upper-cased, no internal whitespace
+    return re.sub(r'\s+', '', usn or '').upper()
+
 def get_clean_text(xml_element):
-    text_parts = []
-    for node in xml_element.findall(f'.//{TEXT_TAG}'):
-        if node.text:
-            text_parts.append(node.text)
-    return "".join(text_parts).strip()
+    # Same nodes as findall('.//w:t'), but iterdescendants skips the path machinery
+    return "".join([node.text for node in xml_element.iterdescendants(TEXT_TAG) if node.text]).strip()
 
-def get_all_headers(doc):
-    all_headers = []
-    for section in doc.sections:
-        header_data = {"floating": [], "standard": []}
-        header = section.header
-        xml_element = header._element
+def get_header_data(hdr_element):
+    # hdr_element is a parsed w:hdr (python-docx oxml element, so p.text matches Paragraph.text)
+    header_data = {"floating": [], "standard": []}
 
-        for box in xml_element.findall(f'.//{TEXT_BOX_TAG}'):
-            box_text = get_clean_text(box)
-            if box_text:
-                header_data["floating"].append(box_text)
+    for box in hdr_element.findall(f'.//{TEXT_BOX_TAG}'):
+        box_text = get_clean_text(box)
+        if box_text:
+            header_data["floating"].append(box_text)
 
-        for paragraph in header.paragraphs:
-            text = paragraph.text.strip()
-            if text:
-                header_data["standard"].append(text)
+    for paragraph in hdr_element.p_lst:
+        text = paragraph.text.strip()
+        if text:
+            header_data["standard"].append(text)
 
-        all_headers.append(header_data)
-    return all_headers
+    return header_data
+
+def get_all_headers(doc):
+    return [get_header_data(section.header._element) for section in doc.sections]
 
 def extract_interleaved_data(file_path):
     print(f"--- PROCESSING: {file_path} ---\n")
@@ -96,6 +116,82 @@ def extract_interleaved_data(file_path):
 
 # ==============================
 
+def table_rows(tbl_element):
+    rows_data = []
+    for row in tbl_element.findall(f'.//{WORD_NAMESPACE}tr'):
+        cells = row.findall(f'.//{WORD_NAMESPACE}tc')
+        row_text_list = [get_clean_text(cell) for cell in cells]
+        rows_data.append(row_text_list)
+    return rows_data
+
+def room_from_header(h_data, current_room):
+    """Room No for a block from its section header; keeps current_room if none found."""
+    # Extract Room from Header
+    # Image shows "Room No" "GBL301" in header area
+
+    # 1. Search in floating (text boxes)
+    for text in h_data["floating"]:
+        # Check for "Room No" label AND value in same string
+        room_match = re.search(r'(?:Room|Hall)\s*(?:No\.?)?\s*[:\-]?\s*([A-Za-z0-9\-\/]+)', text, re.IGNORECASE)
+        if room_match:
+            candidate = room_match.group(1).strip()
+            if len(candidate) > 1 and candidate.lower() not in ['no', 'date', 'session', 'time']:
+                current_room = candidate
+                break # Found it
+
+        # Fallback: if text is JUST "GBL301" or similar code?
+        # Only if we saw "Room" in a previous box? (Hard to track order)
+        # But let's check if it matches a Room Code pattern directly? (Dangerous)
+        if re.match(r'^[A-Z]{2,4}[0-9]{3}$', text.strip()): # e.g. GBL301
+            current_room = text.strip()
+
+    # 2. Search in standard paragraphs if not found in floating
+    if current_room == "-":
+        for text in h_data["standard"]:
+             room_match = re.search(r'(?:Room|Hall)\s*(?:No\.?)?\s*[:\-\.]?\s*([A-Za-z0-9\-\/]+)', text, re.IGNORECASE)
+             if room_match:
+                 candidate = room_match.group(1).strip()
+                 if len(candidate) > 1 and candidate.lower() not in ['no', 'date', 'session', 'time']:
+                     current_room = candidate
+                     break
+    return current_room
+
+def student_records(rows_data):
+    header = [c.lower() for c in rows_data[0]]
+
+    usn_idx = -1
+    seat_idx = -1
+    course_idx = -1
+
+    for idx, col in enumerate(header):
+        if "register" in col or "usn" in col: usn_idx = idx
+        if "sl" in col and "no" in col: seat_idx = idx # Explicit: Sl. No IS Seat No
+        if "course" in col and "code" in col: course_idx = idx
+
+    records = []
+    for row_idx, row in enumerate(rows_data[1:]): # Skip table header
+        if not any(row): continue
+
+        usn_val = normalize_usn(row[usn_idx]) if usn_idx != -1 and usn_idx < len(row) else "UNKNOWN"
+        seat_val = row[seat_idx] if seat_idx != -1 and seat_idx < len(row) else "UNKNOWN"
+        course_val = row[course_idx] if course_idx != -1 and course_idx < len(row) else "-"
+
+        if not usn_val or usn_val == "UNKNOWN": continue
+
+        records.append({
+            "usn": usn_val,
+            "seat": seat_val,
+            "course": course_val,
+            "raw_data": row
+        })
+    return records
+
+def is_block_start(first_row_str):
+    return "Date" in first_row_str or "Session" in first_row_str
+
+def is_student_table(first_row_str):
+    return "Register Number" in first_row_str or "Sl. No" in first_row_str
+
 def parse_exam_file_wrapper(file_path):
     """
     Wraps/Re-implements the logic to return structured data grouped by pages/blocks.
@@ -107,32 +203,29 @@ def parse_exam_file_wrapper(file_path):
 
     section_headers = get_all_headers(doc)
     current_block_index = 0
-    
-    import re
 
-    # Structure: [ { "page_idx": 1, "room": "GBL201", "records": [...] }, ... ]
+    # Structure: [ { "page_idx": 1, "room": "GBL201", "columns": [...], "records": [...] }, ... ]
     pages = []
     current_page_records = []
+    current_columns = []
     current_room = "-"
     
     # Helper to push current page
     def flush_page():
-        nonlocal current_page_records, current_block_index, current_room
+        nonlocal current_page_records, current_columns, current_block_index, current_room
         if current_page_records:
             pages.append({
                 "page_idx": current_block_index, 
                 "room": current_room,
+                "columns": current_columns,
                 "records": current_page_records
             })
             current_page_records = []
+        current_columns = []
 
     for element in doc.element.body:
         if element.tag == TBL_TAG:
-            rows_data = []
-            for row in element.findall(f'.//{WORD_NAMESPACE}tr'):
-                cells = row.findall(f'.//{WORD_NAMESPACE}tc')
-                row_text_list = [get_clean_text(cell) for cell in cells]
-                rows_data.append(row_text_list)
+            rows_data = table_rows(element)
 
             if not rows_data:
                 continue
@@ -140,72 +233,297 @@ def parse_exam_file_wrapper(file_path):
             first_row_str = " ".join(rows_data[0])
 
             # BLOCK / PAGE BREAK LOGIC
-            if "Date" in first_row_str or "Session" in first_row_str:
+            if is_block_start(first_row_str):
                 flush_page()
                 current_block_index += 1
                 
-                # Extract Room from Header
-                # Image shows "Room No" "GBL301" in header area
                 if current_block_index <= len(section_headers):
-                     h_data = section_headers[current_block_index - 1]
-                     
-                     # 1. Search in floating (text boxes)
-                     for text in h_data["floating"]:
-                         # Check for "Room No" label AND value in same string
-                         room_match = re.search(r'(?:Room|Hall)\s*(?:No\.?)?\s*[:\-]?\s*([A-Za-z0-9\-\/]+)', text, re.IGNORECASE)
-                         if room_match:
-                             candidate = room_match.group(1).strip()
-                             if len(candidate) > 1 and candidate.lower() not in ['no', 'date', 'session', 'time']:
-                                 current_room = candidate
-                                 break # Found it
-
-                         # Fallback: if text is JUST "GBL301" or similar code?
-                         # Only if we saw "Room" in a previous box? (Hard to track order)
-                         # But let's check if it matches a Room Code pattern directly? (Dangerous)
-                         if re.match(r'^[A-Z]{2,4}[0-9]{3}$', text.strip()): # e.g. GBL301
-                             current_room = text.strip()
-                     
-                     # 2. Search in standard paragraphs if not found in floating
-                     if current_room == "-":
-                         for text in h_data["standard"]:
-                              room_match = re.search(r'(?:Room|Hall)\s*(?:No\.?)?\s*[:\-\.]?\s*([A-Za-z0-9\-\/]+)', text, re.IGNORECASE)
-                              if room_match:
-                                  candidate = room_match.group(1).strip()
-                                  if len(candidate) > 1 and candidate.lower() not in ['no', 'date', 'session', 'time']:
-                                      current_room = candidate
-                                      break
+                     current_room = room_from_header(section_headers[current_block_index - 1], current_room)
 
-            elif "Register Number" in first_row_str or "Sl. No" in first_row_str:
-                header = [c.lower() for c in rows_data[0]]
-                
-                usn_idx = -1
-                seat_idx = -1
-                course_idx = -1
-                
-                for idx, col in enumerate(header):
-                    if "register" in col or "usn" in col: usn_idx = idx
-                    if "sl" in col and "no" in col: seat_idx = idx # Explicit: Sl. No IS Seat No
-                    if "course" in col and "code" in col: course_idx = idx
-                
-                for row_idx, row in enumerate(rows_data[1:]): # Skip table header
-                    if not any(row): continue
-                    
-                    usn_val = row[usn_idx] if usn_idx != -1 and usn_idx < len(row) else "UNKNOWN"
-                    seat_val = row[seat_idx] if seat_idx != -1 and seat_idx < len(row) else "UNKNOWN"
-                    course_val = row[course_idx] if course_idx != -1 and course_idx < len(row) else "-"
-                    
-                    if not usn_val or usn_val == "UNKNOWN": continue
-
-                    record = {
-                        "usn": usn_val,
-                        "seat": seat_val,
-                        "course": course_val,
-                        "raw_data": row
-                    }
-                    
-                    current_page_records.append(record)
+            elif is_student_table(first_row_str):
+                current_page_records.extend(student_records(rows_data))
+                # Header of the page's first student table names the raw_data cells
+                current_columns = current_columns or rows_data[0]
 
     # Flush last page
     flush_page()
             
     return {"pages": pages, "total_count": sum(len(p['records']) for p in pages)}
+
+# ==============================
+# STREAMING PARSER
+# ==============================
+# Same output as parse_exam_file_wrapper without building the python-docx object
+# model: word/document.xml is read from the zip with lxml iterparse, one top-level
+# element at a time (each is dropped once handled), and a section's header part
+# is only loaded when a block actually needs it. Pages are yielded as soon as
+# their room is known, so memory stays at about one page regardless of file size.
+# Table rows, records and room detection use the helpers above, so the two
+# parsers can only differ in how they walk the file (see core/tests.py).
+
+BODY_TAG = WORD_NAMESPACE + 'body'
+SECT_PR_TAG = WORD_NAMESPACE + 'sectPr'
+P_PR_TAG = WORD_NAMESPACE + 'pPr'
+HEADER_REF_TAG = WORD_NAMESPACE + 'headerReference'
+W_TYPE_ATTR = WORD_NAMESPACE + 'type'
+R_ID_ATTR = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+RELS_NAMESPACE = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+OFFICE_DOCUMENT_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+
+EMPTY_HEADER = {"floating": [], "standard": []}
+
+def _part_targets(docx_zip, part_name):
+    """rId -> zip member name for the internal relationships of part_name."""
+    part_dir, part_file = posixpath.split(part_name)
+    rels_name = posixpath.join(part_dir, '_rels', part_file + '.rels')
+    try:
+        rels = etree.fromstring(docx_zip.read(rels_name))
+    except KeyError:
+        return {}
+    targets = {}
+    for rel in rels.iter(f'{RELS_NAMESPACE}Relationship'):
+        if rel.get('TargetMode') == 'External':
+            continue
+        target = rel.get('Target')
+        path = target[1:] if target.startswith('/') else posixpath.normpath(posixpath.join(part_dir, target))
+        targets[rel.get('Id')] = (rel.get('Type'), path)
+    return targets
+
+def _main_document_part(docx_zip):
+    for rel_type, path in _part_targets(docx_zip, '').values():
+        if rel_type == OFFICE_DOCUMENT_REL:
+            return path
+    raise ValueError("No main document part found; not a .docx file?")
+
+def _default_header_rid(sect_pr, inherited):
+    # python-docx section.header: the section's own default header, otherwise
+    # the one of the nearest preceding w:sectPr (linked to previous)
+    for ref in sect_pr.iterchildren(HEADER_REF_TAG):
+        if ref.get(W_TYPE_ATTR) == 'default':
+            return ref.get(R_ID_ATTR)
+    return inherited
+
+def _is_document_section(sect_pr, body):
+    # Same set as Document.sections: w:body/w:p/w:pPr/w:sectPr and w:body/w:sectPr
+    parent = sect_pr.getparent()
+    if parent is body:
+        return True
+    if parent.tag != P_PR_TAG:
+        return False
+    paragraph = parent.getparent()
+    return paragraph.tag == PARA_TAG and paragraph.getparent() is body
+
+def iter_exam_pages(file_path):
+    """
+    Yields the pages of parse_exam_file_wrapper's result one at a time, in order.
+    Raises on unreadable files.
+    """
+    with zipfile.ZipFile(file_path) as docx_zip:
+        document_part = _main_document_part(docx_zip)
+        document_rels = _part_targets(docx_zip, document_part)
+
+        header_cache = {}
+
+        def header_for(rid):
+            if rid is None:
+                return EMPTY_HEADER
+            if rid not in header_cache:
+                header_cache.clear()  # sections are visited in order, keep just the latest
+                header_cache[rid] = get_header_data(parse_xml(docx_zip.read(document_rels[rid][1])))
+            return header_cache[rid]
+
+        with docx_zip.open(document_part) as document_xml:
+            yield from _stream_pages(document_xml, header_for)
+
+def _stream_pages(document_xml, header_for):
+    body = None
+    section_rids = []      # resolved default header rId of each section seen so far
+    inherited_rid = None
+
+    block_index = 0
+    records = []
+    columns = []
+    rooms_known = 0        # blocks 1..rooms_known have their room worked out
+    room = "-"
+    waiting = deque()      # flushed pages whose section header has not been reached yet
+
+    def flush_page():
+        nonlocal records, columns
+        if records:
+            waiting.append({"page_idx": block_index, "room": None, "columns": columns, "records": records})
+            records = []
+        columns = []
+
+    def resolve(at_end=False):
+        # Block k takes its room from section k's header (or keeps the previous
+        # room when the document has fewer sections), so rooms are worked out in
+        # order as soon as that section's w:sectPr has been read
+        nonlocal rooms_known, room
+        while waiting and waiting[0]["page_idx"] <= rooms_known:
+            page = waiting.popleft()
+            page["room"] = room
+            yield page
+        while rooms_known < block_index and (at_end or rooms_known < len(section_rids)):
+            rooms_known += 1
+            if rooms_known <= len(section_rids):
+                room = room_from_header(header_for(section_rids[rooms_known - 1]), room)
+            while waiting and waiting[0]["page_idx"] <= rooms_known:
+                page = waiting.popleft()
+                page["room"] = room
+                yield page
+
+    # Only tables and section properties matter; everything else is skipped by
+    # libxml2 without a Python round trip and dropped along with the next table.
+    # (No remove_blank_text as in python-docx's parser: it only drops whitespace
+    # between elements, never the w:t text read here.)
+    events = etree.iterparse(
+        document_xml, events=('end',), tag=(TBL_TAG, SECT_PR_TAG), resolve_entities=False,
+    )
+    for _, element in events:
+        if body is None:
+            body = next(element.iterancestors(BODY_TAG), None)
+            if body is None:
+                continue
+
+        if element.tag == SECT_PR_TAG:
+            inherited_rid = _default_header_rid(element, inherited_rid)
+            if _is_document_section(element, body):
+                section_rids.append(inherited_rid)
+                yield from resolve()
+
+        top_level = element
+        while top_level.getparent() is not body:
+            top_level = top_level.getparent()
+            if top_level is None:
+                break
+        if top_level is not element:
+            # Inside a top-level element still being read (nested table, w:p/w:pPr/w:sectPr)
+            continue
+
+        if element.tag == TBL_TAG:
+            rows_data = table_rows(element)
+            if rows_data:
+                first_row_str = " ".join(rows_data[0])
+                if is_block_start(first_row_str):
+                    flush_page()
+                    block_index += 1
+                    yield from resolve()
+                elif is_student_table(first_row_str):
+                    records.extend(student_records(rows_data))
+                    columns = columns or rows_data[0]
+
+        # Done with this table (and any paragraphs etc. before it). clear() first:
+        # removing a populated subtree makes lxml walk it, freeing it in place does not
+        element.clear()
+        while element.getprevious() is not None:
+            body[0].clear()
+            del body[0]
+        body.remove(element)
+
+    flush_page()
+    yield from resolve(at_end=True)
+
+def parse_exam_file_streaming(file_path):
+    """Drop-in replacement for parse_exam_file_wrapper built on iter_exam_pages."""
+    try:
+        pages = list(iter_exam_pages(file_path))
+    except Exception as e:
+        return {"error": str(e), "data": []}
+    return {"pages": pages, "total_count": sum(len(p['records']) for p in pages)}
+
+def parse_exam_file(file_path, parser=None):
+    """Parses with `parser` ('streaming' or 'python-docx'), default settings.DOCX_PARSER."""
+    if (parser or settings.DOCX_PARSER) == 'streaming':
+        result = parse_exam_file_streaming(file_path)
+        if not result.get("error"):
+            return result
+        # Let python-docx have a go (and produce its error message) before giving up
+        logger.warning(f"Streaming parser failed on {file_path}: {result['error']}; retrying with python-docx")
+    return parse_exam_file_wrapper(file_path)
+
+# ==============================
+# PARALLEL PARSING (multi-file uploads)
+# ==============================
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def _get_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # forkserver: workers are not forked from a threaded web worker holding
+            # DB connections; they only import this module
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+            _parse_pool = ProcessPoolExecutor(max_workers=settings.PARSE_WORKERS, mp_context=context)
+        return _parse_pool
+
+def _discard_parse_pool(pool):
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _timed_parse(file_path, parser):
+    # Runs in the pool workers, which do not record metrics; parse_many does
+    started = time.perf_counter()
+    return parse_exam_file(file_path, parser), time.perf_counter() - started
+
+def _observed(timed):
+    result, seconds = timed
+    metrics.PARSE_DURATION.observe(seconds, result='error' if result.get('error') else 'parsed')
+    return result
+
+def _parse_error(file_path, e):
+    logger.error(f"Parsing {file_path} failed: {e!r}")
+    return {"error": str(e) or e.__class__.__name__, "data": []}
+
+def parse_many(file_paths, on_parsed=None):
+    """
+    parse_exam_file for several files at once, in a pool of settings.PARSE_WORKERS
+    processes. Results come back in the order of file_paths. A file that fails,
+    even by killing its worker, gets an {"error": ...} result of its own.
+    on_parsed, if given, is called with no arguments as each file finishes.
+    """
+    parser = settings.DOCX_PARSER
+    if len(file_paths) < 2 or settings.PARSE_WORKERS < 2:
+        results = []
+        for path in file_paths:
+            results.append(_observed(_timed_parse(path, parser)))
+            if on_parsed:
+                on_parsed()
+        return results
+
+    pool = _get_parse_pool()
+    futures = [pool.submit(_timed_parse, path, parser) for path in file_paths]
+    results = []
+    crashed = []
+    for index, (path, future) in enumerate(zip(file_paths, futures)):
+        try:
+            results.append(_observed(future.result()))
+        except BrokenProcessPool:
+            results.append(None)
+            crashed.append(index)
+        except Exception as e:
+            results.append(_parse_error(path, e))
+        if on_parsed and index not in crashed:
+            on_parsed()
+
+    if crashed:
+        # A worker died (segfault, OOM kill) and took the pool with it. Retry the
+        # affected files one at a time in fresh pools so only the culprit fails.
+        _discard_parse_pool(pool)
+        for index in crashed:
+            pool = _get_parse_pool()
+            try:
+                results[index] = _observed(pool.submit(_timed_parse, file_paths[index], parser).result())
+            except BrokenProcessPool as e:
+                _discard_parse_pool(pool)
+                results[index] = _parse_error(file_paths[index], e)
+            except Exception as e:
+                results[index] = _parse_error(file_paths[index], e)
+            if on_parsed:
+                on_parsed()
+    return results
@@ -0,0 +1,137 @@
+"""
+Sampled request profiles for finding the slow view or query on exam morning.
+
+core.middleware.ProfilerMiddleware picks PROFILER_SAMPLE_RATE of all requests
+(0 = off, the default) and records for each: the view, status, total time,
+and every SQL statement with its time, collected by the same per-connection
+execute wrapper QueryCountMiddleware uses. Statements are stored without
+their parameters, so USNs and other request data stay out of the log. With
+PROFILER_CPROFILE on, sampled sync requests also run under cProfile; the
+function listing is kept for requests taking at least PROFILER_SLOW_MS.
+
+An unsampled request costs one random() call. A sampled one costs a timer
+per query and a line appended to the log; cProfile roughly doubles the time
+of the requests it profiles, so keep the sample rate small with it on.
+
+Each process appends profiles as JSON lines to PROFILER_DIR/<pid>.jsonl,
+rotated at PROFILER_LOG_MAX_BYTES with PROFILER_LOG_BACKUPS old files kept.
+The staff page at dashboard/profiles/ (core.views.profiles) shows the recent
+profiles of all processes.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+from collections import Counter
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+SQL_MAX_CHARS = 2000
+REPEATED_TOP = 5
+PROFILE_TOP_FUNCTIONS = 30
+
+_lock = threading.Lock()
+_handler = None
+_handler_pid = None
+
+
+def sampled():
+    return random.random() < settings.PROFILER_SAMPLE_RATE
+
+
+def start_cprofile():
+    """A running cProfile.Profile if PROFILER_CPROFILE is on, else None."""
+    if not settings.PROFILER_CPROFILE:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None  # another profiler is already active
+    return profiler
+
+
+def _profile_text(profiler):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    return out.getvalue()
+
+
+def build_profile(method, path, view, status, seconds, statements, profiler=None):
+    """statements is [(sql, seconds, many)] in execution order."""
+    counts = Counter(sql for sql, _, _ in statements)
+    ms = round(seconds * 1000, 2)
+    return {
+        'at': timezone.now().isoformat(),
+        'pid': os.getpid(),
+        'method': method,
+        'path': path,
+        'view': view,
+        'status': status,
+        'ms': ms,
+        'sql_ms': round(sum(elapsed for _, elapsed, _ in statements) * 1000, 2),
+        'queries': len(statements),
+        # The first PROFILER_MAX_QUERIES statements; the rest are only counted
+        'statements': [
+            {'sql': sql[:SQL_MAX_CHARS], 'ms': round(elapsed * 1000, 3), 'many': many}
+            for sql, elapsed, many in statements[:settings.PROFILER_MAX_QUERIES]
+        ],
+        # The same statement run again and again is usually a query in a loop
+        'repeated': [
+            {'sql': sql[:SQL_MAX_CHARS], 'count': count}
+            for sql, count in counts.most_common(REPEATED_TOP) if count > 1
+        ],
+        'profile': _profile_text(profiler) if profiler is not None and ms >= settings.PROFILER_SLOW_MS else None,
+    }
+
+
+def _get_handler():
+    # One file per process, opened lazily so forked workers each get their own
+    global _handler, _handler_pid
+    if _handler_pid != os.getpid():
+        os.makedirs(settings.PROFILER_DIR, exist_ok=True)
+        _handler = RotatingFileHandler(
+            os.path.join(settings.PROFILER_DIR, f"{os.getpid()}.jsonl"),
+            maxBytes=settings.PROFILER_LOG_MAX_BYTES,
+            backupCount=settings.PROFILER_LOG_BACKUPS,
+        )
+        _handler_pid = os.getpid()
+    return _handler
+
+
+def write_profile(profile):
+    line = json.dumps(profile, separators=(',', ':'))
+    with _lock:
+        _get_handler().emit(logging.makeLogRecord({'msg': line}))
+
+
+def recent_profiles(limit=100, sort='recent'):
+    """The latest profiles of all processes, newest first, or slowest first with sort='slowest'."""
+    profiles = []
+    try:
+        names = os.listdir(settings.PROFILER_DIR)
+    except FileNotFoundError:
+        return profiles
+    for name in names:
+        if '.jsonl' not in name:
+            continue
+        try:
+            with open(os.path.join(settings.PROFILER_DIR, name)) as f:
+                for line in f:
+                    try:
+                        profiles.append(json.loads(line))
+                    except ValueError:
+                        pass  # a line still being written, or cut by a crash
+        except OSError:
+            continue  # rotated away while listing
+    key = (lambda p: p['ms']) if sort == 'slowest' else (lambda p: p['at'])
+    profiles.sort(key=key, reverse=True)
+    return profiles[:limit]
@@ -0,0 +1,156 @@
+"""
+Host-wide rate limiter shared by every worker process.
+
+Counters live in a small memory-mapped file (RATE_LIMIT_FILE), so all gunicorn
+/uvicorn workers on the host see the same numbers. Django's default
+LocMemCache is per process, which made the real limit N workers x the
+configured one.
+
+The file is a fixed-size open-addressing hash table. Each slot holds the
+key's 64-bit hash, the index of the current window and the request counts for
+the current and previous windows. These give a sliding-window estimate:
+
+    previous * (time left in the current window / window) + current
+
+Each check reads, updates and writes back one slot while holding an fcntl
+byte-range lock on that key's probe range, plus a process-local
+threading.Lock (POSIX record locks do not exclude threads of the same
+process). A check costs a few microseconds: no network and no SQL.
+
+If every probe slot for a key holds a live counter, the oldest one is taken
+over, so a flooded table fails open rather than blocking anyone. On platforms
+without fcntl only the thread lock is used, so counts are atomic within a
+process but not across processes.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from django.conf import settings
+
+MAGIC = b'SARL0001'
+HEADER = struct.Struct('<8sQ')  # magic, slot count
+SLOT = struct.Struct('<QqII')  # key hash, window index, current count, previous count
+PROBES = 8
+
+
+class SharedRateLimiter:
+    def __init__(self, path, slots):
+        self.path = str(path)
+        self.slots = max(int(slots), PROBES)
+        self.size = HEADER.size + self.slots * SLOT.size
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def allow(self, key, limit, window, now=None):
+        """
+        Count one request for `key` unless that would exceed `limit` requests
+        per `window` seconds. Returns (allowed, estimated count before this request).
+        """
+        now = time.time() if now is None else now
+        current_window, into_window = divmod(now, window)
+        current_window = int(current_window)
+
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        first = digest % (self.slots - PROBES + 1)
+
+        with self._thread_lock:
+            self._open()
+            self._lock_range(first, fcntl.LOCK_EX if fcntl else None)
+            try:
+                offset, (_, slot_window, current, previous) = self._find_slot(digest, first, current_window)
+
+                if slot_window == current_window:
+                    pass
+                elif slot_window == current_window - 1:
+                    previous, current = current, 0
+                else:
+                    previous = current = 0
+
+                estimate = previous * (1 - into_window / window) + current
+                allowed = estimate + 1 <= limit
+                if allowed:
+                    current += 1
+                SLOT.pack_into(self._map, offset, digest, current_window, current, previous)
+            finally:
+                self._lock_range(first, fcntl.LOCK_UN if fcntl else None)
+        return allowed, estimate
+
+    def _find_slot(self, digest, first, current_window):
+        # The key's own slot may sit behind a free one (its earlier slot was taken
+        # when it arrived and has gone idle since), so look at every probe first
+        free = oldest = None
+        for i in range(first, first + PROBES):
+            offset = HEADER.size + i * SLOT.size
+            slot = SLOT.unpack_from(self._map, offset)
+            if slot[0] == digest:
+                return offset, slot
+            # Empty, or idle for two windows (its counts no longer matter)
+            if free is None and (slot[0] == 0 or slot[1] < current_window - 1):
+                free = offset
+            if oldest is None or slot[1] < oldest[1][1]:
+                oldest = (offset, slot)
+        if free is not None:
+            return free, (digest, 0, 0, 0)
+        # Every probe slot is live: take over the oldest one
+        return oldest[0], (digest, 0, 0, 0)
+
+    def _lock_range(self, first, op):
+        if op is not None:
+            fcntl.lockf(self._fd, op, PROBES * SLOT.size, HEADER.size + first * SLOT.size)
+
+    def _open(self):
+        # Opened lazily and re-opened after fork so each worker has its own fd/mapping
+        if self._pid == os.getpid():
+            return
+        self._close()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl:
+                fcntl.lockf(fd, fcntl.LOCK_EX, HEADER.size, 0)
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                header = os.read(fd, HEADER.size)
+                if len(header) != HEADER.size or HEADER.unpack(header) != (MAGIC, self.slots):
+                    # New file, or one written with a different layout/size: start from zero
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self.size)
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    os.write(fd, HEADER.pack(MAGIC, self.slots))
+            finally:
+                if fcntl:
+                    fcntl.lockf(fd, fcntl.LOCK_UN, HEADER.size, 0)
+            self._map = mmap.mmap(fd, self.size)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._pid = os.getpid()
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+        self._map = self._fd = self._pid = None
+
+
+_limiter = None
+
+
+def get_limiter():
+    global _limiter
+    # Rebuilt if the settings change (tests point RATE_LIMIT_FILE elsewhere)
+    if (_limiter is None or _limiter.path != str(settings.RATE_LIMIT_FILE)
+            or _limiter.slots != max(int(settings.RATE_LIMIT_TABLE_SLOTS), PROBES)):
+        _limiter = SharedRateLimiter(settings.RATE_LIMIT_FILE, settings.RATE_LIMIT_TABLE_SLOTS)
+    return _limiter
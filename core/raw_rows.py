@@ -0,0 +1,68 @@
+"""
+Compact storage for the raw parsed table rows behind published allotments.
+
+SeatAllotment used to carry every row's cells in an other_data JSON column
+that the student API never returns. The rows are now kept once per upload in
+UploadRawRows: one zlib-compressed JSON document per upload, with the table's
+column names stored once per page instead of once per row:
+
+    {"pages": [{"page_idx": 1, "room": "GBL201", "columns": [...], "rows": [[...], ...]}]}
+
+Rows are archived as parsed; preview edits only change the allotments.
+With RAW_ROWS_STORAGE = 'drop' nothing is kept.
+"""
+import json
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+
+from .models import StagingPage, StagingRecord, UploadRawRows
+
+
+def pack(pages):
+    raw = json.dumps({'pages': pages}, separators=(',', ':'), ensure_ascii=False).encode()
+    return zlib.compress(raw, 6), len(raw)
+
+
+def unpack(data):
+    return json.loads(zlib.decompress(bytes(data)))['pages']
+
+
+def raw_rows_entry(upload, pages):
+    """Unsaved UploadRawRows for upload; pages as in the module docstring."""
+    data, raw_size = pack(pages)
+    return UploadRawRows(
+        upload=upload, data=data, raw_size=raw_size, row_count=sum(len(page['rows']) for page in pages),
+    )
+
+
+def archive_batch(batch):
+    """Stores the raw rows of every upload in a staging batch. Returns the number of uploads archived."""
+    if settings.RAW_ROWS_STORAGE != 'compressed':
+        return 0
+
+    rows = defaultdict(list)
+    for page_id, raw_data in StagingRecord.objects.filter(page__batch=batch).order_by('id').values_list(
+        'page_id', 'raw_data'
+    ).iterator(chunk_size=5000):
+        rows[page_id].append(raw_data)
+
+    pages = defaultdict(list)
+    for page in StagingPage.objects.filter(batch=batch).values('id', 'upload_id', 'page_idx', 'room', 'columns'):
+        pages[page['upload_id']].append({
+            'page_idx': page['page_idx'],
+            'room': page['room'],
+            'columns': page['columns'],
+            'rows': rows.get(page['id'], []),
+        })
+
+    entries = [raw_rows_entry(upload, pages[upload.id]) for upload in batch.uploads.all() if pages[upload.id]]
+    UploadRawRows.objects.bulk_create(entries)
+    return len(entries)
+
+
+def load_raw_rows(upload):
+    """The archived pages of upload (see the module docstring), or [] if none were kept."""
+    data = UploadRawRows.objects.filter(upload=upload).values_list('data', flat=True).first()
+    return unpack(data) if data is not None else []
@@ -0,0 +1,269 @@
+"""
+Pre-rendered student results served as static files.
+
+For the set of currently visible windows we write one JSON file per USN
+prefix (the USN minus its last two characters, i.e. ~100 consecutive register
+numbers) under RESULT_SHARDS_ROOT/<generation>/, with gzip/brotli variants,
+plus RESULT_SHARDS_ROOT/manifest.json describing the windows and how long the
+generation stays valid. ResultShardMiddleware serves these straight from disk,
+so index.html can answer most lookups without reaching a view or the DB.
+
+A generation is named by allotment_index.state_token(), so it is
+rebuilt whenever either changes and withdrawn (directory removed, manifest
+cleared) once no window is visible. Publish/delete/admin edits schedule a
+sync via allotments_changed(), run after the commit in a background thread
+(schedule_sync) so the admin's request does not wait for the compression.
+Time boundaries (a window opening or closing) need no cron: the manifest's
+valid_until is the next boundary, and once it has passed the middleware
+stops serving that manifest and its shards and schedules a sync itself.
+Syncs from all processes on the host take turns on a lock file.
+
+`manage.py warm_up_allotments` writes the generation of an upcoming window
+ahead of its opening (prewrite_generation). Such a directory carries an
+.opens_at marker and is kept until then, so the sync at opening only has to
+switch the manifest over.
+"""
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from whitenoise.compress import Compressor
+
+from .allotment_index import VERSION_KEY, serialize_allotment, state_token, visible_windows
+from .models import DataVersion, SeatAllotment
+
+try:
+    import fcntl
+except ImportError:  # Windows: syncs from different processes are not serialized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+OPENS_AT_MARKER = '.opens_at'
+SYNC_LOCK_NAME = '.sync.lock'
+
+_sync_lock = threading.Lock()
+_sync_thread = None
+_sync_pid = None
+_sync_pending = False
+
+
+def shard_key(usn_normalized):
+    # Mirrored in templates/index.html (shardKey)
+    return re.sub(r'[^A-Z0-9]', '_', usn_normalized[:-2] or '_')
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST_NAME), 'rb') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_generation(root, generation, file_ids):
+    """Stream the visible allotments into shard files, one prefix group at a time."""
+    tmp_dir = os.path.join(root, f"{generation}.tmp-{os.getpid()}")
+    os.makedirs(tmp_dir, exist_ok=True)
+    compressor = Compressor(quiet=True)
+
+    rows = SeatAllotment.objects.filter(
+        uploaded_file_id__in=file_ids
+    ).order_by('usn_normalized', 'id').values_list(
+        'usn_normalized', 'usn', 'room_no', 'seat_no', 'course_code', 'exam_start_time'
+    ).iterator(chunk_size=2000)
+
+    shard_count = record_count = 0
+    for key, group in itertools.groupby(rows, key=lambda row: shard_key(row[0])):
+        shard = {}
+        for usn_normalized, *row in group:
+            # Same rule as the lookup index: lowest id wins for duplicate USNs
+            if usn_normalized not in shard:
+                shard[usn_normalized] = serialize_allotment(*row)
+        path = os.path.join(tmp_dir, f"{key}.json")
+        with open(path, 'w') as f:
+            json.dump(shard, f, separators=(',', ':'))
+        compressor.compress(path)
+        shard_count += 1
+        record_count += len(shard)
+
+    final_dir = os.path.join(root, generation)
+    old_dir = f"{final_dir}.old-{os.getpid()}"
+    if os.path.isdir(final_dir):
+        # --force rewrite: swap the directories so readers never see a partial set
+        os.rename(final_dir, old_dir)
+    try:
+        os.rename(tmp_dir, final_dir)
+    except OSError:
+        # Another process finished the same generation first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return shard_count, record_count
+
+
+def _opens_later(path):
+    # A generation written ahead of its window's opening
+    try:
+        with open(os.path.join(path, OPENS_AT_MARKER)) as f:
+            return datetime.fromisoformat(f.read().strip()) > timezone.now()
+    except (OSError, ValueError):
+        return False
+
+
+def _remove_stale_generations(root, keep):
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name == keep or not os.path.isdir(path) or _opens_later(path):
+            continue
+        if '.tmp-' in name and time.time() - os.path.getmtime(path) < 3600:
+            continue  # possibly still being written by another process
+        shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def _host_lock(root):
+    # One sync at a time per host; a waiting sync then usually finds the shards up to date
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(root, SYNC_LOCK_NAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def sync_result_shards(force=False):
+    """
+    Bring the on-disk shards in line with the currently visible windows.
+    Returns a short description of what was done.
+    """
+    root = str(settings.RESULT_SHARDS_ROOT)
+    os.makedirs(root, exist_ok=True)
+    with _host_lock(root):
+        return _sync(root, force)
+
+
+def _sync(root, force):
+    now = timezone.now()
+    version = DataVersion.current(VERSION_KEY)
+    windows, valid_until = visible_windows(now)
+    generation = state_token(version, windows) if windows else None
+
+    manifest = _read_manifest(root)
+    if (not force and manifest is not None and manifest.get('generation') == generation
+            and (generation is None or os.path.isdir(os.path.join(root, generation)))):
+        return f"Result shards up to date (generation {generation})"
+
+    started = time.monotonic()
+    shard_count = record_count = 0
+    written = generation is not None and (force or not os.path.isdir(os.path.join(root, generation)))
+    if written:
+        shard_count, record_count = _write_generation(root, generation, [w['file_id'] for w in windows])
+
+    new_manifest = {
+        "generation": generation,
+        "base_url": f"{settings.RESULT_SHARDS_URL}{generation}/" if generation else None,
+        "valid_until": valid_until,
+        "generated_at": now,
+        "windows": [
+            {
+                "id": w['id'],
+                "name": w['window_name'],
+                "visible_from": w['visible_from'],
+                "visible_until": w['visible_until'],
+            }
+            for w in windows
+        ],
+    }
+    # The manifest is tiny and rewritten in place, so it is never precompressed
+    # (a stale .gz/.br next to a fresh manifest would be served instead of it)
+    _write_atomic(
+        os.path.join(root, MANIFEST_NAME),
+        json.dumps(new_manifest, cls=DjangoJSONEncoder).encode(),
+    )
+    _remove_stale_generations(root, keep=generation)
+
+    if generation is None:
+        summary = "Result shards withdrawn (no visible windows)"
+    elif not written:
+        summary = f"Result shards switched to generation {generation} (written ahead by warm-up)"
+    else:
+        summary = (
+            f"Result shards generation {generation}: {record_count} USNs in {shard_count} shards "
+            f"for {len(windows)} windows in {time.monotonic() - started:.2f}s"
+        )
+    logger.info(summary)
+    return summary
+
+
+def prewrite_generation(generation, file_ids, opens_at):
+    """
+    Writes the shards of a generation that becomes current at opens_at, unless
+    they already exist. Returns (shards, records) written, or None if there was
+    nothing to do.
+    """
+    root = str(settings.RESULT_SHARDS_ROOT)
+    os.makedirs(root, exist_ok=True)
+    final_dir = os.path.join(root, generation)
+    if os.path.isdir(final_dir):
+        return None
+    written = _write_generation(root, generation, file_ids)
+    _write_atomic(os.path.join(final_dir, OPENS_AT_MARKER), opens_at.isoformat().encode())
+    return written
+
+
+def schedule_sync():
+    """
+    Runs sync_result_shards in a background thread of this process. Calls
+    made while a sync is running are folded into one more sync after it. The
+    thread is not a daemon, so a management command waits for it before exiting.
+    """
+    global _sync_thread, _sync_pid, _sync_pending
+    with _sync_lock:
+        _sync_pending = True
+        # A thread inherited through fork is not running in this process
+        if _sync_thread is not None and _sync_pid == os.getpid():
+            return _sync_thread
+        _sync_thread = threading.Thread(target=_sync_in_background, name='result-shard-sync')
+        _sync_pid = os.getpid()
+        _sync_thread.start()
+        return _sync_thread
+
+
+def _sync_in_background():
+    global _sync_thread, _sync_pending
+    try:
+        while True:
+            with _sync_lock:
+                if not _sync_pending:
+                    _sync_thread = None
+                    return
+                _sync_pending = False
+            try:
+                sync_result_shards()
+            except Exception as e:
+                # Shards are only an accelerator; the API still answers if this fails
+                logger.error(f"Result shard sync failed: {e}", exc_info=True)
+    finally:
+        connection.close()
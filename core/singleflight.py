@@ -0,0 +1,150 @@
+"""
+Per-worker request coalescing ("single flight") with a short-lived result cache.
+
+When a window opens the same USNs are looked up many times within
+milliseconds. SingleFlight.do(key, fn) runs fn once for all concurrent
+callers with the same key: the first caller runs it, the others wait for its
+result instead of running their own query. The result is then kept for
+`ttl` seconds (at most `max_keys` keys, least recently used dropped first),
+so the burst right after it is answered from memory too.
+
+Errors are not cached; every caller waiting on a failed call gets the error.
+The async variant, ado(key, factory), runs the shared call as its own task, so
+a client disconnecting (cancelling its request) does not cancel the query
+the other requests are waiting for.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from . import metrics
+
+_MISS = object()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, ttl, max_keys, name='default'):
+        # Callables so settings overrides (tests) apply to an existing instance
+        self.name = name
+        self._ttl = ttl
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._inflight = {}
+        self._ainflight = {}
+        self.calls = 0
+        self.hits = 0
+        self.coalesced = 0
+        self.executed = 0
+
+    def _get(self, key):
+        # Caller holds the lock
+        entry = self._results.get(key)
+        if entry is None:
+            return _MISS
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._results[key]
+            return _MISS
+        self._results.move_to_end(key)
+        return value
+
+    def _store(self, key, value):
+        with self._lock:
+            self.executed += 1
+            metrics.COALESCE.inc(flight=self.name, result='executed')
+            ttl = self._ttl()
+            if ttl <= 0:
+                return
+            self._results[key] = (time.monotonic() + ttl, value)
+            self._results.move_to_end(key)
+            while len(self._results) > self._max_keys():
+                self._results.popitem(last=False)
+
+    def do(self, key, fn):
+        with self._lock:
+            self.calls += 1
+            value = self._get(key)
+            if value is not _MISS:
+                self.hits += 1
+                metrics.COALESCE.inc(flight=self.name, result='cached')
+                return value
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self.coalesced += 1
+                metrics.COALESCE.inc(flight=self.name, result='coalesced')
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+            self._store(key, call.value)
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+
+    async def ado(self, key, factory):
+        with self._lock:
+            self.calls += 1
+            value = self._get(key)
+            if value is not _MISS:
+                self.hits += 1
+                metrics.COALESCE.inc(flight=self.name, result='cached')
+                return value
+
+        # Only ever touched from the event loop's thread
+        loop = asyncio.get_running_loop()
+        task = self._ainflight.get(key)
+        if task is not None and task.get_loop() is loop:
+            with self._lock:
+                self.coalesced += 1
+            metrics.COALESCE.inc(flight=self.name, result='coalesced')
+        else:
+            task = loop.create_task(self._arun(key, factory))
+            self._ainflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _arun(self, key, factory):
+        try:
+            value = await factory()
+            self._store(key, value)
+            return value
+        finally:
+            if self._ainflight.get(key) is asyncio.current_task():
+                del self._ainflight[key]
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'executed': self.executed,
+                'cache_hits': self.hits,
+                'coalesced': self.coalesced,
+                'saved': self.hits + self.coalesced,
+                'cached_keys': len(self._results),
+                'in_flight': len(self._inflight) + len(self._ainflight),
+            }
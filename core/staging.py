@@ -0,0 +1,198 @@
+"""
+Server-side staging of parsed uploads awaiting publish.
+
+A finished ParseJob writes its pages and records into StagingBatch /
+StagingPage / StagingRecord, and the preview session only keeps the batch id.
+Preview edits are single-row UPDATEs, and publishing copies the batch into
+SeatAllotment with INSERT ... SELECT statements, so neither edits nor publish
+push the full dataset through the session or through Python objects.
+
+publish_staged runs the whole publish (windows, uploads, allotments, audit
+entries, staging cleanup) in one transaction: it either all happens or none
+of it does.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from . import metrics
+from .allotment_index import allotments_changed
+from .raw_rows import archive_batch
+from .models import (
+    AdminAuditLog, SeatAllotment, StagingBatch, StagingPage, StagingRecord, UploadedFile, VisibilityWindow,
+)
+
+logger = logging.getLogger(__name__)
+
+STAGING_INSERT_BATCH_SIZE = 2000
+
+
+def stage_results(user, parsed):
+    """
+    Creates a StagingBatch from [(upload, pages)] as returned by the parser,
+    keeping the upload and page order. Returns the batch.
+    """
+    batch = StagingBatch.objects.create(user=user)
+    batch.uploads.set([upload for upload, _ in parsed])
+
+    page_objs = []
+    page_records = []
+    for upload, pages in parsed:
+        for page in pages:
+            page_objs.append(StagingPage(
+                batch=batch,
+                upload=upload,
+                position=len(page_objs),
+                page_idx=page['page_idx'],
+                room=page['room'],
+                record_count=len(page['records']),
+                columns=page.get('columns', []),
+            ))
+            page_records.append(page['records'])
+    StagingPage.objects.bulk_create(page_objs, batch_size=STAGING_INSERT_BATCH_SIZE)
+
+    StagingRecord.objects.bulk_create((
+        StagingRecord(
+            page=page,
+            row_idx=row_idx,
+            usn=record['usn'],
+            seat=record['seat'],
+            course=record['course'],
+            raw_data=record['raw_data'],
+        )
+        for page, records in zip(page_objs, page_records)
+        for row_idx, record in enumerate(records)
+    ), batch_size=STAGING_INSERT_BATCH_SIZE)
+    return batch
+
+
+def _columns(model, *names):
+    qn = connection.ops.quote_name
+    return ', '.join(qn(model._meta.get_field(name).column) for name in names)
+
+
+def publish_batch(batch, exam_start_time, visible_from, visible_until):
+    """
+    Copies every staged record of batch into SeatAllotment, carrying the window
+    bounds denormalized. Returns the number of rows inserted.
+
+    Runs one INSERT ... SELECT per PUBLISH_CHUNK_SIZE staged record ids, so no
+    single statement (or SQLite write lock) grows with the upload. Record ids
+    follow the preview order, so SeatAllotment ids do too.
+    """
+    bounds = StagingRecord.objects.filter(page__batch=batch).aggregate(first=Min('id'), last=Max('id'))
+    if bounds['first'] is None:
+        return 0
+
+    qn = connection.ops.quote_name
+    adapt = connection.ops.adapt_datetimefield_value
+    sql = f"""
+        INSERT INTO {qn(SeatAllotment._meta.db_table)} ({_columns(
+            SeatAllotment, 'uploaded_file', 'usn', 'usn_normalized', 'room_no', 'seat_no', 'course_code',
+            'exam_start_time', 'visible_from', 'visible_until', 'window_active',
+        )})
+        SELECT p.{qn('upload_id')}, r.{qn('usn')}, r.{qn('usn')}, p.{qn('room')}, r.{qn('seat')},
+               r.{qn('course')}, %s, %s, %s, %s
+        FROM {qn(StagingRecord._meta.db_table)} r
+        JOIN {qn(StagingPage._meta.db_table)} p ON p.{qn('id')} = r.{qn('page_id')}
+        WHERE p.{qn('batch_id')} = %s AND r.{qn('id')} BETWEEN %s AND %s
+        ORDER BY r.{qn('id')}
+    """
+    params = [adapt(exam_start_time), adapt(visible_from), adapt(visible_until), True, batch.id]
+    inserted = 0
+    with connection.cursor() as cursor:
+        for start in range(bounds['first'], bounds['last'] + 1, settings.PUBLISH_CHUNK_SIZE):
+            cursor.execute(sql, params + [start, start + settings.PUBLISH_CHUNK_SIZE - 1])
+            inserted += cursor.rowcount
+    return inserted
+
+
+class PublishError(Exception):
+    pass
+
+
+@contextmanager
+def _timed(timings, phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = round(time.perf_counter() - started, 4)
+
+
+def publish_staged(batch, user, exam_start_time, window_name=''):
+    """
+    Publishes a staging batch: one VisibilityWindow per upload (named
+    window_name, or after the file), the uploads marked published, the staged
+    records copied into SeatAllotment, their raw rows archived and an audit
+    entry per upload, all in one transaction. The batch is deleted and the student caches refreshed
+    afterwards.
+
+    Returns {"uploads", "rows", "timings"}; timings are seconds per phase.
+    Raises PublishError if the batch is gone (already published or
+    discarded) or one of its uploads already has a window.
+    """
+    timings = {}
+    visible_from = exam_start_time - timedelta(minutes=45)
+    visible_until = exam_start_time + timedelta(hours=3)
+    started = time.perf_counter()
+
+    with transaction.atomic():
+        with _timed(timings, 'lock'):
+            # A double-submitted publish waits here and then finds the batch gone
+            if not StagingBatch.objects.select_for_update().filter(id=batch.id).exists():
+                raise PublishError("This preview was already published or discarded.")
+            uploads = list(UploadedFile.objects.filter(staging_batches=batch).order_by('id'))
+            if not uploads:
+                raise PublishError("The files in this preview were deleted.")
+            if VisibilityWindow.objects.filter(file__in=uploads).exists():
+                raise PublishError("Some of these files are already published.")
+
+        # Windows before the allotments; bulk_create skips VisibilityWindow.save's
+        # sync_allotments, which would have nothing to rewrite yet anyway
+        with _timed(timings, 'windows'):
+            VisibilityWindow.objects.bulk_create([
+                VisibilityWindow(
+                    file=upload,
+                    window_name=window_name or upload.filename(),
+                    visible_from=visible_from,
+                    visible_until=visible_until,
+                    is_active_manual=True,
+                )
+                for upload in uploads
+            ])
+            UploadedFile.objects.filter(id__in=[upload.id for upload in uploads]).update(
+                is_published=True, exam_date=exam_start_time.date(),
+            )
+
+        with _timed(timings, 'allotments'):
+            rows = publish_batch(batch, exam_start_time, visible_from, visible_until)
+
+        # Raw table rows go to one compressed UploadRawRows per upload (or nowhere)
+        with _timed(timings, 'raw_rows'):
+            archive_batch(batch)
+
+        with _timed(timings, 'audit'):
+            AdminAuditLog.objects.bulk_create([
+                AdminAuditLog(user=user, action='PUBLISH', details=f"Published {upload.filename()}")
+                for upload in uploads
+            ])
+
+        with _timed(timings, 'cleanup'):
+            batch.delete()
+
+    # After commit, so shard regeneration and other workers see the new rows
+    with _timed(timings, 'invalidate'):
+        allotments_changed()
+
+    timings['total'] = round(time.perf_counter() - started, 4)
+    for phase, seconds in timings.items():
+        metrics.PUBLISH_DURATION.observe(seconds, phase=phase)
+    metrics.PUBLISH_ROWS.inc(rows)
+    logger.info(f"Published {len(uploads)} files / {rows} allotments: {timings}")
+    return {'uploads': len(uploads), 'rows': rows, 'timings': timings}
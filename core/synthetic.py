@@ -0,0 +1,122 @@
+"""
+Synthetic exam data for benchmarks and load tests.
+
+Produces seating plans shaped like parse_exam_file_wrapper output (a list of
+pages, one room each, with Sl. No / Register Number / Course Code rows). The
+same plans can be written to the DB or rendered as .docx. USNs follow the
+college's 4PS<year><branch><roll> pattern, and a student sits more than one
+exam, so USNs repeat across uploads as they do in real data.
+
+write_seating_docx() renders a plan in the layout parse_exam_file_wrapper
+expects, for parser benchmarks (manage.py bench_parser).
+"""
+import random
+from xml.sax.saxutils import escape
+
+from docx import Document
+from docx.enum.section import WD_SECTION
+from docx.oxml import parse_xml
+
+BRANCHES = ['CS', 'IS', 'EC', 'EE', 'ME', 'CV', 'AI', 'CB']
+BLOCKS = ['GBL', 'MBA', 'CSB', 'ECB', 'MEB']
+SYNTHETIC_COLUMNS = ['Sl. No', 'Register Number', 'Course Code']
+
+
+def student_pool(rng, size, years=(21, 22, 23, 24)):
+    """`size` distinct USNs spread over years and branches."""
+    per_cohort = -(-size // (len(years) * len(BRANCHES)))
+    pool = [
+        f"4PS{year}{branch}{roll:03d}"
+        for year in years
+        for branch in BRANCHES
+        for roll in range(1, per_cohort + 1)
+    ]
+    rng.shuffle(pool)
+    return pool[:size]
+
+
+def rooms(count):
+    # GBL101..GBL110, MBA101..., then the next floor: GBL201...
+    names = []
+    for i in range(count):
+        block, n = BLOCKS[i % len(BLOCKS)], i // len(BLOCKS)
+        names.append(f"{block}{n // 10 + 1}{n % 10 + 1:02d}")
+    return names
+
+
+def course_code(usn):
+    # 21CS51-style code derived from the student's year and branch
+    return f"{usn[3:5]}{usn[5:7]}5{int(usn[-1]) % 4 + 1}"
+
+
+def seating_plan(students, seats_per_room=30):
+    """Seat `students` room by room, returning parser-shaped pages."""
+    pages = []
+    room_names = rooms(-(-len(students) // seats_per_room))
+    for page_idx, room in enumerate(room_names):
+        chunk = students[page_idx * seats_per_room:(page_idx + 1) * seats_per_room]
+        records = []
+        for seat, usn in enumerate(chunk, start=1):
+            course = course_code(usn)
+            records.append({
+                "usn": usn,
+                "seat": str(seat),
+                "course": course,
+                "raw_data": [str(seat), usn, course],
+            })
+        pages.append({"page_idx": page_idx, "room": room, "columns": SYNTHETIC_COLUMNS, "records": records})
+    return pages
+
+
+def exam_plans(count, students_per_exam, pool_size=None, seats_per_room=30, seed=42):
+    """
+    `count` seating plans drawn from one student pool. Yields
+    (exam number, pages). Each plan is a different random subset of the pool.
+    """
+    rng = random.Random(seed)
+    pool = student_pool(rng, pool_size or students_per_exam * 2)
+    for exam in range(count):
+        students = rng.sample(pool, min(students_per_exam, len(pool)))
+        yield exam, seating_plan(students, seats_per_room)
+
+
+# ---------- .docx rendering (parser input) ----------
+
+_TEXT_BOX_XML = (
+    '<w:p xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    ' xmlns:v="urn:schemas-microsoft-com:vml">'
+    '<w:r><w:pict><v:shape style="position:absolute;margin-left:380pt;margin-top:0;width:110pt;height:24pt">'
+    '<v:textbox><w:txbxContent><w:p><w:r><w:t>{text}</w:t></w:r></w:p></w:txbxContent></v:textbox>'
+    '</v:shape></w:pict></w:r></w:p>'
+)
+
+
+def write_seating_docx(pages, path, exam_date='12-05-2025', session='Morning (09:30 AM - 12:30 PM)'):
+    """
+    Render parser-shaped pages as a seating plan .docx laid out like the real ones:
+    one section per room whose header has a title paragraph and a floating
+    "Room No" text box, then a Date/Session table and the student table.
+    """
+    doc = Document()
+    for i, page in enumerate(pages):
+        section = doc.sections[0] if i == 0 else doc.add_section(WD_SECTION.NEW_PAGE)
+        header = section.header
+        header.is_linked_to_previous = False
+        header.paragraphs[0].text = "P.E.S. College of Engineering, Mandya - Seating Arrangement"
+        header._element.append(parse_xml(_TEXT_BOX_XML.format(text=escape(f"Room No: {page['room']}"))))
+
+        info = doc.add_table(rows=2, cols=3)
+        for cell, text in zip(info.rows[0].cells, ['Date', 'Session', 'Room']):
+            cell.text = text
+        for cell, text in zip(info.rows[1].cells, [exam_date, session, page['room']]):
+            cell.text = text
+
+        students = doc.add_table(rows=1 + len(page['records']), cols=3)
+        for cell, text in zip(students.rows[0].cells, SYNTHETIC_COLUMNS):
+            cell.text = text
+        for row, record in zip(students.rows[1:], page['records']):
+            for cell, text in zip(row.cells, record['raw_data']):
+                cell.text = text
+
+        doc.add_paragraph("Signature of the Invigilator")
+    doc.save(path)
@@ -1,3 +1,1480 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from docx import Document
+from docx.enum.section import WD_SECTION
+from docx.oxml import parse_xml
+
+from . import jobs, metrics, parser, profiling, result_shards, staging, views
+from .allotment_index import allotment_index, allotments_changed, load_snapshot, lookup_allotment, state_etag
+from .bloom import BloomFilter
+from .expiry import orphaned_files, run_expiry
+from .middleware import ProfilerMiddleware, RateLimitMiddleware
+from .models import (
+    DataVersion, ParseCache, ParseJob, SeatAllotment, StagingBatch, StagingRecord, UploadRawRows, UploadedFile,
+    VisibilityWindow,
+)
+from .parser import PARSER_VERSION, iter_exam_pages, normalize_usn, parse_many, parse_exam_file, parse_exam_file_streaming, parse_exam_file_wrapper
+from .ratelimit import HEADER, PROBES, SLOT, SharedRateLimiter
+from .raw_rows import load_raw_rows
+from .singleflight import SingleFlight
+from .synthetic import _TEXT_BOX_XML, exam_plans, write_seating_docx
+from .uploads import store_upload
+from .warmup import warm_up
+
+
+def build_docx(path, sections, trailing_paragraph=True):
+    """
+    Each section is a dict with:
+      header: ('box', text) | ('para', text) | ('linked', None) | None for no header at all
+      tables: list of tables, each a list of rows (lists of cell strings); a row
+              may be a table itself (nested in its first cell)
+    """
+    doc = Document()
+    for i, section_spec in enumerate(sections):
+        section = doc.sections[0] if i == 0 else doc.add_section(WD_SECTION.NEW_PAGE)
+        header_spec = section_spec.get('header')
+        if header_spec is not None and header_spec[0] != 'linked':
+            header = section.header
+            header.is_linked_to_previous = False
+            kind, text = header_spec
+            if kind == 'box':
+                header.paragraphs[0].text = "Seating Arrangement"
+                header._element.append(parse_xml(_TEXT_BOX_XML.format(text=text)))
+            else:
+                header.paragraphs[0].text = text
+
+        for rows in section_spec['tables']:
+            width = max(len(row) for row in rows if isinstance(row, list))
+            table = doc.add_table(rows=len(rows), cols=width)
+            for row, cells in zip(table.rows, rows):
+                if isinstance(cells, tuple):  # nested table in the first cell
+                    nested = row.cells[0].add_table(rows=len(cells), cols=len(cells[0]))
+                    for nested_row, nested_cells in zip(nested.rows, cells):
+                        for cell, text in zip(nested_row.cells, nested_cells):
+                            cell.text = text
+                    continue
+                for cell, text in zip(row.cells, cells):
+                    cell.text = text
+            if trailing_paragraph:
+                doc.add_paragraph("Signature of the Invigilator")
+    doc.save(path)
+
+
+def block(date='12-05-2025'):
+    return [['Date', 'Session'], [date, 'Morning']]
+
+
+def students(*usns, start=1):
+    return [['Sl. No', 'Register Number', 'Course Code']] + [
+        [str(start + i), usn, '21CS51'] for i, usn in enumerate(usns)
+    ]
+
+
+class StreamingParserDifferentialTests(SimpleTestCase):
+    """The streaming parser must return exactly what parse_exam_file_wrapper returns."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+
+    def assertSameParse(self, path):
+        expected = parse_exam_file_wrapper(path)
+        self.assertFalse(expected.get('error'), expected)
+        self.assertEqual(parse_exam_file_streaming(path), expected)
+        self.assertEqual(list(iter_exam_pages(path)), expected['pages'])
+        return expected
+
+    def docx(self, name, sections, **kwargs):
+        path = os.path.join(self.tmp, name)
+        build_docx(path, sections, **kwargs)
+        return path
+
+    def test_synthetic_seating_plans(self):
+        for exam, pages in exam_plans(3, 250, seats_per_room=37):
+            path = os.path.join(self.tmp, f'plan_{exam}.docx')
+            write_seating_docx(pages, path)
+            result = self.assertSameParse(path)
+            self.assertEqual(result['total_count'], 250)
+            self.assertEqual([p['room'] for p in result['pages']], [p['room'] for p in pages])
+
+    def test_header_variants(self):
+        result = self.assertSameParse(self.docx('headers.docx', [
+            # Header paragraphs are only searched while no room has been found yet
+            {'header': ('para', 'Hall No. MBA-12'), 'tables': [block(), students('4PS21CS001', '4ps21cs002 ')]},
+            {'header': ('box', 'Room No: GBL301'), 'tables': [block(), students('4PS21CS003')]},
+            {'header': ('box', 'CSB104'), 'tables': [block(), students('4PS21CS004')]},
+            # Linked to previous: inherits CSB104's header
+            {'header': ('linked', None), 'tables': [block(), students('4PS21CS005')]},
+            # Header without any room: keeps the previous room
+            {'header': ('para', 'Department of Computer Science'), 'tables': [block(), students('4PS21CS006')]},
+        ]))
+        self.assertEqual([p['room'] for p in result['pages']], ['MBA-12', 'GBL301', 'CSB104', 'CSB104', 'CSB104'])
+
+    def test_first_section_without_header(self):
+        self.assertSameParse(self.docx('no_first_header.docx', [
+            {'header': None, 'tables': [block(), students('4PS21CS001')]},
+            {'header': ('linked', None), 'tables': [block(), students('4PS21CS002')]},
+            {'header': ('box', 'Room No: GBL101'), 'tables': [block(), students('4PS21CS003')]},
+        ]))
+
+    def test_more_blocks_than_sections(self):
+        # Page breaks instead of section breaks: one header for every block
+        result = self.assertSameParse(self.docx('one_section.docx', [
+            {'header': ('box', 'Room No: GBL201'), 'tables': [
+                block(), students('4PS21CS001', '4PS21CS002'),
+                block(), students('4PS21CS003'),
+                block(), students('4PS21CS004'),
+            ]},
+        ]))
+        self.assertEqual([p['page_idx'] for p in result['pages']], [1, 2, 3])
+
+    def test_irregular_tables(self):
+        self.assertSameParse(self.docx('irregular.docx', [
+            {'header': ('box', 'Room No: GBL101'), 'tables': [
+                # Students before any Date/Session table land on page 0
+                students('4PS21CS900'),
+                block(),
+                # Blank rows, missing USNs, short rows and an unrelated table
+                students('4PS21CS001', '', '4PS21CS002') + [['', '', ''], ['9']],
+                [['Invigilator', 'Signature']],
+                # Two student tables in one block, the second with a nested table
+                students('4PS21CS003', start=4) + [(('Room', 'Note'), ('x', 'y'))],
+            ]},
+            {'header': ('box', 'Room No: GBL102'), 'tables': [
+                [['Session', 'Date'], ['Afternoon', '13-05-2025']],
+                [['USN', 'Sl. No'], ['4PS21CS010', '1']],
+            ]},
+        ], trailing_paragraph=False))
+
+    def test_empty_document(self):
+        self.assertSameParse(self.docx('empty.docx', [{'header': ('box', 'Room No: GBL101'), 'tables': []}]))
+
+    def test_unreadable_file(self):
+        path = os.path.join(self.tmp, 'broken.docx')
+        with open(path, 'wb') as f:
+            f.write(b'not a zip file')
+        self.assertTrue(parse_exam_file_streaming(path)['error'])
+        with override_settings(DOCX_PARSER='streaming'):
+            self.assertEqual(parse_exam_file(path), parse_exam_file_wrapper(path))
+
+
+_timed_parse = parser._timed_parse
+
+
+def _crashing_parse(file_path, docx_parser):
+    # Stands in for parser._timed_parse in the pool workers
+    if 'crash' in os.path.basename(file_path):
+        os._exit(1)
+    return _timed_parse(file_path, docx_parser)
+
+
+@override_settings(PARSE_WORKERS=2, METRICS_ENABLED=False)
+class ParsePoolTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        # A pool of its own, with PARSE_WORKERS=2; forked so workers can run _crashing_parse from this module
+        parser._parse_pool = None
+        self.enterContext(mock.patch.object(parser.multiprocessing, 'get_all_start_methods', return_value=['fork']))
+        self.addCleanup(self.shutdown_pool)
+
+    def shutdown_pool(self):
+        # Waits, so the next test does not fork while this pool's threads hold locks
+        pool, parser._parse_pool = parser._parse_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def plans(self, count):
+        paths = []
+        for exam, pages in exam_plans(count, 40, seats_per_room=20):
+            path = os.path.join(self.tmp, f'plan_{exam}.docx')
+            write_seating_docx(pages, path)
+            paths.append((path, [page['room'] for page in pages]))
+        return paths
+
+    def rooms(self, result):
+        return [page['room'] for page in result['pages']]
+
+    def test_results_keep_upload_order(self):
+        plans = self.plans(5)
+        done = []
+        results = parse_many([path for path, _ in plans], on_parsed=lambda: done.append(1))
+        self.assertEqual([self.rooms(result) for result in results], [rooms for _, rooms in plans])
+        self.assertEqual(len(done), 5)
+
+    def test_corrupt_file_fails_alone(self):
+        plans = self.plans(2)
+        corrupt = os.path.join(self.tmp, 'corrupt.docx')
+        Path(corrupt).write_bytes(b'not a docx')
+        results = parse_many([plans[0][0], corrupt, plans[1][0]])
+        self.assertTrue(results[1]['error'])
+        self.assertEqual([self.rooms(results[0]), self.rooms(results[2])], [plans[0][1], plans[1][1]])
+
+    def test_crashed_worker_fails_only_its_file(self):
+        plans = self.plans(3)
+        crash = os.path.join(self.tmp, 'crash.docx')
+        shutil.copy(plans[0][0], crash)
+        paths = [plans[0][0], crash, plans[1][0], plans[2][0]]
+        with mock.patch.object(parser, '_timed_parse', _crashing_parse):
+            results = parse_many(paths)
+        self.assertIn('terminated abruptly', results[1]['error'])
+        self.assertEqual(
+            [self.rooms(results[i]) for i in (0, 2, 3)], [plans[0][1], plans[1][1], plans[2][1]],
+        )
+
+
+class IsolatedTestCase(TestCase):
+    """
+    TestCase whose on-disk side effects (uploads, result shards, index
+    snapshots, rate limit table, metrics) go to a temporary directory instead
+    of the checkout.
+    """
+    @classmethod
+    def setUpClass(cls):
+        tmp = Path(tempfile.mkdtemp())
+        cls.addClassCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        isolated = override_settings(
+            MEDIA_ROOT=tmp / 'media',
+            RESULT_SHARDS_ROOT=tmp / 'results',
+            ALLOTMENT_SNAPSHOT_DIR=tmp / 'snapshots',
+            RATE_LIMIT_FILE=tmp / 'ratelimit.bin',
+            METRICS_DIR=tmp / 'metrics',
+            PROFILER_DIR=tmp / 'profiles',
+        )
+        isolated.enable()
+        cls.addClassCleanup(isolated.disable)
+        super().setUpClass()
+
+
+def make_window(usns, start=None, hours=1, active=True, name='allot.docx'):
+    """An upload with a visibility window around `start` (default now) and one allotment per USN."""
+    start = start or timezone.now()
+    upload = UploadedFile.objects.create(file=f'uploads/{name}', original_name=name)
+    window = VisibilityWindow.objects.create(
+        file=upload, visible_from=start - timedelta(hours=hours), visible_until=start + timedelta(hours=hours),
+        is_active_manual=active,
+    )
+    for i, usn in enumerate(usns, start=1):
+        SeatAllotment.objects.create(
+            uploaded_file=upload, usn=usn, room_no='R1', seat_no=str(i), exam_start_time=start,
+        )
+    return upload, window
+
+
+def stage(user, *files):
+    """
+    A StagingBatch of uploads given as (filename, [(room, [usn, ...]), ...]); page_idx
+    restarts at 0 in every file, as the parser numbers them.
+    """
+    parsed = []
+    for name, pages in files:
+        upload = UploadedFile.objects.create(file=f'uploads/{name}', original_name=name)
+        parsed.append((upload, [
+            {'page_idx': idx, 'room': room, 'records': [
+                {'usn': usn, 'seat': str(seat), 'course': '21CS51', 'raw_data': [str(seat), usn]}
+                for seat, usn in enumerate(usns, start=1)
+            ]}
+            for idx, (room, usns) in enumerate(pages)
+        ]))
+    return staging.stage_results(user, parsed)
+
+
+class VisibilityDriftCommandTests(IsolatedTestCase):
+    def test_drift_fails_until_fixed(self):
+        upload, window = make_window(['4PS22CS001', '4PS22CS002'])
+        call_command('check_visibility_drift', stdout=StringIO())
+
+        # A bulk update that bypasses VisibilityWindow.save leaves the allotments behind
+        VisibilityWindow.objects.filter(pk=window.pk).update(is_active_manual=False)
+        with self.assertRaisesMessage(CommandError, '2 rows disagree with their window'):
+            call_command('check_visibility_drift')
+
+        call_command('check_visibility_drift', fix=True, stdout=StringIO())
+        self.assertFalse(SeatAllotment.objects.filter(window_active=True).exists())
+        call_command('check_visibility_drift', stdout=StringIO())
+
+
+class ResultShardTests(IsolatedTestCase):
+    def get_json(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))
+
+    def manifest_path(self):
+        return os.path.join(settings.RESULT_SHARDS_ROOT, result_shards.MANIFEST_NAME)
+
+    def test_change_syncs_after_commit_in_background(self):
+        make_window(['4PS22CS001'])
+        with self.captureOnCommitCallbacks() as callbacks:
+            allotments_changed()
+        self.assertEqual(callbacks, [result_shards.schedule_sync])
+        self.assertFalse(os.path.exists(self.manifest_path()))
+
+    def test_schedule_sync_folds_calls_into_one_thread(self):
+        with mock.patch.object(result_shards, 'sync_result_shards') as sync:
+            thread = result_shards.schedule_sync()
+            self.assertIs(result_shards.schedule_sync(), thread)
+            thread.join()
+        self.assertIn(sync.call_count, (1, 2))
+        self.assertIsNone(result_shards._sync_thread)
+
+    def test_serves_only_the_current_generation(self):
+        make_window(['4PS22CS001'])
+        result_shards.sync_result_shards()
+        manifest = self.get_json('/results/manifest.json')
+        shard = self.get_json(f"{manifest['base_url']}{result_shards.shard_key('4PS22CS001')}.json")
+        self.assertEqual(shard['4PS22CS001']['seat'], '1')
+
+        # A leftover generation is not served even though its files exist
+        os.makedirs(os.path.join(settings.RESULT_SHARDS_ROOT, 'old'))
+        Path(settings.RESULT_SHARDS_ROOT, 'old', '4PS22CS0.json').write_text('{}')
+        self.assertEqual(self.client.get('/results/old/4PS22CS0.json').status_code, 404)
+
+    def test_expired_manifest_is_withdrawn(self):
+        make_window(['4PS22CS001'])
+        result_shards.sync_result_shards()
+        with open(self.manifest_path()) as f:
+            manifest = json.load(f)
+        # The window closed and nothing has synced since
+        manifest['valid_until'] = (timezone.now() - timedelta(seconds=1)).isoformat()
+        with open(self.manifest_path(), 'w') as f:
+            json.dump(manifest, f)
+
+        with mock.patch('core.middleware.schedule_sync') as schedule_sync:
+            self.assertEqual(self.client.get('/results/manifest.json').status_code, 404)
+            shard_url = f"{manifest['base_url']}{result_shards.shard_key('4PS22CS001')}.json"
+            self.assertEqual(self.client.get(shard_url).status_code, 404)
+        self.assertTrue(schedule_sync.called)
+
+
+@override_settings(RATE_LIMITS={'/api/allotment': (2, 60)}, RATE_LIMIT_REVALIDATE_FACTOR=3)
+class RateLimitRevalidationTests(IsolatedTestCase):
+    def statuses(self, ip, etag, count=10):
+        return [
+            self.client.get('/api/allotment', {'usn': '4PS22CS001'}, REMOTE_ADDR=ip, HTTP_IF_NONE_MATCH=etag).status_code
+            for _ in range(count)
+        ]
+
+    def test_only_a_matching_etag_raises_the_ceiling(self):
+        make_window(['4PS22CS001'])
+        allotments_changed()
+        etag = state_etag(allotment_index.state()[0])
+
+        self.assertEqual(self.statuses('10.0.0.1', etag), [304] * 6 + [429] * 4)
+        # Anything else gets a full answer, so it counts at the normal limit
+        self.assertEqual(self.statuses('10.0.0.2', 'W/"bogus"'), [200] * 2 + [429] * 8)
+        self.assertEqual(self.statuses('10.0.0.3', 'x'), [200] * 2 + [429] * 8)
+
+    def test_async(self):
+        make_window(['4PS22CS001'])
+        allotments_changed()
+        etag = state_etag(allotment_index.state()[0])
+
+        async def view(request):
+            return HttpResponse()
+        middleware = RateLimitMiddleware(view)
+        factory = RequestFactory()
+
+        def statuses(ip, etag):
+            request = factory.get('/api/allotment', REMOTE_ADDR=ip, HTTP_IF_NONE_MATCH=etag)
+            return [async_to_sync(middleware)(request).status_code for _ in range(10)]
+        self.assertEqual(statuses('10.0.1.1', etag).count(200), 6)
+        self.assertEqual(statuses('10.0.1.2', 'x').count(200), 2)
+
+
+class SharedRateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'ratelimit.bin')
+
+    def test_sliding_window_estimate(self):
+        limiter = SharedRateLimiter(self.path, 64)
+        start = 6000.0  # start of a 60 s window
+        self.assertEqual([limiter.allow('k', 10, 60, now=start)[0] for _ in range(11)], [True] * 10 + [False])
+
+        # Halfway into the next window the previous one still weighs 50%
+        allowed, estimate = limiter.allow('k', 10, 60, now=start + 90)
+        self.assertEqual((allowed, estimate), (True, 5.0))
+        self.assertEqual(sum(limiter.allow('k', 10, 60, now=start + 90)[0] for _ in range(10)), 4)
+
+        # Two windows later nothing is left
+        self.assertEqual(limiter.allow('k', 10, 60, now=start + 180), (True, 0.0))
+        # Keys are counted separately
+        self.assertEqual(limiter.allow('other', 10, 60, now=start), (True, 0.0))
+
+    def test_full_probe_range_takes_over_the_oldest_slot(self):
+        # With PROBES slots every key probes the same range
+        limiter = SharedRateLimiter(self.path, PROBES)
+        start = 6000.0
+        limiter.allow('oldest', 100, 60, now=start)
+        for i in range(PROBES - 1):
+            limiter.allow(f'live{i}', 100, 60, now=start + 60)
+        self.assertEqual(limiter.allow('oldest', 100, 60, now=start + 60)[1], 1.0)
+        limiter.allow('oldest', 100, 60, now=start)  # back in the previous window
+
+        # A new key fails open instead of being refused...
+        self.assertEqual(limiter.allow('new', 100, 60, now=start + 60), (True, 0.0))
+        # ...by taking over the slot whose counter is oldest
+        self.assertEqual(limiter.allow('oldest', 100, 60, now=start + 60)[1], 0.0)
+        self.assertEqual(limiter.allow('live0', 100, 60, now=start + 60)[1], 1.0)
+
+    def test_key_behind_an_idle_slot_keeps_its_count(self):
+        # 'first' takes slot 0, so 'second' probes on to slot 1
+        limiter = SharedRateLimiter(self.path, PROBES)
+        start = 6000.0
+        limiter.allow('first', 100, 60, now=start)
+        for _ in range(3):
+            limiter.allow('second', 3, 60, now=start + 60)
+
+        # Once 'first' has gone idle its slot is free, but 'second' must still find its own
+        self.assertEqual(limiter.allow('second', 3, 60, now=start + 120), (False, 3.0))
+        digests = [SLOT.unpack_from(limiter._map, HEADER.size + i * SLOT.size)[0] for i in range(PROBES)]
+        self.assertEqual(len([digest for digest in digests if digest]), 2)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_forked_process_reopens_and_shares_counts(self):
+        limiter = SharedRateLimiter(self.path, 64)
+        limiter.allow('k', 100, 60, now=6000.0)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for _ in range(5):
+                    limiter.allow('k', 100, 60, now=6000.0)
+                os._exit(0 if limiter._pid == os.getpid() else 1)
+            except BaseException:
+                os._exit(2)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(limiter.allow('k', 100, 60, now=6000.0)[1], 6.0)
+
+    def test_layout_reset_on_size_change(self):
+        SharedRateLimiter(self.path, 64).allow('k', 100, 60, now=6000.0)
+        self.assertEqual(SharedRateLimiter(self.path, 64).allow('k', 100, 60, now=6000.0)[1], 1.0)
+
+        resized = SharedRateLimiter(self.path, 128)
+        self.assertEqual(resized.allow('k', 100, 60, now=6000.0)[1], 0.0)
+        self.assertEqual(os.path.getsize(self.path), HEADER.size + 128 * SLOT.size)
+
+
+@override_settings(RATE_LIMITS={}, ALLOTMENT_INDEX_ENABLED=True, ALLOTMENT_INDEX_CHECK_INTERVAL=60)
+class AllotmentIndexTests(IsolatedTestCase):
+    def setUp(self):
+        allotment_index.invalidate()
+
+    def test_lookup_is_served_from_memory(self):
+        make_window(['4PS22CS001'])
+        allotments_changed()
+        allotment_index.state()
+        with self.assertNumQueries(0):
+            self.assertEqual(allotment_index.lookup(' 4ps22 cs001 ')['seat'], '1')
+            self.assertIsNone(allotment_index.lookup('4PS22CS999'))
+
+        response = self.client.get('/api/allotment', {'usn': '4PS22CS001'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['room'], 'R1')
+        self.assertEqual(response['ETag'], state_etag(allotment_index.token))
+        self.assertEqual(self.client.get('/api/allotment', {'usn': '4PS22CS999'}).status_code, 404)
+
+    def test_change_in_this_worker_rebuilds(self):
+        make_window(['4PS22CS001'])
+        allotments_changed()
+        self.assertIsNone(allotment_index.lookup('4PS22CS002'))
+
+        make_window(['4PS22CS002'], name='second.docx')
+        # Within the check interval the index is not re-validated...
+        self.assertIsNone(allotment_index.lookup('4PS22CS002'))
+        # ...unless this worker made the change
+        allotments_changed()
+        self.assertIsNotNone(allotment_index.lookup('4PS22CS002'))
+
+    @override_settings(ALLOTMENT_INDEX_CHECK_INTERVAL=0)
+    def test_change_in_another_worker_rebuilds_after_version_check(self):
+        make_window(['4PS22CS001'])
+        allotment_index.state()
+        make_window(['4PS22CS002'], name='second.docx')
+        DataVersion.bump('allotments')
+        self.assertIsNotNone(allotment_index.lookup('4PS22CS002'))
+
+    def test_only_open_active_windows_are_visible(self):
+        now = timezone.now()
+        make_window(['4PS22CS001'], active=False)
+        make_window(['4PS22CS002'], start=now + timedelta(hours=2), name='later.docx')
+        allotments_changed()
+        self.assertIsNone(allotment_index.lookup('4PS22CS001'))
+        self.assertIsNone(allotment_index.lookup('4PS22CS002'))
+        self.assertEqual(allotment_index.state()[1], now + timedelta(hours=1))
+
+        # Passing the opening boundary rebuilds without any version change
+        with mock.patch('django.utils.timezone.now', return_value=now + timedelta(minutes=90)):
+            self.assertIsNotNone(allotment_index.lookup('4PS22CS002'))
+        with mock.patch('django.utils.timezone.now', return_value=now + timedelta(hours=4)):
+            self.assertIsNone(allotment_index.lookup('4PS22CS002'))
+
+
+@override_settings(RATE_LIMITS={}, STUDENT_BATCH_API_KEYS=['kiosk-key'], STUDENT_BATCH_MAX_USNS=4)
+class StudentBatchLookupTests(IsolatedTestCase):
+    url = '/api/allotment/batch'
+
+    def setUp(self):
+        allotment_index.invalidate()
+        make_window(['4PS22CS001', '4PS22CS002'])
+        allotments_changed()
+
+    def post(self, body, content_type='application/json', **extra):
+        extra.setdefault('HTTP_X_API_KEY', 'kiosk-key')
+        data = json.dumps(body) if not isinstance(body, str) else body
+        return self.client.post(self.url, data, content_type=content_type, **extra)
+
+    def test_results_and_missing(self):
+        response = self.post({'usns': ['4ps22cs002', '4PS22CS999', '4PS22CS001', '4PS22CS999']})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-store', response['Cache-Control'])
+        data = response.json()
+        self.assertEqual(sorted(data['results']), ['4PS22CS001', '4PS22CS002'])
+        self.assertEqual(data['results']['4PS22CS002']['seat'], '2')
+        self.assertEqual(data['missing'], ['4PS22CS999'])
+
+    def test_without_index_uses_one_query(self):
+        with self.settings(ALLOTMENT_INDEX_ENABLED=False, LOOKUP_BLOOM_ENABLED=False):
+            allotment_index.invalidate()
+            allotment_index.state()
+            with self.assertNumQueries(1):
+                data = self.post({'usns': ['4PS22CS001', '4PS22CS999']}).json()
+        self.assertEqual(list(data['results']), ['4PS22CS001'])
+        self.assertEqual(data['missing'], ['4PS22CS999'])
+
+    def test_authentication(self):
+        self.assertEqual(self.post({'usns': []}, HTTP_X_API_KEY='').status_code, 403)
+        self.assertEqual(self.post({'usns': []}, HTTP_X_API_KEY='wrong').status_code, 403)
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.post({'usns': []}, HTTP_X_API_KEY='').status_code, 200)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(self.url, HTTP_X_API_KEY='kiosk-key').status_code, 405)
+        self.assertEqual(self.post('usns=1', content_type='application/x-www-form-urlencoded').status_code, 415)
+        self.assertEqual(self.post('not json').status_code, 400)
+        self.assertEqual(self.post(['4PS22CS001']).status_code, 400)
+        self.assertEqual(self.post({'usns': [1]}).status_code, 400)
+        self.assertEqual(self.post({'usns': ['A', 'B', 'C', 'D', 'E']}).status_code, 400)
+
+
+@override_settings(METRICS_ENABLED=False)
+class SingleFlightTests(SimpleTestCase):
+    def flight(self, ttl=60, max_keys=100):
+        return SingleFlight(ttl=lambda: ttl, max_keys=lambda: max_keys)
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = self.flight(ttl=0)
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'value'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('k', slow)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('k', slow))) for _ in range(4)]
+        for thread in followers:
+            thread.start()
+        while flight.stats()['coalesced'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(len(calls), 1)
+        # ttl=0 shares in-flight calls only
+        self.assertEqual(flight.do('k', lambda: 'again'), 'again')
+
+    def test_results_are_cached_for_ttl(self):
+        flight = self.flight(ttl=60)
+        self.assertEqual(flight.do('k', lambda: 1), 1)
+        self.assertEqual(flight.do('k', lambda: 2), 1)
+        self.assertEqual(flight.do('other', lambda: 3), 3)
+        with mock.patch('core.singleflight.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(flight.do('k', lambda: 4), 4)
+        self.assertEqual(flight.stats()['cache_hits'], 1)
+
+    def test_least_recently_used_keys_are_dropped(self):
+        flight = self.flight(max_keys=2)
+        flight.do('a', lambda: 1)
+        flight.do('b', lambda: 1)
+        flight.do('a', lambda: 1)
+        flight.do('c', lambda: 1)
+        self.assertEqual(flight.do('a', lambda: 2), 1)
+        self.assertEqual(flight.do('b', lambda: 2), 2)
+
+    def test_errors_reach_every_waiter_and_are_not_cached(self):
+        flight = self.flight()
+        started, release = threading.Event(), threading.Event()
+
+        def failing():
+            started.set()
+            release.wait(5)
+            raise ValueError('boom')
+
+        errors = []
+
+        def call():
+            try:
+                flight.do('k', failing)
+            except ValueError as e:
+                errors.append(e)
+        threads = [threading.Thread(target=call)]
+        threads[0].start()
+        started.wait(5)
+        threads.append(threading.Thread(target=call))
+        threads[1].start()
+        while flight.stats()['coalesced'] < 1:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(flight.do('k', lambda: 'ok'), 'ok')
+
+    def test_async_callers_share_one_task_despite_cancellation(self):
+        flight = self.flight(ttl=0)
+        calls = []
+
+        async def query():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'value'
+
+        async def scenario():
+            first = asyncio.ensure_future(flight.ado('k', query))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(flight.ado('k', query))
+            await asyncio.sleep(0)
+            first.cancel()  # a client going away must not cancel the shared query
+            return await second
+
+        self.assertEqual(asyncio.run(scenario()), 'value')
+        self.assertEqual(len(calls), 1)
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_no_false_negatives_and_false_positives_near_target(self):
+        bloom = BloomFilter(5000, 0.01, max_bytes=1 << 20)
+        for i in range(5000):
+            bloom.add(f'4PS22CS{i:04d}')
+        self.assertTrue(all(f'4PS22CS{i:04d}' in bloom for i in range(5000)))
+        false_positives = sum(f'4PS22EC{i:04d}' in bloom for i in range(10000))
+        self.assertLess(false_positives / 10000, 0.02)
+        self.assertAlmostEqual(bloom.expected_fp_rate(), 0.01, delta=0.002)
+
+    def test_size_cap(self):
+        bloom = BloomFilter(100000, 0.001, max_bytes=1024)
+        self.assertEqual(len(bloom.bits), 1024)
+        self.assertEqual(bloom.stats()['bytes'], 1024)
+
+
+@override_settings(
+    RATE_LIMITS={}, ALLOTMENT_INDEX_ENABLED=False, LOOKUP_BLOOM_ENABLED=True,
+    ALLOTMENT_INDEX_CHECK_INTERVAL=60, LOOKUP_COALESCE_TTL=0,
+)
+class BloomLookupTests(IsolatedTestCase):
+    def setUp(self):
+        allotment_index.invalidate()
+        make_window(['4PS22CS001'])
+        allotments_changed()
+        allotment_index.state()
+
+    def test_unknown_usn_is_rejected_without_a_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup_allotment('4PS22XX999'), (None, None))
+            self.assertEqual(self.client.get('/api/allotment', {'usn': '4PS22XX999'}).status_code, 404)
+        self.assertGreaterEqual(allotment_index.bloom_rejected, 2)
+
+        with self.assertNumQueries(1):
+            allotment, body = lookup_allotment('4ps22cs001')
+        self.assertEqual(json.loads(body), allotment)
+        self.assertEqual(allotment['usn'], '4PS22CS001')
+
+    def test_filter_follows_changes(self):
+        make_window(['4PS22CS002'], name='second.docx')
+        allotments_changed()
+        self.assertEqual(lookup_allotment('4PS22CS002')[0]['usn'], '4PS22CS002')
+        self.assertEqual(allotment_index.bloom_stats()['usns'], 2)
+
+
+@override_settings(EXPIRY_GRACE_HOURS=0)
+class ExpiryTests(IsolatedTestCase):
+    def setUp(self):
+        # Each test starts with an empty uploads/
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(self.settings(MEDIA_ROOT=media))
+
+    def cache(self, content_hash, parser_version=PARSER_VERSION):
+        return ParseCache.objects.create(content_hash=content_hash, parser_version=parser_version, result={'pages': []})
+
+    def test_parse_cache_lives_as_long_as_an_upload_with_its_hash(self):
+        expired, _ = make_window(['4PS22CS001'], start=timezone.now() - timedelta(days=2), name='old.docx')
+        UploadedFile.objects.filter(pk=expired.pk).update(content_hash='a' * 64)
+        shared, _ = make_window(['4PS22CS002'], start=timezone.now() - timedelta(days=2), name='shared.docx')
+        UploadedFile.objects.filter(pk=shared.pk).update(content_hash='b' * 64)
+        UploadedFile.objects.create(file='uploads/b.docx', original_name='again.docx', content_hash='b' * 64)
+        self.cache('a' * 64)
+        self.cache('b' * 64)
+        self.cache('b' * 64, parser_version=PARSER_VERSION - 1)
+        self.cache('c' * 64)  # its upload was deleted from the dashboard
+
+        # The expiring upload's row is only counted once the upload is gone
+        self.assertEqual(run_expiry(dry_run=True, remove_files=False)['parse_cache'], 2)
+        report = run_expiry(remove_files=False)
+        self.assertEqual((report['uploads'], report['parse_cache']), (2, 3))
+        self.assertEqual(
+            list(ParseCache.objects.values_list('content_hash', 'parser_version')), [('b' * 64, PARSER_VERSION)],
+        )
+
+    def old_file(self, name, content=b'docx'):
+        path = Path(settings.MEDIA_ROOT) / 'uploads' / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        old = time.time() - settings.ORPHAN_FILE_MIN_AGE_SECONDS - 60
+        os.utime(path, (old, old))
+        return path
+
+    def test_reused_file_is_not_an_orphan(self):
+        upload = store_upload(SimpleUploadedFile('a.docx', b'same bytes'))
+        path = Path(upload.file.path)
+        old = time.time() - settings.ORPHAN_FILE_MIN_AGE_SECONDS - 60
+        os.utime(path, (old, old))
+        upload.delete()
+        self.assertEqual(orphaned_files(), [(upload.file.name, 10)])
+
+        again = store_upload(SimpleUploadedFile('b.docx', b'same bytes'))
+        self.assertEqual(again.file.name, upload.file.name)
+        self.assertGreater(path.stat().st_mtime, old)
+        self.assertEqual(orphaned_files(), [])
+
+    def test_file_removed_during_reuse_is_stored_again(self):
+        first = store_upload(SimpleUploadedFile('a.docx', b'same bytes'))
+        first.delete()
+        # Expiry deletes the copy just after store_upload found it
+        with mock.patch('core.uploads._touch', side_effect=lambda name: os.remove(first.file.path)):
+            upload = store_upload(SimpleUploadedFile('b.docx', b'same bytes'))
+        self.assertEqual(Path(upload.file.path).read_bytes(), b'same bytes')
+
+    def test_orphans_are_rechecked_before_removal(self):
+        self.old_file('gone.docx')
+        reused = self.old_file('reused.docx')
+        listed = orphaned_files()
+        self.assertEqual(len(listed), 2)
+        UploadedFile.objects.create(file='uploads/reused.docx', original_name='reused.docx')
+
+        with mock.patch('core.expiry.orphaned_files', return_value=listed):
+            self.assertEqual(run_expiry()['files'], 1)
+        self.assertTrue(reused.exists())
+        self.assertFalse((reused.parent / 'gone.docx').exists())
+
+    def test_finished_jobs_go_with_their_uploads(self):
+        expired, _ = make_window(['4PS22CS001'], start=timezone.now() - timedelta(days=2))
+        kept = UploadedFile.objects.create(file='uploads/kept.docx', original_name='kept.docx')
+
+        now = timezone.now()
+
+        def job(status, *uploads, seen=True, finished_at=now):
+            return ParseJob.objects.create(
+                status=status, finished_at=finished_at, seen_at=now if seen else None,
+                files=[{'upload_id': upload.id, 'filename': upload.original_name} for upload in uploads],
+            )
+        done = job(ParseJob.DONE, expired)
+        failed = job(ParseJob.FAILED, expired)
+        old_unseen = job(ParseJob.FAILED, seen=False, finished_at=now - timedelta(days=2))
+        unseen = job(ParseJob.FAILED, seen=False)  # the uploader has not been shown the error yet
+        partly = job(ParseJob.DONE, expired, kept)
+        queued = job(ParseJob.QUEUED, expired, finished_at=None)
+
+        self.assertEqual(run_expiry(dry_run=True, remove_files=False)['parse_jobs'], 1)
+        self.assertEqual(run_expiry(remove_files=False)['parse_jobs'], 3)
+        self.assertEqual(set(ParseJob.objects.values_list('id', flat=True)), {unseen.id, partly.id, queued.id})
+        self.assertFalse(ParseJob.objects.filter(id__in=[done.id, failed.id, old_unseen.id]).exists())
+
+
+@override_settings(
+    PARSE_JOBS_MODE='background', PARSE_JOB_MAX_ATTEMPTS=2, PARSE_JOB_STALE_SECONDS=60,
+    PARSE_JOB_HEARTBEAT_SECONDS=3600, PARSE_JOB_RETRY_DELAY=30,
+)
+class ParseJobQueueTests(IsolatedTestCase):
+    def setUp(self):
+        self.upload = UploadedFile.objects.create(file='uploads/a.docx', original_name='a.docx')
+        self.job = jobs.enqueue_parse_job(None, [self.upload])
+
+    def go_stale(self):
+        ParseJob.objects.update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+
+    def test_a_job_is_claimed_once(self):
+        claimed = jobs.claim_job('w1')
+        self.assertEqual(
+            (claimed.id, claimed.status, claimed.worker, claimed.attempts), (self.job.id, ParseJob.RUNNING, 'w1', 1),
+        )
+        self.assertIsNone(jobs.claim_job('w2'))
+
+        # Retries wait for run_after
+        ParseJob.objects.update(status=ParseJob.QUEUED, run_after=timezone.now() + timedelta(seconds=30))
+        self.assertIsNone(jobs.claim_job('w2'))
+
+    def test_heartbeat_only_while_owned(self):
+        jobs.claim_job('w1')
+        self.go_stale()
+        heartbeat = jobs._Heartbeat(self.job, 'w1')
+        heartbeat.stopped = mock.Mock(wait=mock.Mock(side_effect=[False, True]))
+        with mock.patch.object(jobs, 'connection'):  # the thread closes its own connection, not the test's
+            heartbeat.run()
+        self.assertEqual(jobs.reclaim_stale_jobs(), (0, 0))
+
+        self.go_stale()
+        heartbeat = jobs._Heartbeat(self.job, 'w2')
+        heartbeat.stopped = mock.Mock(wait=mock.Mock(side_effect=[False, True]))
+        with mock.patch.object(jobs, 'connection'):
+            heartbeat.run()
+        self.assertEqual(jobs.reclaim_stale_jobs(), (1, 0))
+
+    def test_stale_jobs_are_requeued_then_failed(self):
+        job = jobs.claim_job('w1')
+        self.go_stale()
+        self.assertEqual(jobs.reclaim_stale_jobs(), (1, 0))
+        self.assertEqual(jobs.claim_job('w2').attempts, 2)
+
+        # w1 coming back cannot record a result for the job any more
+        with mock.patch.object(jobs, 'parse_uploads', return_value=[{'pages': []}]):
+            jobs.run_job(job, 'w1')
+        self.assertEqual(ParseJob.objects.get().worker, 'w2')
+
+        self.go_stale()
+        self.assertEqual(jobs.reclaim_stale_jobs(), (0, 1))
+        self.assertEqual(ParseJob.objects.get().status, ParseJob.FAILED)
+
+    def test_errors_are_retried_with_backoff(self):
+        with mock.patch.object(jobs, 'parse_uploads', side_effect=RuntimeError('db went away')):
+            started = timezone.now()
+            jobs.run_job(jobs.claim_job('w1'), 'w1')
+            job = ParseJob.objects.get()
+            self.assertEqual((job.status, job.error), (ParseJob.QUEUED, 'db went away'))
+            self.assertGreaterEqual(job.run_after, started + timedelta(seconds=30))
+
+            ParseJob.objects.update(run_after=timezone.now())
+            jobs.run_job(jobs.claim_job('w1'), 'w1')
+        job = ParseJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (ParseJob.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+
+    @override_settings(PARSE_JOBS_MODE='inline')
+    def test_inline_jobs_fail_without_retry(self):
+        with mock.patch.object(jobs, 'parse_uploads', side_effect=RuntimeError('db went away')):
+            jobs.run_inline(self.job)
+        self.assertEqual(ParseJob.objects.get().status, ParseJob.FAILED)
+
+    def test_parse_errors_fail_the_job(self):
+        with mock.patch.object(jobs, 'parse_uploads', return_value=[{'error': 'not a seating plan'}]):
+            jobs.run_job(jobs.claim_job('w1'), 'w1')
+        job = ParseJob.objects.get()
+        self.assertEqual(job.status, ParseJob.FAILED)
+        self.assertIn('a.docx: not a seating plan', job.error)
+        self.assertFalse(UploadedFile.objects.exists())
+
+
+@override_settings(PUBLISH_CHUNK_SIZE=7, RESULT_SHARDS_ENABLED=False)
+class PublishTests(IsolatedTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('admin', is_staff=True)
+        first = UploadedFile.objects.create(file='uploads/a.docx', original_name='a.docx')
+        second = UploadedFile.objects.create(file='uploads/b.docx', original_name='b.docx')
+        self.expected = []
+
+        def pages(*sizes):
+            result = []
+            for size in sizes:
+                room = f'R{len(result) + len(self.expected)}'
+                records = []
+                for seat in range(1, size + 1):
+                    usn = f'4PS22CS{len(self.expected):03d}'
+                    self.expected.append((usn, room, str(seat)))
+                    records.append({'usn': usn, 'seat': str(seat), 'course': '21CS51', 'raw_data': [str(seat), usn]})
+                result.append({'page_idx': len(result), 'room': room, 'records': records})
+            return result
+        # 23 rows: several chunks of 7, the last one partial
+        self.batch = staging.stage_results(self.user, [(first, pages(5, 10)), (second, pages(8))])
+        self.exam = timezone.now() + timedelta(days=1)
+
+    def published(self):
+        return list(SeatAllotment.objects.order_by('id').values_list('usn', 'room_no', 'seat_no'))
+
+    def test_chunks_copy_every_row_in_order(self):
+        # A record deleted in the preview leaves a gap in the ids
+        StagingRecord.objects.filter(usn='4PS22CS007').delete()
+        self.expected = [row for row in self.expected if row[0] != '4PS22CS007']
+        version = DataVersion.current('allotments')
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            result = staging.publish_staged(self.batch, self.user, self.exam, window_name='Mid-term')
+
+        table = SeatAllotment._meta.db_table
+        self.assertEqual(sum(q['sql'].lstrip().startswith(f'INSERT INTO "{table}"') for q in queries), 4)
+
+        self.assertEqual((result['uploads'], result['rows']), (2, 22))
+        self.assertEqual(self.published(), self.expected)
+        allotment = SeatAllotment.objects.first()
+        self.assertEqual(allotment.exam_start_time, self.exam)
+        self.assertEqual(allotment.visible_until, self.exam + timedelta(hours=3))
+        self.assertTrue(allotment.window_active)
+        self.assertEqual(set(VisibilityWindow.objects.values_list('window_name', flat=True)), {'Mid-term'})
+        self.assertFalse(StagingBatch.objects.exists())
+        self.assertEqual(DataVersion.current('allotments'), version + 1)
+
+        with self.assertRaises(staging.PublishError):
+            staging.publish_staged(self.batch, self.user, self.exam)
+
+    def test_failure_rolls_everything_back(self):
+        version = DataVersion.current('allotments')
+        with mock.patch.object(staging, 'archive_batch', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                staging.publish_staged(self.batch, self.user, self.exam)
+
+        self.assertEqual(self.published(), [])
+        self.assertFalse(VisibilityWindow.objects.exists())
+        self.assertFalse(UploadedFile.objects.filter(is_published=True).exists())
+        self.assertTrue(StagingBatch.objects.filter(id=self.batch.id).exists())
+        self.assertEqual(DataVersion.current('allotments'), version)
+
+        # The preview can still be published afterwards
+        self.assertEqual(staging.publish_staged(self.batch, self.user, self.exam)['rows'], 23)
+
+
+class MetricsFileTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        self.enterContext(self.settings(METRICS_DIR=self.dir, METRICS_ENABLED=True))
+        # Samples of this process only, not of whatever ran before
+        self.enterContext(mock.patch.object(metrics, '_samples', {}))
+        self.enterContext(mock.patch.object(metrics, '_flusher_pid', os.getpid()))
+
+    def exited_process(self, name, count):
+        # Our pid with another start time: a process that exited and whose pid was reused
+        (self.dir / name).write_text(json.dumps([[metrics.RATE_LIMITED.name, ['/api/allotment'], count]]))
+
+    def total(self):
+        return metrics.collect().get((metrics.RATE_LIMITED.name, ('/api/allotment',)), 0)
+
+    def test_file_names_carry_the_process_start_time(self):
+        metrics.RATE_LIMITED.inc(path='/api/allotment')
+        metrics.flush()
+        pid, started = metrics._file_name()[:-len('.json')].split('-')
+        self.assertEqual(int(pid), os.getpid())
+        self.assertEqual([name for name in os.listdir(self.dir) if name.endswith('.json')], [metrics._file_name()])
+        self.assertFalse(metrics._exited(metrics._file_name()))
+        self.assertTrue(metrics._exited(f"{pid}-{int(started) + 1}.json"))
+
+    def test_exited_processes_are_folded_and_never_lost(self):
+        metrics.RATE_LIMITED.inc(2, path='/api/allotment')
+        self.exited_process(f"{os.getpid()}-1.json", 3)
+        self.assertEqual(self.total(), 5)
+        self.assertFalse((self.dir / f"{os.getpid()}-1.json").exists())
+        self.assertTrue((self.dir / metrics.EXITED_NAME).exists())
+        self.assertEqual(self.total(), 5)
+
+        self.exited_process(f"{os.getpid()}-2.json", 4)
+        metrics.RATE_LIMITED.inc(path='/api/allotment')
+        self.assertEqual(self.total(), 10)
+
+    def test_file_folded_but_not_removed_is_not_counted_twice(self):
+        self.exited_process(f"{os.getpid()}-1.json", 3)
+        with mock.patch('core.metrics.os.remove', side_effect=OSError):
+            self.assertEqual(self.total(), 3)
+        self.assertTrue((self.dir / f"{os.getpid()}-1.json").exists())
+        self.assertEqual(self.total(), 3)
+
+
+class DashboardTests(IsolatedTestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        now = timezone.now()
+        self.active, _ = make_window(['4PS22CS001', '4PS22CS002', '4PS22CS003'], name='active.docx')
+        SeatAllotment.objects.filter(usn='4PS22CS003').update(room_no='R2')
+        make_window(['4PS22CS004'], start=now + timedelta(hours=3), name='upcoming.docx')
+        make_window(['4PS22CS005', '4PS22CS006'], active=False, name='deactivated.docx')
+        make_window(['4PS22CS007'], start=now - timedelta(hours=3), name='expired.docx')
+        UploadedFile.objects.create(file='uploads/inactive.docx', original_name='inactive.docx')
+
+    def uploads(self, **params):
+        response = self.client.get('/dashboard/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['uploads']
+
+    def test_statuses_and_counts(self):
+        rows = {u.original_name: (u.status, u.allotment_count, u.room_count) for u in self.uploads()}
+        self.assertEqual(rows, {
+            'active.docx': ('Active', 3, 2),
+            'upcoming.docx': ('Upcoming', 1, 1),
+            'deactivated.docx': ('Deactivated (Manual)', 2, 1),
+            'expired.docx': ('Expired', 1, 1),
+            'inactive.docx': ('Inactive', 0, 0),
+        })
+
+    def test_status_filter(self):
+        expected = {
+            'active': 'active.docx', 'upcoming': 'upcoming.docx', 'deactivated': 'deactivated.docx',
+            'expired': 'expired.docx', 'inactive': 'inactive.docx',
+        }
+        for status, name in expected.items():
+            with self.subTest(status=status):
+                self.assertEqual([u.original_name for u in self.uploads(status=status)], [name])
+        # Anything else shows everything
+        self.assertEqual(len(self.uploads(status='bogus')), 5)
+
+    def test_pagination(self):
+        with mock.patch.object(views, 'DASHBOARD_PER_PAGE', 2):
+            pages = [self.uploads(page=page) for page in (1, 2, 3)]
+            self.assertEqual(self.uploads(page=99).number, 3)
+        names = [u.original_name for page in pages for u in page]
+        # Newest first, every upload exactly once
+        self.assertEqual(names, [
+            'inactive.docx', 'expired.docx', 'deactivated.docx', 'upcoming.docx', 'active.docx',
+        ])
+        self.assertEqual(pages[0].paginator.count, 5)
+
+    def test_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/dashboard/').status_code, 404)
+
+
+class PreviewApiTests(IsolatedTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('admin', is_staff=True)
+        self.client.force_login(self.user)
+        self.batch = stage(
+            self.user,
+            ('a.docx', [('GBL301', [f'4PS22CS{i:03d}' for i in range(1, 6)]), ('CSB104', ['4PS22CS006'])]),
+            ('b.docx', [('GBL302', ['4PS22EC001', '4PS22EC002'])]),
+        )
+        session = self.client.session
+        session['staging_batch_id'] = self.batch.id
+        session.save()
+        self.first_upload = self.batch.uploads.get(original_name='a.docx')
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-store', response['Cache-Control'])
+        return response.json()
+
+    def test_page_filters(self):
+        data = self.get('/preview/api/pages')
+        self.assertEqual([p['room'] for p in data['results']], ['GBL301', 'CSB104', 'GBL302'])
+        self.assertEqual(data['results'][2]['filename'], 'b.docx')
+
+        self.assertEqual(
+            [p['room'] for p in self.get('/preview/api/pages', file=self.first_upload.id)['results']],
+            ['GBL301', 'CSB104'],
+        )
+        self.assertEqual([p['room'] for p in self.get('/preview/api/pages', room='gbl')['results']], ['GBL301', 'GBL302'])
+
+    def test_record_filters(self):
+        page = self.get('/preview/api/pages', room='CSB104')['results'][0]
+        records = self.get('/preview/api/records', page_id=page['id'])['results']
+        self.assertEqual([(r['usn'], r['room'], r['filename']) for r in records], [('4PS22CS006', 'CSB104', 'a.docx')])
+
+        self.assertEqual([r['usn'] for r in self.get('/preview/api/records', usn=' 4ps22ec ')['results']],
+                         ['4PS22EC001', '4PS22EC002'])
+        self.assertEqual(self.get('/preview/api/records', file=self.first_upload.id)['total'], 6)
+        self.assertEqual(self.get('/preview/api/records', file=self.first_upload.id, room='GBL')['total'], 5)
+
+    def test_pagination_and_per_page_cap(self):
+        data = self.get('/preview/api/records', per_page=3, page=3)
+        self.assertEqual((data['page'], data['num_pages'], data['total']), (3, 3, 8))
+        self.assertEqual([r['usn'] for r in data['results']], ['4PS22EC001', '4PS22EC002'])
+        self.assertEqual(self.get('/preview/api/records', per_page=0)['num_pages'], 8)
+
+        with mock.patch.object(views, 'PREVIEW_MAX_PER_PAGE', 2):
+            self.assertEqual(self.get('/preview/api/records', per_page=1000)['num_pages'], 4)
+        self.assertEqual(self.get('/preview/api/records', per_page='x')['num_pages'], 1)
+
+    def test_only_the_sessions_batch_is_reachable(self):
+        other = stage(self.user, ('c.docx', [('HIDDEN', ['4PS22ME001'])]))
+        other_page = other.pages.get()
+        self.assertEqual(self.get('/preview/api/records', page_id=other_page.id)['total'], 0)
+        self.assertEqual(self.get('/preview/api/pages', file=other_page.upload_id)['total'], 0)
+
+        session = self.client.session
+        del session['staging_batch_id']
+        session.save()
+        self.assertEqual(self.client.get('/preview/api/pages').status_code, 404)
+        self.assertEqual(self.client.get('/preview/api/records').status_code, 404)
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.create_user('student'))
+        session = self.client.session
+        session['staging_batch_id'] = self.batch.id
+        session.save()
+        self.assertEqual(self.client.get('/preview/api/pages').status_code, 404)
+        self.assertEqual(self.client.get('/preview/api/records').status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get('/preview/api/records').status_code, 404)
+
+
+class PreviewEditTests(IsolatedTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('admin', is_staff=True)
+        self.client.force_login(self.user)
+        # Both files have a page 0 in the same room with a record for the same USN
+        self.batch = stage(
+            self.user,
+            ('a.docx', [('GBL301', ['4PS22CS001', '4PS22CS002'])]),
+            ('b.docx', [('GBL301', ['4PS22CS001'])]),
+        )
+        session = self.client.session
+        session['staging_batch_id'] = self.batch.id
+        session.save()
+        self.page_a = self.batch.pages.get(upload__original_name='a.docx')
+        self.page_b = self.batch.pages.get(upload__original_name='b.docx')
+        self.assertEqual(self.page_a.page_idx, self.page_b.page_idx)
+
+    def post(self, **data):
+        response = self.client.post('/preview/', data)
+        self.assertRedirects(response, '/preview/', fetch_redirect_response=False)
+
+    def test_room_edit_touches_only_its_page(self):
+        self.post(action='update_page_room', page_id=self.page_b.id, room_no='CSB104')
+        self.assertEqual(
+            dict(self.batch.pages.values_list('upload__original_name', 'room')),
+            {'a.docx': 'GBL301', 'b.docx': 'CSB104'},
+        )
+
+    def test_record_edit_touches_only_its_record_and_normalizes_usn(self):
+        target = self.page_b.records.get()
+        self.post(action='update_record', record_id=target.id, usn=' 4ps22cs099 ', seat='12')
+        self.assertEqual(
+            sorted(StagingRecord.objects.filter(page__batch=self.batch).values_list('page__upload__original_name', 'usn', 'seat')),
+            [('a.docx', '4PS22CS001', '1'), ('a.docx', '4PS22CS002', '2'), ('b.docx', '4PS22CS099', '12')],
+        )
+
+    def test_blank_usn_is_rejected(self):
+        target = self.page_a.records.get(usn='4PS22CS001')
+        self.post(action='update_record', record_id=target.id, usn='  ', seat='9')
+        target.refresh_from_db()
+        self.assertEqual((target.usn, target.seat), ('4PS22CS001', '1'))
+
+    def test_edits_outside_the_session_batch_are_ignored(self):
+        other = stage(self.user, ('c.docx', [('HIDDEN', ['4PS22ME001'])]))
+        other_page = other.pages.get()
+        self.post(action='update_page_room', page_id=other_page.id, room_no='GBL301')
+        self.post(action='update_record', record_id=other_page.records.get().id, usn='4PS22CS001', seat='1')
+        other_page.refresh_from_db()
+        self.assertEqual(other_page.room, 'HIDDEN')
+        self.assertEqual(other_page.records.get().usn, '4PS22ME001')
+
+
+class RawRowsTests(IsolatedTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('admin', is_staff=True)
+        self.upload = UploadedFile.objects.create(file='uploads/a.docx', original_name='a.docx')
+        self.pages = [
+            {'page_idx': 1, 'room': 'GBL301', 'columns': ['Sl', 'USN'], 'rows': [['1', '4PS22CS001'], ['2', '4PS22CS002']]},
+            {'page_idx': 2, 'room': 'CSB104', 'columns': ['Sl', 'USN', 'Name'], 'rows': [['1', '4PS22CS003', 'Åsa']]},
+        ]
+        self.batch = staging.stage_results(self.user, [(self.upload, [
+            {'page_idx': page['page_idx'], 'room': page['room'], 'columns': page['columns'], 'records': [
+                {'usn': row[1], 'seat': row[0], 'course': '21CS51', 'raw_data': row} for row in page['rows']
+            ]}
+            for page in self.pages
+        ])])
+
+    def test_publish_archives_the_parsed_rows(self):
+        # Preview edits change the allotment, not the archived row
+        StagingRecord.objects.filter(usn='4PS22CS003').update(usn='4PS22CS099')
+        staging.publish_staged(self.batch, self.user, timezone.now() + timedelta(days=1))
+
+        self.assertEqual(load_raw_rows(self.upload), self.pages)
+        self.assertEqual(self.upload.raw_rows.row_count, 3)
+        self.assertTrue(SeatAllotment.objects.filter(usn='4PS22CS099').exists())
+
+    @override_settings(RAW_ROWS_STORAGE='drop')
+    def test_drop_keeps_nothing(self):
+        staging.publish_staged(self.batch, self.user, timezone.now() + timedelta(days=1))
+        self.assertEqual(SeatAllotment.objects.count(), 3)
+        self.assertFalse(UploadRawRows.objects.exists())
+        self.assertEqual(load_raw_rows(self.upload), [])
+
+    def test_migration_groups_consecutive_rooms_into_pages(self):
+        migration = importlib.import_module('core.migrations.0008_compact_raw_rows')
+        # SeatAllotment.other_data no longer exists, so stand in for the historical model
+        legacy = [
+            ('GBL301', ['1', '4PS22CS001']), ('GBL301', ['2', '4PS22CS002']),
+            ('CSB104', ['1', '4PS22CS003']),
+            ('GBL301', ['3', '4PS22CS004']),
+        ]
+        seat_allotment = mock.Mock()
+        seat_allotment.objects.values_list.return_value.distinct.return_value = [self.upload.id]
+        seat_allotment.objects.filter.return_value.order_by.return_value.values_list.return_value.iterator.return_value = legacy
+        legacy_apps = mock.Mock()
+        legacy_apps.get_model.side_effect = lambda app, name: {'SeatAllotment': seat_allotment, 'UploadRawRows': UploadRawRows}[name]
+
+        migration.compact_other_data(legacy_apps, None)
+
+        self.assertEqual(load_raw_rows(self.upload), [
+            {'page_idx': 1, 'room': 'GBL301', 'columns': [], 'rows': [['1', '4PS22CS001'], ['2', '4PS22CS002']]},
+            {'page_idx': 2, 'room': 'CSB104', 'columns': [], 'rows': [['1', '4PS22CS003']]},
+            {'page_idx': 3, 'room': 'GBL301', 'columns': [], 'rows': [['3', '4PS22CS004']]},
+        ])
+        raw_rows = self.upload.raw_rows
+        self.assertEqual(raw_rows.row_count, 4)
+        self.assertEqual(raw_rows.raw_size, len(json.dumps(
+            {'pages': load_raw_rows(self.upload)}, separators=(',', ':'), ensure_ascii=False
+        ).encode()))
+
+
+@override_settings(PROFILER_SAMPLE_RATE=1.0, ALLOTMENT_INDEX_ENABLED=False, RATE_LIMITS={})
+class ProfilerTests(IsolatedTestCase):
+    def setUp(self):
+        allotment_index.invalidate()
+        directory = override_settings(PROFILER_DIR=Path(tempfile.mkdtemp(dir=settings.PROFILER_DIR.parent)))
+        directory.enable()
+        self.addCleanup(directory.disable)
+        self.addCleanup(self.reset_handler)
+
+    def reset_handler(self):
+        # The log file is opened once per process; let the next test open its own
+        if profiling._handler is not None:
+            profiling._handler.close()
+        profiling._handler = profiling._handler_pid = None
+
+    def logged(self):
+        return [json.loads(line) for line in (settings.PROFILER_DIR / f'{os.getpid()}.jsonl').read_text().splitlines()]
+
+    def test_sampled_request_is_logged_without_parameters(self):
+        make_window(['4PS22CS001'])
+        self.assertEqual(self.client.get('/api/allotment', {'usn': '4PS22CS001'}).status_code, 200)
+
+        [profile] = self.logged()
+        self.assertEqual((profile['method'], profile['path'], profile['view'], profile['status']),
+                         ('GET', '/api/allotment', 'student_lookup', 200))
+        self.assertEqual(profile['queries'], len(profile['statements']))
+        self.assertTrue(any('core_seatallotment' in statement['sql'] for statement in profile['statements']))
+        self.assertNotIn('4PS22CS001', json.dumps(profile))
+        self.assertIsNone(profile['profile'])
+
+    @override_settings(PROFILER_SAMPLE_RATE=0)
+    def test_rate_zero_is_not_installed(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilerMiddleware(lambda request: HttpResponse())
+        self.client.get('/api/allotment', {'usn': '4PS22CS001'})
+        self.assertEqual(os.listdir(settings.PROFILER_DIR), [])
+
+    @override_settings(PROFILER_SAMPLE_RATE=0)
+    def test_profiles_page_merges_processes(self):
+        for pid, ms in ((101, 5.0), (102, 90.0)):
+            with open(settings.PROFILER_DIR / f'{pid}.jsonl', 'w') as f:
+                f.write(json.dumps({'at': f'2026-10-18T09:00:0{pid - 100}', 'pid': pid, 'ms': ms, 'statements': []}) + '\n')
+                f.write('{"cut short')
+        # A rotated backup counts too
+        with open(settings.PROFILER_DIR / '101.jsonl.1', 'w') as f:
+            f.write(json.dumps({'at': '2026-10-18T08:59:00', 'pid': 101, 'ms': 40.0, 'statements': []}) + '\n')
+
+        self.assertEqual(self.client.get('/dashboard/profiles/').status_code, 404)
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        response = self.client.get('/dashboard/profiles/')
+        self.assertEqual([(p['pid'], p['ms']) for p in response.context['profiles']], [(102, 90.0), (101, 5.0), (101, 40.0)])
+        response = self.client.get('/dashboard/profiles/', {'sort': 'slowest'})
+        self.assertEqual([p['ms'] for p in response.context['profiles']], [90.0, 40.0, 5.0])
+
+
+class WarmUpTests(IsolatedTestCase):
+    def setUp(self):
+        allotment_index.invalidate()
+        self.addCleanup(allotment_index.invalidate)
+        now = timezone.now()
+        # Visible now, and a second window opening in 30 minutes
+        make_window(['4PS22CS001'], name='current.docx')
+        self.upcoming, window = make_window(['4PS22CS002', '4PS22CS003'], start=now + timedelta(minutes=90),
+                                            name='upcoming.docx')
+        self.opening = window.visible_from
+
+    def test_snapshot_is_written_for_the_upcoming_state(self):
+        report = warm_up(horizon=timedelta(hours=1))
+        self.assertEqual((report['at'], report['upcoming'], report['usns'], report['problems']),
+                         (self.opening, True, 3, []))
+
+        snapshot = load_snapshot(report['token'])
+        self.assertEqual(set(snapshot), {'4PS22CS001', '4PS22CS002', '4PS22CS003'})
+        self.assertEqual(snapshot['4PS22CS002']['seat'], '1')
+        self.assertNotEqual(allotment_index.state()[0], report['token'])
+
+        # A worker rebuilding once the window is open loads the snapshot instead of querying
+        SeatAllotment.objects.filter(uploaded_file=self.upcoming).update(seat_no='99')
+        with mock.patch('django.utils.timezone.now', return_value=self.opening + timedelta(seconds=1)), \
+                self.assertLogs('core.allotment_index', 'INFO') as logs:
+            allotment, _ = lookup_allotment('4PS22CS002')
+        self.assertIn('rebuilt from snapshot', logs.output[0])
+        self.assertEqual(allotment['seat'], '1')
+
+    def test_prewritten_shards_survive_syncs_until_the_opening(self):
+        report = warm_up(horizon=timedelta(hours=1))
+        generation = os.path.join(settings.RESULT_SHARDS_ROOT, report['token'])
+        self.assertTrue(os.path.isfile(os.path.join(generation, result_shards.OPENS_AT_MARKER)))
+
+        # The sync for the current state keeps the upcoming generation around
+        summary = result_shards.sync_result_shards()
+        self.assertIn('Result shards generation', summary)
+        self.assertTrue(os.path.isfile(os.path.join(generation, result_shards.OPENS_AT_MARKER)))
+        self.assertEqual(len([name for name in os.listdir(settings.RESULT_SHARDS_ROOT)
+                              if os.path.isdir(os.path.join(settings.RESULT_SHARDS_ROOT, name))]), 2)
+        self.assertEqual(warm_up(horizon=timedelta(hours=1))['shards'], 'already written')
+
+        # At the opening the sync only switches the manifest over, and drops the old generation
+        with mock.patch('django.utils.timezone.now', return_value=self.opening + timedelta(seconds=1)):
+            summary = result_shards.sync_result_shards()
+        self.assertIn(f"switched to generation {report['token']}", summary)
+        self.assertEqual([name for name in os.listdir(settings.RESULT_SHARDS_ROOT)
+                          if os.path.isdir(os.path.join(settings.RESULT_SHARDS_ROOT, name))], [report['token']])
+
+
+class NormalizeUsnTests(SimpleTestCase):
+    def test_normalize_usn(self):
+        for raw, expected in [
+            ('4PS22CS001', '4PS22CS001'),
+            (' 4ps22cs001 ', '4PS22CS001'),
+            ('4ps 22\tcs\n001', '4PS22CS001'),
+            ('\u00a04Ps22cS001\u00a0', '4PS22CS001'),
+            ('', ''),
+            (None, ''),
+        ]:
+            with self.subTest(raw=raw):
+                self.assertEqual(normalize_usn(raw), expected)
+
+
+@override_settings(RATE_LIMITS={})
+class UsnLookupTests(IsolatedTestCase):
+    def setUp(self):
+        allotment_index.invalidate()
+        self.addCleanup(allotment_index.invalidate)
+        # Stored as typed in the seating plan
+        make_window([' 4ps22cs001', '4PS22CS002'])
+
+    def test_padded_lower_case_usn_is_found(self):
+        for enabled in (True, False):
+            with self.subTest(index=enabled), override_settings(ALLOTMENT_INDEX_ENABLED=enabled):
+                allotment_index.invalidate()
+                for usn in ('  4ps22cs001 ', '4PS22CS001', '4ps22cs002\t'):
+                    response = self.client.get('/api/allotment', {'usn': usn})
+                    self.assertEqual(response.status_code, 200, usn)
+                self.assertEqual(self.client.get('/api/allotment', {'usn': ' 4ps22cs003 '}).status_code, 404)
+
+    def test_migration_backfills_normalized_usns(self):
+        migration = importlib.import_module('core.migrations.0003_seatallotment_usn_normalized')
+        SeatAllotment.objects.update(usn_normalized='')
+        migration.backfill_usn_normalized(apps, None)
+        self.assertEqual(sorted(SeatAllotment.objects.values_list('usn', 'usn_normalized')),
+                         [(' 4ps22cs001', '4PS22CS001'), ('4PS22CS002', '4PS22CS002')])
+
+
+def async_lookup_urlconf():
+    """A fresh copy of seat_allotment.urls loaded with ASYNC_STUDENT_LOOKUP on (the route is picked at import)."""
+    spec = importlib.util.find_spec('seat_allotment.urls')
+    urls = importlib.util.module_from_spec(spec)
+    with override_settings(ASYNC_STUDENT_LOOKUP=True):
+        spec.loader.exec_module(urls)
+    return urls
+
+
+@override_settings(RATE_LIMITS={})
+class AsyncStudentLookupTests(IsolatedTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        urlconf = override_settings(ROOT_URLCONF=async_lookup_urlconf())
+        urlconf.enable()
+        cls.addClassCleanup(urlconf.disable)
+
+    def setUp(self):
+        allotment_index.invalidate()
+        self.addCleanup(allotment_index.invalidate)
+        self.client = AsyncClient()
+        make_window(['4PS22CS001'])
+        _, self.closed = make_window(['4PS22CS002'], start=timezone.now() - timedelta(hours=3), name='closed.docx')
+        _, self.upcoming = make_window(['4PS22CS003'], start=timezone.now() + timedelta(hours=3), name='upcoming.docx')
+        _, self.off = make_window(['4PS22CS004'], active=False, name='off.docx')
+
+    def test_routes_to_the_async_view(self):
+        self.assertIs(resolve('/api/allotment').func, views.student_lookup_async)
+
+    async def test_hit_miss_and_not_modified(self):
+        for enabled in (True, False):
+            with self.subTest(index=enabled), override_settings(ALLOTMENT_INDEX_ENABLED=enabled):
+                allotment_index.invalidate()
+                response = await self.client.get('/api/allotment', {'usn': ' 4ps22cs001 '})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual((response.json()['room'], response.json()['seat']), ('R1', '1'))
+                etag = response['ETag']
+
+                response = await self.client.get('/api/allotment', {'usn': '4PS22CS001'}, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+
+                response = await self.client.get('/api/allotment', {'usn': '4PS22CS999'})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual((await self.client.get('/api/allotment')).status_code, 400)
+
+    async def test_only_visible_windows_answer(self):
+        for enabled in (True, False):
+            with self.subTest(index=enabled), override_settings(ALLOTMENT_INDEX_ENABLED=enabled):
+                allotment_index.invalidate()
+                for usn in ('4PS22CS002', '4PS22CS003', '4PS22CS004'):
+                    response = await self.client.get('/api/allotment', {'usn': usn})
+                    self.assertEqual(response.status_code, 404, usn)
+
+
+class BenchmarkProfileTests(SimpleTestCase):
+    def test_unknown_profiles_are_rejected_before_any_server_starts(self):
+        with mock.patch('core.management.commands.bench_servers.LocalServer') as server, \
+                mock.patch('core.management.commands.bench_servers.visible_usns') as usns:
+            for profiles in ('wsgi,gevent', ' , '):
+                with self.subTest(profiles=profiles), self.assertRaisesMessage(CommandError, 'choose from asgi, wsgi'):
+                    call_command('bench_servers', profiles=profiles)
+        server.assert_not_called()
+        usns.assert_not_called()
+
+    def test_loadtest_profile_choices(self):
+        with mock.patch('core.management.commands.loadtest.LocalServer') as server, \
+                self.assertRaisesMessage(CommandError, "invalid choice: 'gevent'"):
+            call_command('loadtest', '--profile', 'gevent')
+        server.assert_not_called()
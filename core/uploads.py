@@ -0,0 +1,123 @@
+"""
+Content-addressed storage and parse caching for uploaded seating plans.
+
+Admins often upload the same .docx again after a failed publish or a small
+correction. Each upload is hashed (SHA-256) as it arrives and stored as
+uploads/<hash>.docx, so identical files share one copy on disk. Parser output is
+cached in ParseCache keyed by (hash, PARSER_VERSION), so a repeat upload goes
+straight to the preview without parsing.
+
+Several UploadedFile rows can point at the same stored file: a file may only be
+removed from storage once no UploadedFile references it any more. Reusing a
+stored file refreshes its modification time, so expiry (core.expiry) does not
+take it for an old orphan while the new UploadedFile is being created.
+"""
+import copy
+import hashlib
+import logging
+import os
+
+from django.core.files.storage import default_storage
+
+from . import metrics
+from .models import ParseCache, UploadedFile
+from .parser import PARSER_VERSION, parse_many
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = 'uploads'
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def stored_name(digest):
+    return f"{UPLOAD_DIR}/{digest}.docx"
+
+
+def store_upload(file):
+    """Creates the UploadedFile for an uploaded .docx, reusing the stored copy of an identical file."""
+    digest = content_hash(file)
+    name = stored_name(digest)
+    if default_storage.exists(name):
+        # Expiry only removes unreferenced files older than ORPHAN_FILE_MIN_AGE_SECONDS
+        _touch(name)
+    else:
+        # If a concurrent upload of the same file gets there first, storage picks
+        # a free name and this upload keeps its own copy
+        name = default_storage.save(name, file)
+    upload = UploadedFile.objects.create(file=name, original_name=file.name, content_hash=digest)
+    if not default_storage.exists(name):
+        # Expiry removed the shared copy before our row referenced it
+        upload.file = default_storage.save(name, file)
+        upload.save(update_fields=['file'])
+    return upload
+
+
+def _touch(name):
+    try:
+        os.utime(default_storage.path(name))
+    except (NotImplementedError, FileNotFoundError):
+        pass  # no local paths, or already removed; store_upload re-checks the file either way
+
+
+def _record_parse(result, source):
+    if result.get('error'):
+        metrics.PARSE_FILES.inc(result='error')
+        return
+    metrics.PARSE_FILES.inc(result=source)
+    metrics.PARSE_RECORDS.observe(sum(len(page['records']) for page in result.get('pages', [])), source=source)
+
+
+def parse_uploads(uploads, progress=None):
+    """
+    Parse results for a list of UploadedFile objects, in the same order. Cached
+    results are reused; every other distinct file is parsed once (parse_many) and
+    its result cached unless parsing failed. progress, if given, is called as
+    progress(files_done, files_total) when cached results are known and after
+    each parsed file.
+    """
+    hashes = {upload.content_hash for upload in uploads if upload.content_hash}
+    results = dict(ParseCache.objects.filter(
+        content_hash__in=hashes, parser_version=PARSER_VERSION
+    ).values_list('content_hash', 'result'))
+
+    to_parse = {}
+    for upload in uploads:
+        key = upload.content_hash or upload.file.name
+        if key not in results:
+            to_parse.setdefault(key, upload.file.path)
+    logger.info(f"{len(uploads)} uploads: {len(to_parse)} distinct files to parse, the rest from the parse cache")
+
+    done = len(uploads) - len(to_parse)
+    if progress:
+        progress(done, len(uploads))
+
+    def on_parsed():
+        nonlocal done
+        done += 1
+        progress(done, len(uploads))
+
+    parsed = dict(zip(to_parse, parse_many(list(to_parse.values()), on_parsed if progress else None)))
+    ParseCache.objects.bulk_create([
+        ParseCache(content_hash=key, parser_version=PARSER_VERSION, result=result)
+        for key, result in parsed.items()
+        if key in hashes and not result.get('error')
+    ], ignore_conflicts=True)
+    results.update(parsed)
+
+    # Callers tag the pages per upload, so the same file uploaded twice needs two copies
+    handed_out = set()
+    ordered = []
+    for upload in uploads:
+        key = upload.content_hash or upload.file.name
+        result = results[key]
+        _record_parse(result, 'parsed' if key in parsed else 'cached')
+        ordered.append(copy.deepcopy(result) if key in handed_out else result)
+        handed_out.add(key)
+    return ordered
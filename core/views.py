@@ -1,18 +1,31 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth import authenticate, login, logout as auth_logout
-from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponseForbidden, Http404
+from django.http import HttpResponse, JsonResponse, HttpResponseNotModified, Http404
 from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-from datetime import timedelta, datetime
+from django.db import IntegrityError
+from django.db.models import Case, Count, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.core.paginator import Paginator
+from datetime import datetime
 import os
+import hmac
 import json
 import logging
 
-from .models import UploadedFile, SeatAllotment, VisibilityWindow, AdminAuditLog
-from .parser import parse_exam_file_wrapper
+from .models import UploadedFile, SeatAllotment, AdminAuditLog, ParseJob, StagingBatch, StagingPage, StagingRecord
+from .parser import normalize_usn
+from .uploads import store_upload
+from .jobs import enqueue_parse_job, run_inline
+from .staging import PublishError, publish_staged
+from . import metrics as app_metrics
+from .profiling import recent_profiles
+from .allotment_index import allotment_index, lookup_allotment, lookup_allotments, alookup_allotment, allotments_changed, lookup_flight, state_etag
 
 logger = logging.getLogger(__name__)
 
@@ -66,52 +79,62 @@ def logout_view(request):
     auth_logout(request)
     return redirect('admin_login')
 
-from django.http import JsonResponse, HttpResponseForbidden, Http404
-
-# ... (imports remain similar, just adding Http404 to line 5 or wherever likely)
-
-@login_required(login_url='admin_login')
-def admin_dashboard(request):
-    if not request.user.is_staff:
-        raise Http404
-    cleanup_expired_data()
-    # ...
-
-# Actually, defining a custom decorator is cleaner.
-# But for now, user asked to "return 404".
-# Let's modify the imports and the specific views.
-
 def admin_dashboard(request):
     if not request.user.is_authenticated or not request.user.is_staff:
         raise Http404
     
-    cleanup_expired_data()
-    uploads = UploadedFile.objects.all().order_by('-uploaded_at')
-    
-    dashboard_data = []
-    now = timezone.now()
-    
-    for upload in uploads:
-        status = "Inactive"
-        if hasattr(upload, 'visibility_window'):
-            win = upload.visibility_window
-            if win.visible_until < now:
-                status = "Expired"
-            elif win.visible_from <= now <= win.visible_until and win.is_active_manual:
-                status = "Active"
-            elif win.visible_from > now:
-                status = "Upcoming"
-            
-            if not win.is_active_manual and status != "Expired":
-                 status = "Deactivated (Manual)"
-        
-        dashboard_data.append({
-            'file': upload,
-            'status': status,
-            'window': getattr(upload, 'visibility_window', None)
-        })
-        
-    return render(request, 'dashboard.html', {'uploads': dashboard_data})
+    # Expired uploads are removed by manage.py expire_allotments, not here
+    statuses = _upload_statuses(timezone.now())
+    uploads = _dashboard_uploads(statuses)
+    status_filter = request.GET.get('status', '')
+    if status_filter in statuses:
+        uploads = uploads.filter(statuses[status_filter][1])
+    else:
+        status_filter = ''
+    page_obj = Paginator(uploads, DASHBOARD_PER_PAGE).get_page(request.GET.get('page'))
+
+    # This admin's uploads still parsing, or finished but not looked at yet
+    jobs = [
+        {**job, 'files_total': len(job['files'])}
+        for job in ParseJob.objects.filter(user=request.user, seen_at__isnull=True)
+        .order_by('id').values('id', 'status', 'files', 'files_done', 'error')
+    ]
+
+    return render(request, 'dashboard.html', {
+        'uploads': page_obj,
+        'jobs': jobs,
+        'statuses': [(key, label) for key, (label, _) in statuses.items()],
+        'status_filter': status_filter,
+    })
+
+DASHBOARD_PER_PAGE = 25
+
+def _upload_statuses(now):
+    # status key -> (label, condition); the conditions don't overlap, so the
+    # same Q both computes the status column and filters by it
+    active = Q(visibility_window__visible_until__gte=now, visibility_window__is_active_manual=True)
+    return {
+        'active': ('Active', active & Q(visibility_window__visible_from__lte=now)),
+        'upcoming': ('Upcoming', active & Q(visibility_window__visible_from__gt=now)),
+        'deactivated': ('Deactivated (Manual)', Q(
+            visibility_window__visible_until__gte=now, visibility_window__is_active_manual=False,
+        )),
+        'expired': ('Expired', Q(visibility_window__visible_until__lt=now)),
+        'inactive': ('Inactive', Q(visibility_window__isnull=True)),
+    }
+
+def _dashboard_uploads(statuses):
+    # One query per page: the window comes joined, the status is a CASE and the
+    # per-upload counts are correlated subqueries. Walking upload_dashboard_idx
+    # they only run for the rows on the page (and the paginator's COUNT leaves
+    # them out)
+    allotments = SeatAllotment.objects.filter(uploaded_file=OuterRef('pk')).order_by().values('uploaded_file')
+    return UploadedFile.objects.select_related('visibility_window').annotate(
+        status=Case(*[When(condition, then=Value(label)) for label, condition in statuses.values()],
+                    default=Value('Inactive')),
+        allotment_count=Coalesce(Subquery(allotments.annotate(n=Count('id')).values('n')), 0),
+        room_count=Coalesce(Subquery(allotments.annotate(n=Count('room_no', distinct=True)).values('n')), 0),
+    ).order_by('-uploaded_at', '-id')
 
 def upload_file(request):
     if not request.user.is_authenticated or not request.user.is_staff:
@@ -120,9 +143,7 @@ def upload_file(request):
     if request.method == 'POST' and request.FILES.getlist('file'):
         files = request.FILES.getlist('file')
         
-        all_pages = []
-        upload_ids = []
-        
+        uploads = []
         for file in files:
             if not file.name.endswith('.docx'):
                 messages.error(request, f"Skipped {file.name}: Only .docx files allowed.")
@@ -133,49 +154,73 @@ def upload_file(request):
                 # messages.warning(request, f"Warning: {file.name} might not be a valid DOCX.")
                 pass
                 
-            upload_obj = UploadedFile.objects.create(file=file)
-            upload_ids.append(upload_obj.id)
+            upload_obj = store_upload(file)
             AdminAuditLog.objects.create(user=request.user, action='UPLOAD', details=f"Uploaded {file.name}")
-            
-            file_path = upload_obj.file.path
-            result = parse_exam_file_wrapper(file_path)
-            
-            if "error" in result and result["error"]:
-                 messages.error(request, f"Error parsing {file.name}: {result['error']}")
-                 upload_obj.delete()
-                 upload_ids.remove(upload_obj.id)
-                 continue
-
-            # Tag pages with source info
-            file_pages = result.get('pages', [])
-            for page in file_pages:
-                page['upload_id'] = upload_obj.id
-                page['filename'] = file.name
-                all_pages.append(page)
-        
-        if not all_pages:
+            uploads.append(upload_obj)
+
+        if not uploads:
             return redirect('admin_dashboard')
 
-        # Store aggregated pages
-        request.session['parsed_pages'] = all_pages
-        request.session['upload_ids'] = upload_ids
-        
-        return redirect('preview_data')
+        # Parsing runs in a ParseJob (core.jobs): picked up by run_parse_worker, or
+        # right here when PARSE_JOBS_MODE is 'inline'
+        job = enqueue_parse_job(request.user, uploads)
+        if settings.PARSE_JOBS_MODE == 'inline':
+            run_inline(job)
+            return redirect('open_parse_job', job_id=job.id)
+
+        messages.info(request, f"Parsing {len(uploads)} file(s) in the background. The preview opens when it is done.")
+        return redirect('admin_dashboard')
         
     return redirect('admin_dashboard')
 
+def parse_job_status(request, job_id):
+    """Progress of an upload's ParseJob, polled by the dashboard."""
+    if not request.user.is_authenticated or not request.user.is_staff:
+        raise Http404
+
+    job = ParseJob.objects.filter(id=job_id).values('status', 'files', 'files_done', 'error').first()
+    if job is None:
+        raise Http404
+    response = JsonResponse({
+        'id': job_id,
+        'status': job['status'],
+        'files_done': job['files_done'],
+        'files_total': len(job['files']),
+        'error': job['error'] if job['status'] == ParseJob.FAILED else '',
+        'open_url': reverse('open_parse_job', args=[job_id]),
+    })
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+def open_parse_job(request, job_id):
+    """Opens the preview of a finished job (or shows why it failed)."""
+    if not request.user.is_authenticated or not request.user.is_staff:
+        raise Http404
+
+    job = get_object_or_404(ParseJob, id=job_id)
+    if job.status not in (ParseJob.DONE, ParseJob.FAILED):
+        return redirect('admin_dashboard')
+
+    ParseJob.objects.filter(id=job.id).update(seen_at=timezone.now())
+    if job.status == ParseJob.FAILED:
+        for error in job.error.splitlines():
+            messages.error(request, error)
+        return redirect('admin_dashboard')
+
+    for error in job.result['errors']:
+        messages.error(request, error)
+    # The pages live in the staging tables; the session only points at them
+    request.session['staging_batch_id'] = job.result['batch_id']
+    return redirect('preview_data')
+
 def preview_data(request):
     if not request.user.is_authenticated or not request.user.is_staff:
         raise Http404
 
-    pages = request.session.get('parsed_pages', [])
-    upload_ids = request.session.get('upload_ids', [])
-    
-    # Fallback for legacy single upload session if any
-    if not upload_ids and request.session.get('upload_id'):
-        upload_ids = [request.session.get('upload_id')]
-    
-    if not pages or not upload_ids:
+    batch = StagingBatch.objects.filter(id=request.session.get('staging_batch_id')).first()
+    if batch is None:
+        return redirect('admin_dashboard')
+    if not batch.uploads.exists():
         return redirect('admin_dashboard')
         
     if request.method == 'POST':
@@ -194,71 +239,31 @@ def preview_data(request):
                 messages.error(request, f"Invalid date format: {e}")
                 return redirect('preview_data')
 
-            # 1. Create SeatAllotments
-            # We need to map upload_id to UploadedFile objects to avoid repeated DB hits
-            upload_objs = {u.id: u for u in UploadedFile.objects.filter(id__in=upload_ids)}
-            
-            records_to_create = []
-            
-            for page in pages:
-                uid = page.get('upload_id')
-                if not uid or uid not in upload_objs: continue
-                
-                u_obj = upload_objs[uid]
-                room = page.get('room', 'UNKNOWN')
-                
-                for record in page.get('records', []):
-                    records_to_create.append(SeatAllotment(
-                        uploaded_file=u_obj,
-                        usn=record.get('usn', 'UNKNOWN'),
-                        room_no=room, 
-                        seat_no=record.get('seat', 'UNKNOWN'),
-                        course_code=record.get('course', 'UNKNOWN'),
-                        exam_start_time=exam_dt,
-                        other_data=record.get('raw_data', [])
-                    ))
-            
-            SeatAllotment.objects.bulk_create(records_to_create)
-            
-            # 2. Create VisibilityWindows & Update UploadedFiles
-            for uid, u_obj in upload_objs.items():
-                w_name = window_name_input if window_name_input else u_obj.filename()
-                
-                VisibilityWindow.objects.create(
-                    file=u_obj,
-                    window_name=w_name,
-                    visible_from=exam_dt - timedelta(minutes=45),
-                    visible_until=exam_dt + timedelta(hours=3),
-                    is_active_manual=True
-                )
-                
-                u_obj.is_published = True
-                u_obj.exam_date = exam_dt.date()
-                u_obj.save()
-                AdminAuditLog.objects.create(user=request.user, action='PUBLISH', details=f"Published {u_obj.filename()}")
-            
+            # Windows, uploads, allotments and audit entries in one transaction (core.staging)
+            try:
+                published = publish_staged(batch, request.user, exam_dt, window_name_input)
+            except (PublishError, IntegrityError) as e:
+                logger.warning(f"Publish of staging batch {batch.id} failed: {e}")
+                messages.error(request, f"Publish failed, nothing was published: {e}")
+                return redirect('preview_data')
+
             # Cleanup Session
-            request.session.pop('parsed_pages', None)
-            request.session.pop('upload_ids', None)
-            request.session.pop('upload_id', None)
+            request.session.pop('staging_batch_id', None)
             
-            messages.success(request, f"Published {len(upload_ids)} files successfully!")
+            messages.success(
+                request,
+                f"Published {published['uploads']} files ({published['rows']} students) "
+                f"in {published['timings']['total']:.1f}s successfully!"
+            )
             return redirect('admin_dashboard')
 
         # --- UPDATE PAGE ROOM ---
         elif action == 'update_page_room':
             try:
-                page_idx = int(request.POST.get('page_idx'))
+                page_id = int(request.POST.get('page_id'))
                 new_room = request.POST.get('room_no')
                 
-                # Find page by index (assuming order is preserved)
-                # parser uses block_index which might not be 0..N perfectly if empty blocks skipped
-                # better to iterate and match 'page_idx' stored in dict
-                
-                target_page = next((p for p in pages if p['page_idx'] == page_idx), None)
-                if target_page:
-                    target_page['room'] = new_room
-                    request.session['parsed_pages'] = pages # Save back
+                if StagingPage.objects.filter(id=page_id, batch=batch).update(room=new_room):
                     messages.success(request, "Room updated for page.")
             except:
                 messages.error(request, "Error updating room.")
@@ -268,26 +273,105 @@ def preview_data(request):
         # --- UPDATE SINGLE RECORD ---
         elif action == 'update_record':
             try:
-                page_idx = int(request.POST.get('page_idx'))
-                row_idx = int(request.POST.get('row_idx'))
-                new_usn = request.POST.get('usn')
+                record_id = int(request.POST.get('record_id'))
+                new_usn = normalize_usn(request.POST.get('usn'))
                 new_seat = request.POST.get('seat')
                 
-                target_page = next((p for p in pages if p['page_idx'] == page_idx), None)
-                if target_page:
-                    if 0 <= row_idx < len(target_page['records']):
-                        target_page['records'][row_idx]['usn'] = new_usn
-                        target_page['records'][row_idx]['seat'] = new_seat
-                        request.session['parsed_pages'] = pages # Save back
-                        messages.success(request, "Record updated.")
+                if new_usn and StagingRecord.objects.filter(id=record_id, page__batch=batch).update(
+                    usn=new_usn, seat=new_seat
+                ):
+                    messages.success(request, "Record updated.")
             except:
                 messages.error(request, "Error updating record.")
                 
             return redirect('preview_data')
 
-    # Calculate total for display
-    total_count = sum(len(p['records']) for p in pages)
-    return render(request, 'preview.html', {'pages': pages, 'count': total_count})
+    # Only the skeleton: pages and records are loaded by the template from the
+    # preview_pages_api / preview_records_api endpoints
+    summary = batch.pages.aggregate(pages=Count('id'), total=Sum('record_count'))
+    return render(request, 'preview.html', {
+        'uploads': batch.uploads.order_by('id'),
+        'page_count': summary['pages'],
+        'count': summary['total'] or 0,
+    })
+
+PREVIEW_MAX_PER_PAGE = 200
+
+def _preview_batch(request):
+    if not request.user.is_authenticated or not request.user.is_staff:
+        raise Http404
+    batch = StagingBatch.objects.filter(id=request.session.get('staging_batch_id')).first()
+    if batch is None:
+        raise Http404
+    return batch
+
+def _preview_page(request, queryset, default_per_page):
+    try:
+        per_page = min(max(int(request.GET.get('per_page', default_per_page)), 1), PREVIEW_MAX_PER_PAGE)
+    except ValueError:
+        per_page = default_per_page
+    return Paginator(queryset, per_page).get_page(request.GET.get('page'))
+
+def _preview_response(page_obj, results):
+    response = JsonResponse({
+        'results': results,
+        'page': page_obj.number,
+        'num_pages': page_obj.paginator.num_pages,
+        'total': page_obj.paginator.count,
+    })
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+def _filter_pages(request, pages):
+    upload_id = request.GET.get('file')
+    if upload_id and upload_id.isdigit():
+        pages = pages.filter(upload_id=upload_id)
+    room = request.GET.get('room', '').strip()
+    if room:
+        pages = pages.filter(room__icontains=room)
+    return pages
+
+def preview_pages_api(request):
+    """Staged pages of the preview, paginated; ?file=<upload id>&room=<text>&page=N."""
+    batch = _preview_batch(request)
+    pages = _filter_pages(request, batch.pages.all())
+    page_obj = _preview_page(request, pages.values(
+        'id', 'upload_id', 'upload__original_name', 'upload__file', 'page_idx', 'room', 'record_count',
+    ), 20)
+    return _preview_response(page_obj, [{
+        'id': page['id'],
+        'upload_id': page['upload_id'],
+        'filename': page['upload__original_name'] or os.path.basename(page['upload__file']),
+        'page_idx': page['page_idx'],
+        'room': page['room'],
+        'record_count': page['record_count'],
+    } for page in page_obj])
+
+def preview_records_api(request):
+    """Staged records, paginated; ?page_id=<staging page> or ?usn=<search>, plus the page filters."""
+    batch = _preview_batch(request)
+    pages = _filter_pages(request, batch.pages.all())
+    page_id = request.GET.get('page_id')
+    if page_id and page_id.isdigit():
+        pages = pages.filter(id=page_id)
+    records = StagingRecord.objects.filter(page__in=pages)
+    usn = normalize_usn(request.GET.get('usn'))
+    if usn:
+        records = records.filter(usn__contains=usn)
+    page_obj = _preview_page(request, records.order_by('page__position', 'row_idx').values(
+        'id', 'usn', 'seat', 'course', 'page_id', 'page__page_idx', 'page__room',
+        'page__upload__original_name', 'page__upload__file',
+    ), 100)
+    return _preview_response(page_obj, [{
+        'id': record['id'],
+        'usn': record['usn'],
+        'seat': record['seat'],
+        'course': record['course'],
+        'page_id': record['page_id'],
+        'page_idx': record['page__page_idx'],
+        'room': record['page__room'],
+        'filename': record['page__upload__original_name'] or os.path.basename(record['page__upload__file']),
+    } for record in page_obj])
 
 def delete_upload(request, upload_id):
     if not request.user.is_authenticated or not request.user.is_staff:
@@ -297,41 +381,152 @@ def delete_upload(request, upload_id):
         upload = get_object_or_404(UploadedFile, id=upload_id)
         filename = upload.filename()
         upload.delete()
+        allotments_changed()
         AdminAuditLog.objects.create(user=request.user, action='DELETE', details=f"Deleted {filename}")
         messages.success(request, "Deleted successfully")
     return redirect('admin_dashboard')
 
-# ================= UTILS =================
-def cleanup_expired_data():
-    now = timezone.now()
-    expired_windows = VisibilityWindow.objects.filter(visible_until__lt=now)
-    for win in expired_windows:
-        win.file.delete()
-
 # ================= STUDENT VIEWS =================
+def _cache_headers(response, etag, expires_at, max_age):
+    # Never let a cached answer outlive the current visibility state
+    if expires_at is not None:
+        max_age = max(0, min(max_age, int((expires_at - timezone.now()).total_seconds())))
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+def _not_modified(request, token, expires_at):
+    # The ETag names the publish version + visible windows, so a refresh with a
+    # matching If-None-Match is answered without any DB work
+    etag = state_etag(token)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        app_metrics.LOOKUP_CACHE.inc(cache='etag', result='hit')
+        return _cache_headers(HttpResponseNotModified(), etag, expires_at, settings.STUDENT_API_MAX_AGE)
+    app_metrics.LOOKUP_CACHE.inc(cache='etag', result='miss')
+    return None
+
+def _allotment_response(allotment, token, expires_at, body=None):
+    etag = state_etag(token)
+    if allotment:
+        # Coalesced DB lookups come with their body already serialized
+        response = HttpResponse(body, content_type='application/json') if body else JsonResponse(allotment)
+        return _cache_headers(response, etag, expires_at, settings.STUDENT_API_MAX_AGE)
+    else:
+        response = JsonResponse({'message': 'Allotment not found'}, status=404)
+        return _cache_headers(response, etag, expires_at, settings.STUDENT_API_MISS_MAX_AGE)
+
 def student_lookup(request):
     usn = request.GET.get('usn')
     if not usn:
         return JsonResponse({'error': 'USN required'}, status=400)
+
+    token, expires_at = allotment_index.state()
+    not_modified = _not_modified(request, token, expires_at)
+    if not_modified:
+        return not_modified
     
-    now = timezone.now()
-    allotment = SeatAllotment.objects.filter(
-        usn__iexact=usn,
-        uploaded_file__visibility_window__visible_from__lte=now,
-        uploaded_file__visibility_window__visible_until__gte=now,
-        uploaded_file__visibility_window__is_active_manual=True
-    ).select_related('uploaded_file').first()
-    
-    if allotment:
-        # Get start time in local timezone (Asia/Kolkata check)
-        # Django handles timezone conversion if USE_TZ is True
-        localized_time = timezone.localtime(allotment.exam_start_time)
-        return JsonResponse({
-            "usn": allotment.usn,
-            "room": allotment.room_no,
-            "seat": allotment.seat_no,
-            "course_code": allotment.course_code or "N/A",
-            "exam_time": localized_time.isoformat(),
-        })
-    else:
-        return JsonResponse({'message': 'Allotment not found'}, status=404)
+    # Served from the per-worker index (see allotment_index.py), no SQL on the hot path
+    allotment, body = lookup_allotment(usn)
+    return _allotment_response(allotment, token, expires_at, body)
+
+async def student_lookup_async(request):
+    """Same as student_lookup, for ASGI deployments (async ORM, no thread per request)."""
+    usn = request.GET.get('usn')
+    if not usn:
+        return JsonResponse({'error': 'USN required'}, status=400)
+
+    token, expires_at = await allotment_index.astate()
+    not_modified = _not_modified(request, token, expires_at)
+    if not_modified:
+        return not_modified
+
+    allotment, body = await alookup_allotment(usn)
+    return _allotment_response(allotment, token, expires_at, body)
+
+def _has_batch_api_key(request):
+    key = request.headers.get('X-API-Key', '')
+    return bool(key) and any(hmac.compare_digest(key, valid) for valid in settings.STUDENT_BATCH_API_KEYS)
+
+@csrf_exempt
+def student_batch_lookup(request):
+    """
+    Help-desk kiosks: POST {"usns": [...]} and get every answer in one response.
+    Staff session or an X-API-Key from STUDENT_BATCH_API_KEYS. CSRF exempt since
+    kiosks authenticate with the key; staff sessions still need the POST to be JSON.
+    """
+    if not (request.user.is_authenticated and request.user.is_staff) and not _has_batch_api_key(request):
+        return JsonResponse({'error': 'Authentication required'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    if request.content_type != 'application/json':
+        return JsonResponse({'error': 'Expected application/json'}, status=415)
+
+    try:
+        usns = json.loads(request.body).get('usns')
+    except (ValueError, AttributeError):
+        usns = None
+    if not isinstance(usns, list) or not all(isinstance(usn, str) for usn in usns):
+        return JsonResponse({'error': 'Body must be {"usns": ["<USN>", ...]}'}, status=400)
+    if len(usns) > settings.STUDENT_BATCH_MAX_USNS:
+        return JsonResponse({'error': f'At most {settings.STUDENT_BATCH_MAX_USNS} USNs per request'}, status=400)
+
+    # De-duplicate but keep the caller's order for the missing list
+    wanted = list(dict.fromkeys(usn for usn in map(normalize_usn, usns) if usn))
+
+    # One dict pass over the per-worker index, or a single IN query without it
+    found = lookup_allotments(wanted)
+    response = JsonResponse({
+        'results': found,
+        'missing': [usn for usn in wanted if usn not in found],
+    })
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+def lookup_stats(request):
+    """This worker's student lookup state and coalescing counters (each worker process has its own)."""
+    if not request.user.is_authenticated or not request.user.is_staff:
+        raise Http404
+    token, expires_at = allotment_index.state()
+    response = JsonResponse({
+        'pid': os.getpid(),
+        'index': {
+            'enabled': settings.ALLOTMENT_INDEX_ENABLED,
+            'usns': len(allotment_index),
+            'state': token,
+            'built_at': allotment_index.built_at,
+            'expires_at': expires_at,
+        },
+        'coalescing': lookup_flight.stats(),
+        'negative_filter': allotment_index.bloom_stats(),
+    })
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+def _has_metrics_token(request):
+    token = settings.METRICS_TOKEN
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+def metrics(request):
+    """Prometheus metrics of all worker processes on this host (core/metrics.py)."""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if not (request.user.is_authenticated and request.user.is_staff) and not _has_metrics_token(request):
+        raise Http404
+    response = HttpResponse(app_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+PROFILES_SHOWN = 100
+
+def profiles(request):
+    """Recent request profiles of all worker processes (core/profiling.py)."""
+    if not request.user.is_authenticated or not request.user.is_staff:
+        raise Http404
+    sort = 'slowest' if request.GET.get('sort') == 'slowest' else 'recent'
+    return render(request, 'profiles.html', {
+        'profiles': recent_profiles(PROFILES_SHOWN, sort),
+        'sort': sort,
+        'sample_percent': settings.PROFILER_SAMPLE_RATE * 100,
+        'cprofile': settings.PROFILER_CPROFILE,
+        'slow_ms': settings.PROFILER_SLOW_MS,
+    })
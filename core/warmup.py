@@ -0,0 +1,172 @@
+"""
+Warm-up ahead of a window's opening, run by `manage.py warm_up_allotments`
+(e.g. from cron 15 minutes before each exam's visible_from).
+
+When a window opens every student checks at once, while every web worker's
+allotment index goes stale at that same moment and the shard sync has
+not run yet. For the state students will see once the next window opens
+this:
+
+  * writes the allotment index snapshot that workers load instead of
+    querying SeatAllotment (core.allotment_index)
+  * writes that state's result shards, the pre-serialized responses
+    index.html fetches (core.result_shards)
+  * runs the direct lookup query for every upcoming USN, so the database has
+    seat_usn_visibility_idx and the rows in its buffers
+  * optionally requests URLs on the site to bring up fresh worker processes
+
+and reports whether all of that is ready. Snapshots and shards are local
+files, so with several hosts run it on each (or share the directories).
+A publish or window edit after the warm-up changes the state token: workers
+then just rebuild from the database as before, and the report of a new
+warm-up run shows the new state.
+"""
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .allotment_index import VERSION_KEY, build_entries, state_token, visible_windows, write_snapshot
+from .models import DataVersion, SeatAllotment, VisibilityWindow
+from .result_shards import prewrite_generation, sync_result_shards
+
+logger = logging.getLogger(__name__)
+
+TOUCH_CHUNK_SIZE = 500
+SNAPSHOT_MAX_AGE_SECONDS = 24 * 3600
+
+
+def next_opening(now, horizon):
+    """visible_from of the first active window opening within horizon, or None."""
+    return VisibilityWindow.objects.filter(
+        is_active_manual=True, visible_from__gt=now, visible_from__lte=now + horizon,
+    ).order_by('visible_from').values_list('visible_from', flat=True).first()
+
+
+def state_at(at):
+    """(version, visible windows, state token) just after `at`, as a worker rebuilding then will see it."""
+    version = DataVersion.current(VERSION_KEY)
+    # A window closing exactly at `at` is already gone for the first request after it
+    windows, _ = visible_windows(at + timedelta(microseconds=1))
+    return version, windows, state_token(version, windows)
+
+
+def touch_lookup_index(usns, at):
+    """Runs the direct lookup query for usns in chunks. Returns the number of rows read."""
+    rows = 0
+    for start in range(0, len(usns), TOUCH_CHUNK_SIZE):
+        rows += len(SeatAllotment.objects.filter(
+            usn_normalized__in=usns[start:start + TOUCH_CHUNK_SIZE],
+            visible_from__lte=at,
+            visible_until__gte=at,
+            window_active=True,
+        ).values_list('id', flat=True))
+    return rows
+
+
+def _remove_old_snapshots(keep):
+    cutoff = time.time() - SNAPSHOT_MAX_AGE_SECONDS
+    for entry in os.scandir(settings.ALLOTMENT_SNAPSHOT_DIR):
+        if entry.name != f"{keep}.json" and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+
+
+def _fetch(url, timeout):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError) as e:
+        logger.warning(f"Warm-up request to {url} failed: {e}")
+        status = None
+    return status, time.perf_counter() - started
+
+
+def ping(url, requests=4, timeout=10):
+    """
+    Sends `requests` concurrent GETs to url, so they spread over the server's
+    workers. Returns {"url", "ok", "requests", "max_ms"}; 2xx/3xx/404 count as ok.
+    """
+    with ThreadPoolExecutor(max_workers=requests) as pool:
+        results = list(pool.map(lambda _: _fetch(url, timeout), range(requests)))
+    return {
+        'url': url,
+        'ok': sum(1 for status, _ in results if status is not None and (status < 400 or status == 404)),
+        'requests': requests,
+        'max_ms': round(max(elapsed for _, elapsed in results) * 1000, 1),
+    }
+
+
+def warm_up(at=None, horizon=None, urls=(), requests=4):
+    """
+    Warms everything for the state just after `at` (default: the next window
+    opening within horizon, else the current state). Returns a report dict.
+    """
+    now = timezone.now()
+    horizon = horizon or timedelta(minutes=settings.WARMUP_HORIZON_MINUTES)
+    if at is None:
+        at = next_opening(now, horizon) or now
+    version, windows, token = state_at(at)
+    file_ids = [w['file_id'] for w in windows]
+    report = {
+        'at': at,
+        'upcoming': at > now,
+        'token': token,
+        'windows': [w['window_name'] for w in windows],
+        'usns': 0,
+        'snapshot': None,
+        'shards': None,
+        'touched_rows': 0,
+        'pings': [],
+        'timings': {},
+        'problems': [],
+    }
+    if not windows:
+        report['problems'].append(f"no window is visible at {timezone.localtime(at):%Y-%m-%d %H:%M}")
+        return report
+
+    timings = report['timings']
+    started = time.perf_counter()
+    entries = build_entries(file_ids)
+    report['usns'] = len(entries)
+    timings['entries'] = round(time.perf_counter() - started, 3)
+
+    if settings.ALLOTMENT_INDEX_ENABLED:
+        started = time.perf_counter()
+        report['snapshot'] = write_snapshot(token, entries)
+        _remove_old_snapshots(keep=token)
+        timings['snapshot'] = round(time.perf_counter() - started, 3)
+
+    if settings.RESULT_SHARDS_ENABLED:
+        started = time.perf_counter()
+        try:
+            if report['upcoming']:
+                written = prewrite_generation(token, file_ids, at)
+                report['shards'] = (f"{written[1]} USNs in {written[0]} shards" if written
+                                    else "already written")
+            else:
+                report['shards'] = sync_result_shards()
+        except OSError as e:
+            report['problems'].append(f"result shards: {e}")
+        timings['shards'] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    report['touched_rows'] = touch_lookup_index(list(entries), at)
+    timings['touch'] = round(time.perf_counter() - started, 3)
+
+    for url in urls:
+        result = ping(url, requests)
+        report['pings'].append(result)
+        if result['ok'] < result['requests']:
+            report['problems'].append(f"{url}: {result['requests'] - result['ok']} of {result['requests']} requests failed")
+
+    logger.info(f"Warm-up for {at}: {report['usns']} USNs, state {token}, {timings}")
+    return report
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'seat_allotment.settings')
+# Under ASGI the student API uses the async view so lookups never hold a worker thread
+os.environ.setdefault('ASYNC_STUDENT_LOOKUP', 'True')
 
 application = get_asgi_application()
+
+# /api/allotment skips the session/CSRF/auth middleware it does not need (see core/asgi.py)
+from core.asgi import route_student_api  # noqa: E402  (needs the app registry loaded above)
+
+application = route_student_api(application)
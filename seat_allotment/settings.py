@@ -6,6 +6,7 @@ Generated by 'django-admin startproject' using Django 5.2.1.
 
 from pathlib import Path
 import os
+import tempfile
 from urllib.parse import urlparse, parse_qs
 
 # --------------------------------------------------
@@ -52,8 +53,12 @@ INSTALLED_APPS = [
 # --------------------------------------------------
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.QueryCountMiddleware',
+    'core.middleware.ProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'core.middleware.StaticFilesMiddleware',
+    'core.middleware.ResultShardMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -174,6 +179,179 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 
+# --------------------------------------------------
+# STUDENT LOOKUP
+# --------------------------------------------------
+
+# Route /api/allotment to the async view; asgi.py turns this on (see start_asgi.sh)
+ASYNC_STUDENT_LOOKUP = os.environ.get('ASYNC_STUDENT_LOOKUP', 'False') == 'True'
+
+# Middleware for /api/allotment under ASGI (core/asgi.py); must all be async capable
+STUDENT_API_MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.QueryCountMiddleware',
+    'core.middleware.ProfilerMiddleware',
+    'core.middleware.RateLimitMiddleware',
+]
+
+# Serve /api/allotment from a per-worker in-memory index instead of the DB
+ALLOTMENT_INDEX_ENABLED = os.environ.get('ALLOTMENT_INDEX_ENABLED', 'True') == 'True'
+
+# How often (seconds) each worker checks the shared version stamp for new publishes
+ALLOTMENT_INDEX_CHECK_INTERVAL = float(os.environ.get('ALLOTMENT_INDEX_CHECK_INTERVAL', '2'))
+
+# With the index disabled, concurrent DB lookups of the same USN share one query
+# (core/singleflight.py), and the result is reused for this many seconds
+# (0 = only share in-flight queries) for up to LOOKUP_COALESCE_MAX_KEYS USNs
+LOOKUP_COALESCE_TTL = float(os.environ.get('LOOKUP_COALESCE_TTL', '2'))
+LOOKUP_COALESCE_MAX_KEYS = int(os.environ.get('LOOKUP_COALESCE_MAX_KEYS', '10000'))
+
+# With the index disabled, a Bloom filter of the visible USNs answers most lookups
+# of unknown USNs (typos, unpublished exams) without a query (core/bloom.py).
+# LOOKUP_BLOOM_FP_RATE is the share of unknown USNs still sent to the DB; the
+# filter never grows past LOOKUP_BLOOM_MAX_BYTES (the rate rises instead)
+LOOKUP_BLOOM_ENABLED = os.environ.get('LOOKUP_BLOOM_ENABLED', 'True') == 'True'
+LOOKUP_BLOOM_FP_RATE = float(os.environ.get('LOOKUP_BLOOM_FP_RATE', '0.01'))
+LOOKUP_BLOOM_MAX_BYTES = int(os.environ.get('LOOKUP_BLOOM_MAX_BYTES', str(4 * 1024 * 1024)))
+
+# Index snapshots written by `manage.py warm_up_allotments` ahead of a window
+# opening, loaded by workers instead of querying (core/warmup.py)
+ALLOTMENT_SNAPSHOT_DIR = Path(os.environ.get('ALLOTMENT_SNAPSHOT_DIR', BASE_DIR / 'snapshots'))
+# How far ahead warm_up_allotments looks for the next window opening
+WARMUP_HORIZON_MINUTES = int(os.environ.get('WARMUP_HORIZON_MINUTES', '60'))
+
+# Cache-Control max-age (seconds) for /api/allotment hits and misses; always capped
+# at the time left until the visible windows change
+STUDENT_API_MAX_AGE = int(os.environ.get('STUDENT_API_MAX_AGE', '60'))
+STUDENT_API_MISS_MAX_AGE = int(os.environ.get('STUDENT_API_MISS_MAX_AGE', '10'))
+
+# Per-path rate limits: path -> (requests, window seconds) per client IP, counted
+# with a sliding window shared by all workers on the host (core/ratelimit.py)
+RATE_LIMITS = {
+    '/api/allotment': (
+        int(os.environ.get('RATE_LIMIT_LOOKUPS', '10')),
+        int(os.environ.get('RATE_LIMIT_WINDOW', '60')),
+    ),
+    # Each call answers up to STUDENT_BATCH_MAX_USNS USNs
+    '/api/allotment/batch': (
+        int(os.environ.get('RATE_LIMIT_BATCH', '60')),
+        int(os.environ.get('RATE_LIMIT_WINDOW', '60')),
+    ),
+}
+# Memory-mapped counter table; must be on a local filesystem all workers can reach
+RATE_LIMIT_FILE = Path(os.environ.get('RATE_LIMIT_FILE', Path(tempfile.gettempdir()) / 'seat_allotment_ratelimit.bin'))
+RATE_LIMIT_TABLE_SLOTS = int(os.environ.get('RATE_LIMIT_TABLE_SLOTS', '65536'))
+
+# Conditional requests (If-None-Match) are usually cheap 304s, so they may go this
+# many times over the normal rate limit before being rejected
+RATE_LIMIT_REVALIDATE_FACTOR = int(os.environ.get('RATE_LIMIT_REVALIDATE_FACTOR', '3'))
+
+# POST /api/allotment/batch (help-desk kiosks): staff session or one of these
+# keys in X-API-Key, comma separated
+STUDENT_BATCH_API_KEYS = [k.strip() for k in os.environ.get('STUDENT_BATCH_API_KEYS', '').split(',') if k.strip()]
+STUDENT_BATCH_MAX_USNS = int(os.environ.get('STUDENT_BATCH_MAX_USNS', '300'))
+
+# Report the SQL query count of every request in an X-DB-Queries header
+# (core.middleware.QueryCountMiddleware); the load test turns this on for its servers
+QUERY_COUNT_HEADER = os.environ.get('QUERY_COUNT_HEADER', 'False') == 'True'
+
+# Pre-rendered per-USN-prefix result files (core/result_shards.py), served by
+# core.middleware.ResultShardMiddleware without touching views or the DB
+RESULT_SHARDS_ENABLED = os.environ.get('RESULT_SHARDS_ENABLED', 'True') == 'True'
+RESULT_SHARDS_ROOT = Path(os.environ.get('RESULT_SHARDS_ROOT', BASE_DIR / 'results'))
+RESULT_SHARDS_URL = '/results/'
+# Cache lifetime of manifest.json; shard files live in per-generation directories and are immutable
+RESULT_SHARDS_MANIFEST_MAX_AGE = int(os.environ.get('RESULT_SHARDS_MANIFEST_MAX_AGE', '5'))
+
+
+# --------------------------------------------------
+# UPLOAD PARSING
+# --------------------------------------------------
+
+# 'streaming' reads the .docx XML incrementally (core.parser.iter_exam_pages) and
+# falls back to python-docx if it fails; 'python-docx' always uses the original parser
+DOCX_PARSER = os.environ.get('DOCX_PARSER', 'streaming')
+
+# Multi-file uploads are parsed in a pool of this many processes (1 = parse serially
+# in the request). Shared by all requests in a web worker process.
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Uploads are parsed by ParseJobs (core/jobs.py). 'inline' (default): parsed
+# inside the upload request. 'background': the upload returns at once and
+# `manage.py run_parse_worker` parses it; only set this where that process runs
+# (the Procfile's worker), since build.sh and a web-only service start none and
+# uploads would stay queued
+PARSE_JOBS_MODE = os.environ.get('PARSE_JOBS_MODE', 'inline')
+PARSE_JOB_MAX_ATTEMPTS = int(os.environ.get('PARSE_JOB_MAX_ATTEMPTS', '3'))
+# A running job whose worker has not sent a heartbeat for this long is re-queued
+PARSE_JOB_STALE_SECONDS = int(os.environ.get('PARSE_JOB_STALE_SECONDS', '120'))
+PARSE_JOB_HEARTBEAT_SECONDS = int(os.environ.get('PARSE_JOB_HEARTBEAT_SECONDS', '10'))
+# First retry delay after an unexpected error, doubled on every further attempt
+PARSE_JOB_RETRY_DELAY = int(os.environ.get('PARSE_JOB_RETRY_DELAY', '30'))
+
+# Publish copies staged records into SeatAllotment in INSERT ... SELECT chunks of
+# this many rows (core.staging.publish_batch), all inside one transaction
+PUBLISH_CHUNK_SIZE = int(os.environ.get('PUBLISH_CHUNK_SIZE', '5000'))
+
+# Raw parsed table rows of published uploads: 'compressed' keeps them once per
+# upload in a zlib-compressed side table (core/raw_rows.py), 'drop' discards them
+RAW_ROWS_STORAGE = os.environ.get('RAW_ROWS_STORAGE', 'compressed')
+
+
+# --------------------------------------------------
+# EXPIRY
+# --------------------------------------------------
+
+# Expired uploads, stale staging batches, unused parse cache rows and orphaned
+# upload files are removed by `manage.py expire_allotments` (core/expiry.py).
+# The parse worker also runs it every EXPIRY_INTERVAL_SECONDS while idle
+# (0 = never), but that process only runs with PARSE_JOBS_MODE = 'background':
+# with the 'inline' default (and with build.sh) nothing expires unless
+# expire_allotments is scheduled, e.g. hourly from cron
+EXPIRY_INTERVAL_SECONDS = int(os.environ.get('EXPIRY_INTERVAL_SECONDS', '3600'))
+# Rows deleted per transaction
+EXPIRY_BATCH_SIZE = int(os.environ.get('EXPIRY_BATCH_SIZE', '2000'))
+# Uploads are deleted this long after their visibility window closes
+EXPIRY_GRACE_HOURS = int(os.environ.get('EXPIRY_GRACE_HOURS', '0'))
+# Unpublished previews are discarded after this long
+STAGING_BATCH_MAX_AGE_HOURS = int(os.environ.get('STAGING_BATCH_MAX_AGE_HOURS', '24'))
+# Newer files may belong to an upload still being saved
+ORPHAN_FILE_MIN_AGE_SECONDS = int(os.environ.get('ORPHAN_FILE_MIN_AGE_SECONDS', '3600'))
+
+
+# --------------------------------------------------
+# METRICS
+# --------------------------------------------------
+
+# Prometheus metrics (core/metrics.py) at /metrics, for staff sessions or
+# scrapers sending "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Every process writes its samples here (one file per process) at most every
+# METRICS_FLUSH_SECONDS; must be a local directory all workers can reach
+METRICS_DIR = Path(os.environ.get('METRICS_DIR', Path(tempfile.gettempdir()) / 'seat_allotment_metrics'))
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '5'))
+
+
+# --------------------------------------------------
+# PROFILING
+# --------------------------------------------------
+
+# Share of requests profiled by core.middleware.ProfilerMiddleware (core/profiling.py),
+# e.g. 0.01 for 1%; 0 = off. Profiles are listed on the staff page dashboard/profiles/
+PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', '0'))
+# Also run sampled requests under cProfile, keeping the output of those taking
+# at least PROFILER_SLOW_MS (roughly doubles the time of the sampled requests)
+PROFILER_CPROFILE = os.environ.get('PROFILER_CPROFILE', 'False') == 'True'
+PROFILER_SLOW_MS = int(os.environ.get('PROFILER_SLOW_MS', '500'))
+# SQL statements kept per profile; further ones are only counted
+PROFILER_MAX_QUERIES = int(os.environ.get('PROFILER_MAX_QUERIES', '100'))
+# One rotating JSON-lines log per process
+PROFILER_DIR = Path(os.environ.get('PROFILER_DIR', Path(tempfile.gettempdir()) / 'seat_allotment_profiles'))
+PROFILER_LOG_MAX_BYTES = int(os.environ.get('PROFILER_LOG_MAX_BYTES', str(1024 * 1024)))
+PROFILER_LOG_BACKUPS = int(os.environ.get('PROFILER_LOG_BACKUPS', '3'))
+
+
 # --------------------------------------------------
 # DEFAULT PRIMARY KEY
 # --------------------------------------------------
@@ -15,11 +15,19 @@ urlpatterns = [
     # Admin Dashboard & Operations
     path('dashboard/', views.admin_dashboard, name='admin_dashboard'),
     path('upload/', views.upload_file, name='upload_file'),
+    path('upload/jobs/<int:job_id>/', views.parse_job_status, name='parse_job_status'),
+    path('upload/jobs/<int:job_id>/open/', views.open_parse_job, name='open_parse_job'),
     path('preview/', views.preview_data, name='preview_data'),
+    path('preview/api/pages', views.preview_pages_api, name='preview_pages_api'),
+    path('preview/api/records', views.preview_records_api, name='preview_records_api'),
     path('delete/<int:upload_id>/', views.delete_upload, name='delete_upload'),
+    path('dashboard/lookup-stats/', views.lookup_stats, name='lookup_stats'),
+    path('dashboard/profiles/', views.profiles, name='profiles'),
+    path('metrics', views.metrics, name='metrics'),
     
     # Student API
-    path('api/allotment', views.student_lookup, name='student_lookup'),
+    path('api/allotment', views.student_lookup_async if settings.ASYNC_STUDENT_LOOKUP else views.student_lookup, name='student_lookup'),
+    path('api/allotment/batch', views.student_batch_lookup, name='student_batch_lookup'),
 
     # Default Admin - Re-enabled per user request
     path('secret_admin_dashboard_99/', admin.site.urls),
@@ -0,0 +1,12 @@
+#!/usr/bin/env bash
+# ASGI serving profile: uvicorn workers running the async student lookup
+# (asgi.py sets ASYNC_STUDENT_LOOKUP=True). Use instead of the Procfile's
+# gunicorn sync workers when many concurrent lookups must stay in flight.
+#   WEB_CONCURRENCY  number of worker processes (default 2)
+#   PORT             listen port (default 8000)
+
+exec uvicorn seat_allotment.asgi:application \
+    --host 0.0.0.0 \
+    --port "${PORT:-8000}" \
+    --workers "${WEB_CONCURRENCY:-2}" \
+    --no-access-log